@@ -24,6 +24,7 @@ from audio.audio_generate import audio_generate
 from client.clientfactory import Clientfactory
 from env import get_env_value
 from model.RAG.retrieve_model import INSTANCE as RAG_INSTANCE
+from model.warmup import warm_up_in_background
 from qa.answer import get_answer
 from qa.function_tool import process_image_describe_tool
 from qa.purpose_type import userPurposeType
@@ -2171,7 +2172,15 @@ def start_gradio():
         fallback_text = selected_port if selected_port is not None else "auto"
         print(f"[gradio] Desired port {desired_port} is busy, switching to {fallback_text}")
 
-    demo.launch(server_port=selected_port, server_name=host, share=share)
+    # 端口绑定完成后再在后台预热向量化模型、知识库索引和知识图谱，只聊天的用户无需等待
+    demo.launch(
+        server_port=selected_port,
+        server_name=host,
+        share=share,
+        prevent_thread_lock=True,
+    )
+    warm_up_in_background()
+    demo.block_thread()
 
 
 if __name__ == "__main__":
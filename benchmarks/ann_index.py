@@ -0,0 +1,128 @@
+'''
+近似检索索引的召回率-延迟测试：以 flat 精确检索的结果为基准，比较 ivf-flat / hnsw / ivf-pq 在不同 nprobe / efSearch 下的 recall@k 与单条查询延迟
+
+用法（在项目根目录执行）：
+    python -m benchmarks.ann_index --synthetic 200000
+    python -m benchmarks.ann_index --index-path ./konwledge-base.index
+'''
+import argparse
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+from langchain_community.vectorstores.faiss import dependable_faiss_import
+
+from model.RAG.index_factory import (
+    DEFAULT_INDEX_CONFIG,
+    apply_search_params,
+    create_index,
+    is_untrained,
+    min_training_samples,
+)
+
+
+def load_vectors(index_path: str) -> np.ndarray:
+    """从已构建的知识库索引中取出全部向量，需为 flat 索引"""
+    faiss = dependable_faiss_import()
+    index = faiss.read_index(f"{index_path}/index.faiss")
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def synthetic_vectors(n: int, dim: int, seed: int = 0) -> np.ndarray:
+    """围绕若干中心生成的带聚类结构的向量，比均匀随机向量更接近真实文本向量的分布"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(1, n // 500), dim)).astype(np.float32)
+    labels = rng.integers(0, len(centers), size=n)
+    return centers[labels] + 0.3 * rng.normal(size=(n, dim)).astype(np.float32)
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(row) & set(expected)) for row, expected in zip(found, truth))
+    return hits / truth.size
+
+
+def timed_search(index, queries: np.ndarray, k: int) -> Tuple[np.ndarray, float, float]:
+    """逐条查询以得到与线上一致的单次延迟，返回 (结果, p50毫秒, p95毫秒)"""
+    results, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        _, ids = index.search(query.reshape(1, -1), k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append(ids[0])
+    return np.array(results), float(np.percentile(latencies, 50)), float(np.percentile(latencies, 95))
+
+
+def benchmark_configs(args) -> List[Dict]:
+    configs = [{"type": "flat"}]
+    for nprobe in args.nprobe:
+        configs.append({"type": "ivf-flat", "nlist": args.nlist, "nprobe": nprobe})
+    for ef_search in args.ef_search:
+        configs.append({"type": "hnsw", "ef-search": ef_search})
+    for nprobe in args.nprobe:
+        configs.append({"type": "ivf-pq", "nlist": args.nlist, "nprobe": nprobe, "pq-m": args.pq_m})
+    return [{**DEFAULT_INDEX_CONFIG, "train-size": args.train_size, **config} for config in configs]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index-path", help="已构建的 flat 知识库索引目录")
+    parser.add_argument("--synthetic", type=int, default=100000, help="未指定索引目录时生成的向量条数")
+    parser.add_argument("--dim", type=int, default=768, help="合成向量的维度")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("-k", type=int, default=6)
+    parser.add_argument("--nlist", type=int, default=1024)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 16, 64])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[32, 64, 128])
+    parser.add_argument("--pq-m", type=int, default=16)
+    parser.add_argument("--train-size", type=int, default=50000)
+    args = parser.parse_args()
+
+    faiss = dependable_faiss_import()
+    vectors = load_vectors(args.index_path) if args.index_path else synthetic_vectors(args.synthetic, args.dim)
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    # 查询取自语料中的向量并加入少量噪声，模拟与知识库内容相近的提问
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.choice(len(vectors), args.queries, replace=False)]
+    queries = queries + 0.05 * rng.normal(size=queries.shape).astype(np.float32)
+    print(f"语料 {len(vectors)} 条, 维度 {vectors.shape[1]}, 查询 {len(queries)} 条, k={args.k}")
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, args.k)
+
+    print(f"{'type':<10}{'params':<16}{'build(s)':>10}{'memory(MB)':>12}{'recall@k':>10}{'p50(ms)':>10}{'p95(ms)':>10}")
+    built = {}
+    for config in benchmark_configs(args):
+        # 同一类型只构建一次，只调整检索参数
+        key = config["type"]
+        if key not in built:
+            start = time.perf_counter()
+            index = create_index(vectors, config)
+            if is_untrained(index, config):
+                # 语料不足以训练时 create_index 返回 flat 索引，其结果不能代表该索引类型
+                print(f"{key}: 语料少于训练所需的 {min_training_samples(config)} 条，跳过")
+                built[key] = None
+                continue
+            index.add(vectors)
+            built[key] = (index, time.perf_counter() - start)
+        if built[key] is None:
+            continue
+        index, build_seconds = built[key]
+        apply_search_params(index, config)
+
+        found, p50, p95 = timed_search(index, queries, args.k)
+        memory_mb = faiss.serialize_index(index).nbytes / 1024 / 1024
+        if key == "hnsw":
+            params = f"efSearch={config['ef-search']}"
+        elif key.startswith("ivf"):
+            params = f"nprobe={config['nprobe']}"
+        else:
+            params = "-"
+        print(
+            f"{key:<10}{params:<16}{build_seconds:>10.2f}{memory_mb:>12.1f}"
+            f"{recall_at_k(found, truth):>10.3f}{p50:>10.3f}{p95:>10.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+'''
+向量检索、BM25 检索与两者倒数排名融合的命中率与延迟对比
+
+问题集为 jsonl，每行 {"question": "...", "answer": "应出现在检索结果中的原文片段"}；
+未提供问题集时，从索引中随机抽取块，截取其中含编码、剂量等英文数字词的短句作为问题，命中即检索结果包含该块。
+
+用法（在项目根目录执行，需先构建好知识库索引）：
+    python -m benchmarks.hybrid_retrieval --questions data/eval/questions.jsonl
+    python -m benchmarks.hybrid_retrieval --sample 300
+'''
+import argparse
+import json
+import random
+import re
+import time
+from typing import Callable, List, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from config.config import Config
+from model.Embedding.embedding_service import get_embedding
+from model.RAG.hybrid_retriever import HybridRetriever
+from model.RAG.index_store import IndexStore
+from model.RAG.lexical_index import LexicalIndex
+
+_ASCII_TERM = re.compile(r"[A-Za-z0-9]+(?:[.\-/][A-Za-z0-9]+)*")
+
+
+def load_questions(path: str) -> List[Tuple[str, str]]:
+    with open(path, "r", encoding="utf-8") as f:
+        items = [json.loads(line) for line in f if line.strip()]
+    return [(item["question"], item["answer"]) for item in items]
+
+
+def sample_questions(vectorstore, n: int, seed: int = 0) -> List[Tuple[str, str]]:
+    """以块中含英文数字词的一小段原文作为问题，答案为该块本身"""
+    rng = random.Random(seed)
+    chunk_ids = list(vectorstore.index_to_docstore_id.values())
+    rng.shuffle(chunk_ids)
+    questions = []
+    for chunk_id in chunk_ids:
+        text = vectorstore.docstore.search(chunk_id).page_content
+        terms = [m for m in _ASCII_TERM.finditer(text) if len(m.group()) >= 3]
+        if not terms:
+            continue
+        term = rng.choice(terms)
+        start = max(0, term.start() - rng.randint(4, 12))
+        questions.append((text[start:term.end() + rng.randint(0, 8)], text))
+        if len(questions) >= n:
+            break
+    return questions
+
+
+def evaluate(search: Callable[[str], List[Document]], questions: List[Tuple[str, str]]):
+    hits, reciprocal_ranks, latencies = 0, [], []
+    for question, answer in questions:
+        start = time.perf_counter()
+        docs = search(question)
+        latencies.append((time.perf_counter() - start) * 1000)
+        rank = next((i for i, doc in enumerate(docs) if answer in doc.page_content), None)
+        hits += rank is not None
+        reciprocal_ranks.append(0.0 if rank is None else 1.0 / (rank + 1))
+    return (
+        hits / len(questions),
+        float(np.mean(reciprocal_ranks)),
+        float(np.percentile(latencies, 50)),
+        float(np.percentile(latencies, 95)),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index-path", help="知识库索引目录，默认为配置中知识库目录旁的 .index")
+    parser.add_argument("--questions", help="问题集 jsonl 文件")
+    parser.add_argument("--sample", type=int, default=200, help="未提供问题集时自动抽取的问题数")
+    parser.add_argument("-k", type=int, default=6)
+    parser.add_argument("--fetch-k", type=int, default=20)
+    parser.add_argument("--rrf-k", type=int, default=60)
+    args = parser.parse_args()
+
+    index_store = (
+        IndexStore(args.index_path)
+        if args.index_path
+        else IndexStore.beside(Config.get_instance().get_with_nested_params("Knowledge-base-path"))
+    )
+    vectorstore = index_store.load(get_embedding(), mmap=False)
+    if vectorstore is None:
+        raise SystemExit(f"没有找到索引 {index_store.index_path}，请先构建知识库")
+    start = time.perf_counter()
+    lexical_index = index_store.load_lexical() or LexicalIndex.from_texts(
+        vectorstore.index_to_docstore_id.values(),
+        (vectorstore.docstore.search(i).page_content for i in vectorstore.index_to_docstore_id.values()),
+    )
+    print(
+        f"块数 {vectorstore.index.ntotal}, 倒排索引 {lexical_index.nbytes / 1024 / 1024:.1f}MB, "
+        f"加载/构建 {time.perf_counter() - start:.2f}s"
+    )
+
+    questions = load_questions(args.questions) if args.questions else sample_questions(vectorstore, args.sample)
+    print(f"问题数 {len(questions)}, k={args.k}")
+
+    dense = vectorstore.as_retriever(search_kwargs={"k": args.k})
+    hybrid = HybridRetriever(
+        vectorstore=vectorstore,
+        lexical_index=lexical_index,
+        search_kwargs={"k": args.k},
+        fetch_k=args.fetch_k,
+        rrf_k=args.rrf_k,
+    )
+
+    def lexical(query: str) -> List[Document]:
+        return [vectorstore.docstore.search(i) for i, _ in lexical_index.search(query, args.k)]
+
+    print(f"{'method':<10}{'hit@k':>8}{'MRR':>8}{'p50(ms)':>10}{'p95(ms)':>10}")
+    for name, search in (("dense", dense.invoke), ("bm25", lexical), ("hybrid", hybrid.invoke)):
+        hit_rate, mrr, p50, p95 = evaluate(search, questions)
+        print(f"{name:<10}{hit_rate:>8.3f}{mrr:>8.3f}{p50:>10.2f}{p95:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+'''
+知识图谱实体自动机的内存测试：比较自动机中保存完整节点字典（原做法）与只保存整数ID、属性集中存入属性表的内存占用，
+快照大小以及单条问题的匹配延迟
+
+用法（在项目根目录执行）：
+    python -m benchmarks.kg_entities --synthetic 100000
+    python -m benchmarks.kg_entities --neo4j
+'''
+import argparse
+import gc
+import pickle
+import random
+import time
+import tracemalloc
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+import ahocorasick as pyahocorasick
+
+from model.KG.entity_table import EntityTableBuilder
+
+
+def synthetic_entities(n: int, seed: int = 0) -> Iterator[Dict]:
+    """逐个生成与医疗图谱节点相近的实体：名称加若干段中文描述属性"""
+    rng = random.Random(seed)
+    chars = "的一是病症状治疗药物检查患者血压糖尿肺炎感染发热咳嗽头痛慢性急性儿童老年饮食注意事项预防"
+    labels = ["疾病", "症状", "药物", "检查手段", "食物"]
+
+    def text(size: int) -> str:
+        return "".join(rng.choices(chars, k=size))
+
+    for i in range(n):
+        yield {
+            "label": labels[i % len(labels)],
+            "名称": f"{text(rng.randint(2, 6))}{i}",
+            "描述": text(rng.randint(80, 300)),
+            "预防": text(rng.randint(20, 120)),
+            "病因": text(rng.randint(20, 120)),
+            "治疗周期": f"{rng.randint(1, 90)}天",
+        }
+
+
+def graph_entities() -> Iterator[Dict]:
+    from model.KG.data_utils import NodeEntities
+
+    return NodeEntities().get_entities_iterator()
+
+
+def build_dicts(entities: Iterable[Dict], key: str):
+    # 原做法：每个词的值为 (序号, 完整节点字典)
+    automaton = pyahocorasick.Automaton()
+    for i, entity in enumerate(entities):
+        automaton.add_word(entity[key], (i, entity))
+    automaton.make_automaton()
+    return automaton, None
+
+
+def build_compact(entities: Iterable[Dict], key: str):
+    automaton = pyahocorasick.Automaton(pyahocorasick.STORE_INTS)
+    table = EntityTableBuilder()
+    for entity in entities:
+        automaton.add_word(entity[key], table.add(entity))
+    automaton.make_automaton()
+    return automaton, table.build()
+
+
+def measure(build: Callable, entities: Callable[[], Iterator[Dict]], key: str) -> Tuple[object, float]:
+    """
+    返回 (模型, 构建后常驻内存MB)。实体与线上一样逐个生成后交给构建函数，
+    常驻内存中只包含模型自己持有的对象（自动机的节点不经过 Python 的内存分配器，不计入）。
+    """
+    gc.collect()
+    tracemalloc.start()
+    model = build(entities(), key)
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return model, current / 1024 / 1024
+
+
+def match_latency(model, queries: List[str]) -> float:
+    automaton, table = model
+    start = time.perf_counter()
+    for query in queries:
+        for _, value in automaton.iter(query):
+            if table is not None:
+                table.get(value)
+    return (time.perf_counter() - start) / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--neo4j", action="store_true", help="从配置的 Neo4j 读取全部节点")
+    parser.add_argument("--synthetic", type=int, default=100000, help="不读取 Neo4j 时生成的实体数")
+    parser.add_argument("--search-key", default="名称")
+    parser.add_argument("--queries", type=int, default=1000)
+    args = parser.parse_args()
+
+    entities = graph_entities if args.neo4j else lambda: synthetic_entities(args.synthetic)
+    names = [entity[args.search_key] for entity in entities()]
+    rng = random.Random(1)
+    sample = rng.sample(names, min(args.queries, len(names)))
+    queries = [f"请问{a}和{b}有什么关系，平时需要注意什么" for a, b in zip(sample, reversed(sample))]
+    print(f"实体 {len(names)} 个, 查询 {len(queries)} 条")
+    del names
+
+    print(f"{'layout':<10}{'memory(MB)':>12}{'snapshot(MB)':>14}{'load(s)':>9}{'match(ms)':>11}")
+    for name, build in (("dict", build_dicts), ("compact", build_compact)):
+        model, memory_mb = measure(build, entities, args.search_key)
+        snapshot = pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL)
+        start = time.perf_counter()
+        pickle.loads(snapshot)
+        load_seconds = time.perf_counter() - start
+        print(
+            f"{name:<10}{memory_mb:>12.1f}{len(snapshot) / 1024 / 1024:>14.1f}{load_seconds:>9.2f}"
+            f"{match_latency(model, queries):>11.3f}"
+        )
+        del model
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+'''
+向量存储精度的内存-延迟-召回率测试：以 float32 flat 精确检索的结果为基准，
+比较各索引类型在 float32 / fp16 / sq8 / pq 存储下的索引大小、单条查询延迟与 recall@k
+
+用法（在项目根目录执行）：
+    python -m benchmarks.vector_storage --synthetic 200000
+    python -m benchmarks.vector_storage --index-path ./konwledge-base.index --types flat hnsw
+'''
+import argparse
+import time
+
+import numpy as np
+from langchain_community.vectorstores.faiss import dependable_faiss_import
+
+from benchmarks.ann_index import load_vectors, recall_at_k, synthetic_vectors, timed_search
+from model.RAG.index_factory import (
+    DEFAULT_INDEX_CONFIG,
+    STORAGE_TYPES,
+    create_index,
+    is_untrained,
+    min_training_samples,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index-path", help="已构建的知识库索引目录（float32 flat 索引）")
+    parser.add_argument("--synthetic", type=int, default=100000, help="未指定索引目录时生成的向量条数")
+    parser.add_argument("--dim", type=int, default=768, help="合成向量的维度")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("-k", type=int, default=6)
+    parser.add_argument("--types", nargs="+", default=["flat", "hnsw", "ivf-flat"])
+    parser.add_argument("--storage", nargs="+", default=list(STORAGE_TYPES))
+    parser.add_argument("--nlist", type=int, default=1024)
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--ef-search", type=int, default=64)
+    parser.add_argument("--pq-m", type=int, default=16)
+    parser.add_argument("--train-size", type=int, default=50000)
+    args = parser.parse_args()
+
+    faiss = dependable_faiss_import()
+    vectors = load_vectors(args.index_path) if args.index_path else synthetic_vectors(args.synthetic, args.dim)
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    # 查询取自语料中的向量并加入少量噪声，模拟与知识库内容相近的提问
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.choice(len(vectors), args.queries, replace=False)]
+    queries = queries + 0.05 * rng.normal(size=queries.shape).astype(np.float32)
+    print(f"语料 {len(vectors)} 条, 维度 {vectors.shape[1]}, 查询 {len(queries)} 条, k={args.k}")
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, args.k)
+    baseline_mb = faiss.serialize_index(exact).nbytes / 1024 / 1024
+
+    print(
+        f"{'type':<10}{'storage':<10}{'build(s)':>10}{'memory(MB)':>12}{'vs f32':>8}"
+        f"{'recall@k':>10}{'p50(ms)':>10}{'p95(ms)':>10}"
+    )
+    for index_type in args.types:
+        for storage in args.storage:
+            config = {
+                **DEFAULT_INDEX_CONFIG,
+                "type": index_type,
+                "storage": storage,
+                "nlist": args.nlist,
+                "nprobe": args.nprobe,
+                "ef-search": args.ef_search,
+                "pq-m": args.pq_m,
+                "train-size": args.train_size,
+            }
+            start = time.perf_counter()
+            index = create_index(vectors, config)
+            if is_untrained(index, config):
+                # 语料不足以训练时 create_index 返回 float32 flat 索引，其结果不能代表该存储方式
+                print(f"{index_type}/{storage}: 语料少于训练所需的 {min_training_samples(config)} 条，跳过")
+                continue
+            index.add(vectors)
+            build_seconds = time.perf_counter() - start
+
+            found, p50, p95 = timed_search(index, queries, args.k)
+            memory_mb = faiss.serialize_index(index).nbytes / 1024 / 1024
+            print(
+                f"{index_type:<10}{storage:<10}{build_seconds:>10.2f}{memory_mb:>12.1f}"
+                f"{memory_mb / baseline_mb:>8.2f}{recall_at_k(found, truth):>10.3f}{p50:>10.3f}{p95:>10.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
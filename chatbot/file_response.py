@@ -0,0 +1,141 @@
+'''用户文件的下载响应：支持 ETag / Last-Modified 条件请求与单区间 Range 请求，可交给前置 nginx / Apache 用 sendfile 发送'''
+import os
+import re
+from typing import Optional, Tuple
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+_BLOCK_SIZE = 64 * 1024
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """解析 Range 请求头，返回闭区间 (start, end)；不支持的格式（如多区间）返回None，按完整文件响应"""
+    if not header:
+        return None
+    match = _RANGE.match(header.strip())
+    if match is None:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if size == 0:
+        # 空文件没有可满足的区间
+        raise RangeNotSatisfiable()
+    if not start:
+        # bytes=-N 表示最后 N 个字节
+        length = int(end)
+        if length == 0:
+            raise RangeNotSatisfiable()
+        return max(0, size - length), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise RangeNotSatisfiable()
+    return start, end
+
+
+def _strip_weak(etag: str) -> str:
+    return etag[2:] if etag.startswith("W/") else etag
+
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    """If-None-Match 使用弱比较，忽略 W/ 前缀"""
+    if not header:
+        return False
+    etags = parse_etags(header)
+    return "*" in etags or _strip_weak(etag) in (_strip_weak(e) for e in etags)
+
+
+def _not_modified(request, etag: str, mtime: int) -> bool:
+    if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+    if if_none_match is not None:
+        # 同时带有两个条件时以 If-None-Match 为准
+        return _etag_matches(if_none_match, etag)
+    since = parse_http_date_safe(request.META.get("HTTP_IF_MODIFIED_SINCE", ""))
+    return since is not None and int(mtime) <= since
+
+
+def _range_applies(request, etag: str, mtime: int) -> bool:
+    """If-Range 与当前文件一致时才按区间响应，否则返回完整文件"""
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/"')):
+        return if_range == etag and not etag.startswith("W/")
+    # If-Range 中的日期须与 Last-Modified 完全相同（RFC 7233 3.2），不能按早于该日期判断
+    last_modified = parse_http_date_safe(if_range)
+    return last_modified is not None and int(mtime) == last_modified
+
+
+def _read_range(path: str, start: int, length: int):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(_BLOCK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def serve_file(
+    request, path: str, content_type: str, sha256: Optional[str] = None, accel_path: Optional[str] = None
+) -> HttpResponse:
+    """
+    sha256 为文件内容哈希，作为强 ETag；未知时用大小与修改时间生成弱 ETag。
+    settings.USER_FILE_SERVE_MODE 为 x-accel-redirect（nginx，使用 accel_path）或 x-sendfile（Apache / lighttpd，使用文件绝对路径）时，
+    Django 只处理条件请求，文件内容与 Range 由前置服务器发送。
+    """
+    stat = os.stat(path)
+    mtime = int(stat.st_mtime)
+    etag = f'"{sha256}"' if sha256 else f'W/"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+    headers = {
+        "ETag": etag,
+        "Last-Modified": http_date(mtime),
+        "Cache-Control": "private, no-cache",
+        "Accept-Ranges": "bytes",
+    }
+    if _not_modified(request, etag, mtime):
+        response = HttpResponseNotModified()
+        for name, value in headers.items():
+            response[name] = value
+        return response
+
+    mode = getattr(settings, "USER_FILE_SERVE_MODE", "") or ""
+    if mode == "x-accel-redirect" and accel_path:
+        response = HttpResponse(content_type=content_type)
+        response["X-Accel-Redirect"] = quote(accel_path)
+    elif mode == "x-sendfile":
+        response = HttpResponse(content_type=content_type)
+        response["X-Sendfile"] = os.path.abspath(path)
+    else:
+        try:
+            byte_range = parse_range(request.META.get("HTTP_RANGE"), stat.st_size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{stat.st_size}"
+            return response
+        if byte_range is not None and _range_applies(request, etag, mtime):
+            start, end = byte_range
+            length = end - start + 1
+            response = StreamingHttpResponse(
+                _read_range(path, start, length), status=206, content_type=content_type
+            )
+            response["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+            response["Content-Length"] = str(length)
+        else:
+            # 完整文件交给 FileResponse，WSGI 服务器支持时会用 sendfile 发送
+            response = FileResponse(open(path, "rb"), content_type=content_type)
+
+    for name, value in headers.items():
+        response[name] = value
+    return response
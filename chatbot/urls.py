@@ -6,7 +6,9 @@ urlpatterns=[
     # 原有的API端点
     path('api/login/', view.login, name='login'),
     path('api/register/', view.register, name='register'),
+    path('api/ready/', view.ready, name='ready'),
     path('upload/', knowledge.build_knowledge_view, name='upload_file'),
+    path('upload/status/', knowledge.build_status_view, name='build_status'),
     path('files/', knowledge.list_uploaded_files, name='list_files'),
     path('files/<str:filename>/', knowledge.delete_file, name='delete_file'),
     path('view_file/<str:filename>/', knowledge.view_uploaded_file_view, name='view_uploaded_file'),
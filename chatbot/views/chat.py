@@ -6,8 +6,7 @@ from django.shortcuts import redirect
 from fastapi import FastAPI
 from django.http import HttpResponse
 from django.core.handlers.asgi import ASGIHandler
-from model.RAG.retrieve_model import Retrievemodel
-INSTANCE = Retrievemodel()
+from model.RAG.retrieve_model import INSTANCE
 # from app import start_gradio
 import threading
 
@@ -1,20 +1,25 @@
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required  
-from model.RAG.retrieve_model import Retrievemodel
-INSTANCE = Retrievemodel()
-import threading
+# 与 Gradio 侧共用同一个检索模型实例，避免重复加载向量化模型
+from model.RAG.retrieve_model import INSTANCE
+from model.RAG.build_queue import get_build_queue
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from django.http import JsonResponse
 import os
-from django.http import FileResponse, Http404
+from django.http import Http404
 from django.conf import settings
+from chatbot.file_response import serve_file
 
-def upload_and_build( uploaded_file):
-    # 先上传文件
-    INSTANCE.upload_user_file(uploaded_file)
-    # 然后更新知识库
-    INSTANCE.build_user_vector_store()
+def upload_and_build(uploaded_file, user_id=None):
+    # 先上传文件，上传的文件对象只在请求期间有效，需要在请求线程中保存
+    user_id = user_id or INSTANCE.user_id
+    upload = INSTANCE.upload_user_file(uploaded_file, user_id)
+    if upload['duplicate-of']:
+        # 内容与已上传的文件相同，不需要重新构建
+        return upload, None
+    # 然后提交知识库构建任务，同一用户构建期间的多次上传合并为一次构建
+    return upload, get_build_queue().submit(user_id, [upload['name']])
 
 
 
@@ -25,13 +30,22 @@ def build_knowledge_view(request):
     if action == 'upload':
         uploaded_file = request.FILES.get('file')
         if uploaded_file:
-            thread = threading.Thread(target=upload_and_build, args=(uploaded_file,))
-            thread.start()
+            upload, job = upload_and_build(uploaded_file, INSTANCE.user_id)
             uploaded_files = INSTANCE.list_uploaded_files()
-            return JsonResponse({'success': '知识库文件上传成功！', 'uploaded_files': uploaded_files}, status=200)
+            if job is None:
+                return JsonResponse({'success': f"文件内容与已上传的 {upload['duplicate-of']} 相同，已跳过。", 'uploaded_files': uploaded_files, 'upload': upload}, status=200)
+            return JsonResponse({'success': '知识库文件上传成功！', 'uploaded_files': uploaded_files, 'upload': upload, 'build_job': job}, status=200)
         else:
             return JsonResponse({'error': '请上传文件。'}, status=400)
 
+@api_view(['GET'])
+def build_status_view(request):
+    """查询当前用户最近一次知识库构建任务的状态：queued / running / done / failed"""
+    job = get_build_queue().status(INSTANCE.user_id)
+    if job is None:
+        return JsonResponse({'error': '没有知识库构建任务'}, status=404)
+    return JsonResponse(job, status=200)
+
 @api_view(['GET'])
 def list_uploaded_files(request):
     uploaded_files = INSTANCE.list_uploaded_files()
@@ -66,7 +80,7 @@ def view_uploaded_file_view(request, filename):
 
     file_path = INSTANCE.view_uploaded_file(filename)
 
-    if not os.path.exists(file_path):
+    if not file_path or not os.path.exists(file_path):
         raise Http404(f"文件 {filename} 不存在")
 
     # 自动检测文件的类型
@@ -80,4 +94,7 @@ def view_uploaded_file_view(request, filename):
     else:
         content_type = 'application/octet-stream'  # 通用文件类型
 
-    return FileResponse(open(file_path, 'rb'), content_type=content_type)
\ No newline at end of file
+    # 支持 ETag / Range，配置 USER_FILE_SERVE_MODE 后由前置服务器直接发送文件
+    name = os.path.basename(file_path)
+    accel_path = f"{settings.USER_FILE_ACCEL_PREFIX.rstrip('/')}/{INSTANCE.user_id}/{name}" if getattr(settings, 'USER_FILE_ACCEL_PREFIX', None) else None
+    return serve_file(request, file_path, content_type, sha256=INSTANCE.uploaded_file_sha256(name), accel_path=accel_path)
\ No newline at end of file
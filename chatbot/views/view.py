@@ -15,6 +15,7 @@ from django.views.decorators.csrf import csrf_exempt
 from rest_framework import status
 from app import start_gradio
 
+from model.warmup import readiness
 from chatbot.encrypt import md5
 from chatbot import forms
 from chatbot import models
@@ -86,3 +87,9 @@ def choice_view(request):
     # 显示选择页面
     return render(request, 'choice.html')
 
+
+# 就绪检查：返回各模型的后台预热状态
+@api_view(['GET'])
+def ready(request):
+    result = readiness()
+    return JsonResponse(result, status=200 if result['ready'] else 503)
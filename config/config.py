@@ -44,6 +44,13 @@ class Config(object):
 
         return conf
 
+    def get_with_default(self, default, *params):
+        """读取嵌套配置，缺失时返回默认值，便于新增配置项兼容旧的yaml文件"""
+        try:
+            return self.get_with_nested_params(*params)
+        except KeyError:
+            return default
+
 
 if __name__ == "__main__":
     print(get_app_root())
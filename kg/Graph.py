@@ -1,4 +1,7 @@
 '''实例化知识图谱对象'''
+import threading
+from typing import Dict, List
+
 from config.config import Config
 from py2neo import Graph, NodeMatcher, RelationshipMatcher, ConnectionUnavailable
 
@@ -43,7 +46,47 @@ class GraphDao(object):
         # 执行查询，并将查询结果返回
         result = self.__graph.run(query, entity_name=entity_name).data()
         return result
+
+    @ensure_connection
+    def query_relationships_by_names(self, entity_names: List[str]) -> Dict[str, List[Dict]]:
+        # 一次查询多个实体的所有关系，返回 {实体名称: [{a, r, b}, ...]}，没有关系的实体对应空列表
+        query = """
+        UNWIND $entity_names AS entity_name
+        MATCH (a)-[r]-(b)
+        WHERE a.名称 = entity_name
+        RETURN entity_name, a, r, b
+        """
+        names = list(dict.fromkeys(entity_names))
+        grouped = {name: [] for name in names}
+        for record in self.__graph.run(query, entity_names=names).data():
+            grouped[record.pop("entity_name")].append(record)
+        return grouped
     
     @ensure_connection
     def query_node(self, *label, **properties):
         return self.__node_matcher.match(*label, **properties)
+
+    @ensure_connection
+    def count_nodes(self, label: str) -> int:
+        # 统计某个标签的节点数，用于判断图谱是否有变化
+        query = f"MATCH (n:`{label}`) RETURN count(n)"
+        return self.__graph.run(query).evaluate()
+
+    @ensure_connection
+    def latest_update(self, label: str, property_name: str):
+        # 某个标签的节点上更新时间属性的最大值，节点属性被修改后随之变化
+        query = f"MATCH (n:`{label}`) RETURN max(n.`{property_name}`)"
+        return self.__graph.run(query).evaluate()
+
+
+_dao = None
+_dao_lock = threading.Lock()
+
+
+def get_dao() -> GraphDao:
+    """返回进程内共享的 GraphDao，首次调用时才连接 Neo4j"""
+    global _dao
+    with _dao_lock:
+        if _dao is None:
+            _dao = GraphDao()
+        return _dao
@@ -0,0 +1,187 @@
+'''以文本内容寻址的向量缓存：sha256(规范化文本) -> float32 向量，向量保存在内存映射文件中'''
+import hashlib
+import json
+import os
+import re
+import threading
+import unicodedata
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+try:  # 多进程同时写缓存时使用文件锁，Windows 下只做进程内加锁
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+_DIGEST_SIZE = 32
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """统一全角半角并折叠空白，只有空白差异的文本共用同一个向量"""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def text_digest(text: str) -> bytes:
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).digest()
+
+
+class EmbeddingCache(object):
+    """
+    缓存目录下有三个文件：
+    keys.bin     追加写入的 32 字节摘要，第 i 个摘要对应第 i 行向量
+    vectors.f32  追加写入的 float32 向量，按行存放，读取时用 np.memmap 映射
+    meta.json    记录模型名称与向量维度，两者变化时缓存作废
+    摘要按前 8 字节排序后常驻内存用于二分查找，新追加的条目先放在小字典里，积累到一定数量再合并。
+    """
+
+    def __init__(self, cache_dir: str, model_name: str):
+        self._cache_dir = cache_dir
+        self._model_name = model_name
+        self._keys_path = os.path.join(cache_dir, "keys.bin")
+        self._vectors_path = os.path.join(cache_dir, "vectors.f32")
+        self._meta_path = os.path.join(cache_dir, "meta.json")
+        self._lock = threading.Lock()
+        self._dim: Optional[int] = None
+        os.makedirs(cache_dir, exist_ok=True)
+        self._clear_state()
+        self._load_meta()
+        self._reload()
+
+    @property
+    def size(self) -> int:
+        return self._rows
+
+    def _clear_state(self):
+        self._rows = 0
+        self._keys: Optional[np.memmap] = None
+        self._vectors: Optional[np.memmap] = None
+        self._sorted_prefix = np.empty(0, dtype=np.uint64)
+        self._sorted_rows = np.empty(0, dtype=np.int64)
+        self._recent: Dict[bytes, int] = {}
+
+    def _load_meta(self):
+        meta = None
+        if os.path.exists(self._meta_path):
+            try:
+                with open(self._meta_path, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                meta = None
+        if meta and meta.get("model") == self._model_name:
+            self._dim = meta.get("dim")
+        else:
+            self._reset(None)
+
+    def _reset(self, dim: Optional[int]):
+        for path in (self._keys_path, self._vectors_path):
+            if os.path.exists(path):
+                os.remove(path)
+        with open(self._meta_path, "w", encoding="utf-8") as f:
+            json.dump({"model": self._model_name, "dim": dim}, f)
+        self._dim = dim
+        self._clear_state()
+
+    def _file_rows(self) -> int:
+        if not self._dim or not os.path.exists(self._keys_path):
+            return 0
+        if not os.path.exists(self._vectors_path):
+            return 0
+        # 先写向量再写摘要，以两者中较短的一方为准，不会读到半条记录
+        return min(
+            os.path.getsize(self._keys_path) // _DIGEST_SIZE,
+            os.path.getsize(self._vectors_path) // (4 * self._dim),
+        )
+
+    def _reload(self):
+        """重新映射缓存文件，其他进程追加的条目在这之后可见"""
+        rows = self._file_rows()
+        if rows == self._rows:
+            return
+        if rows < self._rows:
+            # 文件被其他进程重置过
+            self._clear_state()
+            if not rows:
+                return
+        old_rows = self._rows
+        self._keys = np.memmap(
+            self._keys_path, dtype=np.uint8, mode="r", shape=(rows, _DIGEST_SIZE)
+        )
+        self._vectors = np.memmap(
+            self._vectors_path, dtype=np.float32, mode="r", shape=(rows, self._dim)
+        )
+        self._rows = rows
+        for row in range(old_rows, rows):
+            self._recent[self._keys[row].tobytes()] = row
+        if len(self._recent) > max(4096, rows // 8):
+            prefix = np.ascontiguousarray(self._keys[:, :8]).view("<u8").ravel()
+            order = np.argsort(prefix, kind="stable")
+            self._sorted_prefix = prefix[order]
+            self._sorted_rows = order
+            self._recent = {}
+
+    def _find_rows(self, digests: Sequence[bytes]) -> np.ndarray:
+        """返回每个摘要所在的行号，未命中为 -1"""
+        rows = np.full(len(digests), -1, dtype=np.int64)
+        if not self._rows or not digests:
+            return rows
+        wanted = np.frombuffer(b"".join(digests), dtype=np.uint8).reshape(-1, _DIGEST_SIZE)
+        prefix = np.ascontiguousarray(wanted[:, :8]).view("<u8").ravel()
+        pos = np.searchsorted(self._sorted_prefix, prefix)
+        for i, digest in enumerate(digests):
+            row = self._recent.get(digest)
+            if row is not None:
+                rows[i] = row
+                continue
+            # 前缀相同的条目可能有多个，逐个比对完整摘要
+            p = pos[i]
+            while p < len(self._sorted_prefix) and self._sorted_prefix[p] == prefix[i]:
+                row = self._sorted_rows[p]
+                if self._keys[row].tobytes() == digest:
+                    rows[i] = row
+                    break
+                p += 1
+        return rows
+
+    def get_many(self, digests: Sequence[bytes]) -> List[Optional[np.ndarray]]:
+        with self._lock:
+            self._reload()
+            rows = self._find_rows(digests)
+            return [
+                np.array(self._vectors[row]) if row >= 0 else None for row in rows
+            ]
+
+    def put_many(self, digests: Sequence[bytes], vectors: np.ndarray):
+        if not len(digests):
+            return
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock:
+            lock_file = open(os.path.join(self._cache_dir, ".lock"), "a")
+            try:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._load_meta()
+                if self._dim != vectors.shape[1]:
+                    self._reset(vectors.shape[1])
+                self._reload()
+                existing = self._find_rows(digests)
+                new = [i for i, row in enumerate(existing) if row < 0]
+                if not new:
+                    return
+                # 上次写入若在两个文件之间中断，先截掉多出的半条记录，保证行号对齐
+                for path, row_size in (
+                    (self._vectors_path, 4 * self._dim),
+                    (self._keys_path, _DIGEST_SIZE),
+                ):
+                    if os.path.exists(path):
+                        os.truncate(path, self._rows * row_size)
+                with open(self._vectors_path, "ab") as f:
+                    f.write(vectors[new].tobytes())
+                with open(self._keys_path, "ab") as f:
+                    f.write(b"".join(digests[i] for i in new))
+                self._reload()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
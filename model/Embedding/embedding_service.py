@@ -0,0 +1,165 @@
+'''进程内共享的向量化服务：唯一的模型实例、分批前向计算以及按文本内容寻址的向量缓存'''
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_community.embeddings import ModelScopeEmbeddings
+from modelscope.hub.snapshot_download import snapshot_download
+
+from config.config import Config
+from model.Embedding.embedding_cache import EmbeddingCache, normalize_text, text_digest
+from model.model_registry import get_registry
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    包装一个 Embeddings，对文档向量化做两件事：
+    1. 先按规范化文本的 sha256 查缓存，重复或未变化的文本不再做前向计算；
+    2. 未命中的文本按 batch_size 分批送入模型，避免一次送入过多文本占满内存。
+    问题的向量保存在一个小的内存LRU中，同一请求的检索与重排序只计算一次。
+    """
+
+    _QUERY_CACHE_SIZE = 256
+
+    def __init__(
+        self,
+        embedding: Embeddings,
+        batch_size: int = 32,
+        cache: Optional[EmbeddingCache] = None,
+    ):
+        self._embedding = embedding
+        self._batch_size = max(1, batch_size)
+        self._cache = cache
+        self._lock = threading.Lock()
+        self._queries: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._dimension: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def embedding(self) -> Embeddings:
+        return self._embedding
+
+    @property
+    def dimension(self) -> int:
+        """向量维度，首次访问时向量化一条短文本得到"""
+        if self._dimension is None:
+            self._dimension = len(self._embedding.embed_query("维度"))
+        return self._dimension
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        digests = [text_digest(text) for text in texts]
+        # 同一批次内重复的文本只计算一次
+        unique = {}
+        for i, digest in enumerate(digests):
+            unique.setdefault(digest, i)
+        keys = list(unique)
+
+        if self._cache is not None:
+            cached = self._cache.get_many(keys)
+        else:
+            cached = [None] * len(keys)
+        vectors = dict(zip(keys, cached))
+        missing = [digest for digest in keys if vectors[digest] is None]
+
+        for start in range(0, len(missing), self._batch_size):
+            batch = missing[start : start + self._batch_size]
+            batch_vectors = np.asarray(
+                self._embedding.embed_documents([texts[unique[d]] for d in batch]),
+                dtype=np.float32,
+            )
+            if self._cache is not None:
+                self._cache.put_many(batch, batch_vectors)
+            vectors.update(zip(batch, batch_vectors))
+
+        with self._lock:
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+        return [vectors[digest].tolist() for digest in digests]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = normalize_text(text)
+        with self._lock:
+            vector = self._queries.get(key)
+            if vector is not None:
+                self._queries.move_to_end(key)
+                return vector
+        vector = self._embedding.embed_query(text)
+        with self._lock:
+            self._queries[key] = vector
+            while len(self._queries) > self._QUERY_CACHE_SIZE:
+                self._queries.popitem(last=False)
+        return vector
+
+
+def _download_embedding_model(model_name: str):
+    """本地没有模型文件时先从modelscope下载，只在首次加载时检查一次"""
+    # 此处请自行改成下载embedding模型的位置
+    download_path = Config.get_instance().get_with_nested_params(
+        "model", "embedding", "model-path"
+    )
+    model_path = os.path.join(download_path, model_name)
+    if os.path.exists(model_path):
+        return
+    try:
+        # 如果为空，则从modelscope下载模型
+        model_dir = snapshot_download(model_name, cache_dir=download_path)
+        print(f"Model downloaded and saved to {model_dir}")
+    except Exception as e:
+        print(f"Failed to download model: {e}")
+        if os.path.exists(model_path):
+            shutil.rmtree(model_path)
+
+
+def _load_embedding(model_name: str, model_version: Optional[str] = None) -> CachedEmbeddings:
+    config = Config.get_instance()
+    batch_size = config.get_with_default(32, "model", "embedding", "batch-size")
+    cache_path = config.get_with_default(None, "model", "embedding", "cache-path")
+
+    _download_embedding_model(model_name)
+    cache = None
+    if cache_path:
+        # 不同版本的向量分开缓存，迁移期间新旧模型同时使用时互不覆盖
+        cache_name = model_name.replace("/", "_")
+        if model_version:
+            cache_name = f"{cache_name}@{model_version}"
+        cache = EmbeddingCache(
+            os.path.join(cache_path, cache_name), embedding_model_id(model_name, model_version)
+        )
+    # ModelScopeEmbeddings 只能接受官方模型名
+    return CachedEmbeddings(
+        ModelScopeEmbeddings(model_id=model_name, model_revision=model_version),
+        batch_size=batch_size,
+        cache=cache,
+    )
+
+
+def get_embedding_model_name() -> str:
+    return Config.get_instance().get_with_nested_params("model", "embedding", "model-name")
+
+
+def get_embedding_model_version() -> Optional[str]:
+    return Config.get_instance().get_with_default(None, "model", "embedding", "model-version")
+
+
+def embedding_model_id(model_name: str, model_version: Optional[str] = None) -> str:
+    return f"{model_name}@{model_version}" if model_version else model_name
+
+
+def get_embedding(
+    model_name: Optional[str] = None, model_version: Optional[str] = None
+) -> CachedEmbeddings:
+    """
+    从模型注册表借用进程内唯一的向量化服务，首次调用时才下载、加载模型。
+    不传参数时为配置中的当前模型；迁移向量期间用旧索引记录的模型名与版本取得旧模型。
+    """
+    if model_name is None:
+        model_name, model_version = get_embedding_model_name(), get_embedding_model_version()
+    return get_registry().get(
+        f"embedding:{embedding_model_id(model_name, model_version)}",
+        lambda: _load_embedding(model_name, model_version),
+    )
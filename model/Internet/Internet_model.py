@@ -1,14 +1,17 @@
 '''联网搜索的RAG检索模型类'''
 from model.model_base import Modelbase
 from model.model_base import ModelStatus
+from model.Embedding.embedding_service import get_embedding
+from model.RAG.chunker import StructureAwareChunker
+from model.RAG.index_factory import DEFAULT_INDEX_CONFIG, create_index, load_index_config
 
 import os
+import numpy as np
 from env import get_app_root
 
-from langchain_community.embeddings import ModelScopeEmbeddings
 from langchain_core.vectorstores import VectorStoreRetriever
 from langchain_community.document_loaders import DirectoryLoader, MHTMLLoader, UnstructuredHTMLLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores.faiss import FAISS
 
 from config.config import Config
@@ -21,15 +24,18 @@ class InternetModel(Modelbase):
     def __init__(self,*args,**krgs):
         super().__init__(*args,**krgs)
 
-        # 此处请自行改成下载embedding模型的位置
-        self._embedding_model_path =Config.get_instance().get_with_nested_params("model", "embedding", "model-name")
-        self._text_splitter = RecursiveCharacterTextSplitter
-        #self._embedding = OpenAIEmbeddings()
-        self._embedding = ModelScopeEmbeddings(model_id=self._embedding_model_path)
+        # 与知识库使用相同的切块方式，网页按标题切分
+        self._text_splitter = StructureAwareChunker.from_config()
         self._data_path = os.path.join(get_app_root(), "data/cache/internet")
         
         #self._logger: Logger = Logger("rag_retriever")
 
+    @property
+    def _embedding(self):
+        #self._embedding = OpenAIEmbeddings()
+        # 与本地知识库共用同一个向量化模型实例
+        return get_embedding()
+
     # 建立向量库
     def build(self):
         try:
@@ -56,13 +62,20 @@ class InternetModel(Modelbase):
                 self._retriever = None
                 return
 
-            text_splitter = RecursiveCharacterTextSplitter(chunk_size=2000, chunk_overlap=100)
-            splits = text_splitter.split_documents(docs)
+            splits = self._text_splitter.split_documents(docs)
             if not splits:
                 self._retriever = None
                 return
 
-            vectorstore = FAISS.from_documents(documents=splits, embedding=self._embedding)
+            texts = [split.page_content for split in splits]
+            embeddings = self._embedding.embed_documents(texts)
+            # 与知识库使用相同的向量存储精度；网页块数不足以训练 sq8 / PQ 时 create_index 返回 float32 的 flat 索引
+            config = {**DEFAULT_INDEX_CONFIG, "storage": load_index_config()["storage"]}
+            index = create_index(np.asarray(embeddings, dtype=np.float32), config)
+            vectorstore = FAISS(self._embedding, index, InMemoryDocstore(), {})
+            vectorstore.add_embeddings(
+                zip(texts, embeddings), metadatas=[split.metadata for split in splits]
+            )
             self._retriever = vectorstore.as_retriever(search_kwargs={"k": 6})
         except Exception as exc:  # noqa: BLE001
             print(f"[internet-rag] 构建向量库失败: {exc}")
@@ -1,21 +1,25 @@
 from dataclasses import dataclass,field
+from typing import Optional
 from config.config import Config
-from kg.Graph import GraphDao
+from kg.Graph import GraphDao, get_dao
 
 
 @dataclass
 class NodeEntities(object):
     # 该类负责与Graph类交互，获取节点信息
 
-    dao: GraphDao = field(default_factory=lambda: GraphDao(), init=True, compare=False)
+    # 为None时使用共享的GraphDao，直到真正查询节点时才连接Neo4j
+    _dao: Optional[GraphDao] = field(default=None, init=True, compare=False)
 
-    # 获取节点
-    def get_entities_iterator(self):
+    @property
+    def dao(self) -> GraphDao:
+        return self._dao or get_dao()
 
-        # 定义你要查询的标签类型，比如疾病、症状、药物等
-        labels_to_query = Config.get_instance().get_with_nested_params("database", "neo4j", "node-label")
+    # 获取节点，逐个生成节点字典，不在内存中保留完整的节点列表
+    def get_entities_iterator(self, labels=None):
 
-        node_list = []
+        # 定义你要查询的标签类型，比如疾病、症状、药物等；labels 不为空时只查询这些标签
+        labels_to_query = labels if labels is not None else Config.get_instance().get_with_nested_params("database", "neo4j", "node-label")
 
         # 动态查询不同标签类型的节点
         for label in labels_to_query:
@@ -24,14 +28,34 @@ class NodeEntities(object):
 
             for node in nodes:
                 # 根据节点的标签和属性创建字典
-                node_dict = {
+                yield {
                     'label': label,  # 使用当前查询的标签
                     **dict(node)  # 解包节点的属性
                 }
-                node_list.append(node_dict)
-
-        return node_list
         
        
+    # 图谱指纹：各标签的节点数，以及配置了更新时间属性时各标签的最近更新时间，
+    # 节点增删或修改后指纹变化，据此判断实体自动机快照是否可用、哪些标签需要重新读取
+    def fingerprint(self):
+        labels = Config.get_instance().get_with_nested_params("database", "neo4j", "node-label")
+        updated_at = Config.get_instance().get_with_default(None, "model", "graph-entity", "updated-at-property")
+        counts, updates = {}, {}
+        for label in labels:
+            count = self.dao.count_nodes(label)
+            if count is None:
+                # 未连接Neo4j，无法判断图谱是否变化
+                return None
+            counts[label] = count
+            if updated_at:
+                latest = self.dao.latest_update(label, updated_at)
+                updates[label] = None if latest is None else str(latest)
+        fingerprint = {
+            "search-key": Config.get_instance().get_with_nested_params("model", "graph-entity", "search-key"),
+            "labels": counts,
+        }
+        if updated_at:
+            fingerprint["updated"] = updates
+        return fingerprint
+
     def __call__(self, *args, **kwargs):
         return self.get_entities_iterator()
@@ -0,0 +1,62 @@
+'''实体检索自动机的磁盘快照：以各标签的节点数作为图谱指纹，图谱未变化时直接加载快照，不再从Neo4j拉取全部节点'''
+import os
+import pickle
+from typing import Any, Dict, Optional, Tuple
+
+from env import get_app_root
+
+# 快照格式变化时递增，旧格式的快照直接丢弃重建
+SNAPSHOT_VERSION = 2
+
+DEFAULT_SNAPSHOT_PATH = os.path.join(get_app_root(), "data/cache/kg/entity_automaton.pkl")
+
+
+class AutomatonSnapshot(object):
+    """
+    将构建好的 pyahocorasick 自动机与实体属性表，连同构建时的图谱指纹一起 pickle 到磁盘。
+    多个 worker 启动时只需反序列化快照，指纹与当前图谱不一致时才重新构建。
+    """
+
+    def __init__(self, path: str = DEFAULT_SNAPSHOT_PATH):
+        self._path = path
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def load(self, fingerprint: Dict) -> Optional[Tuple[Any, Any]]:
+        """指纹一致时返回快照中的 (自动机, 实体属性表)，否则返回None"""
+        if not os.path.exists(self._path):
+            return None
+        try:
+            with open(self._path, "rb") as f:
+                snapshot = pickle.load(f)
+        except Exception as e:
+            print(f"读取实体自动机快照 {self._path} 失败: {e}")
+            return None
+        if snapshot.get("version") != SNAPSHOT_VERSION or snapshot.get("fingerprint") != fingerprint:
+            return None
+        return snapshot["automaton"], snapshot["entities"]
+
+    def save(self, model: Tuple[Any, Any], fingerprint: Dict):
+        """先写入临时文件再替换，其他 worker 不会读到写了一半的快照"""
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        tmp_path = f"{self._path}.tmp-{os.getpid()}"
+        try:
+            with open(tmp_path, "wb") as f:
+                automaton, entities = model
+                pickle.dump(
+                    {
+                        "version": SNAPSHOT_VERSION,
+                        "fingerprint": fingerprint,
+                        "automaton": automaton,
+                        "entities": entities,
+                    },
+                    f,
+                    protocol=pickle.HIGHEST_PROTOCOL,
+                )
+            os.replace(tmp_path, self._path)
+        except OSError as e:
+            print(f"保存实体自动机快照 {self._path} 失败: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
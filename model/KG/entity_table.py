@@ -0,0 +1,72 @@
+'''实体属性表：自动机中只保存整数ID，节点属性以紧凑的二进制形式集中保存，匹配到实体时再解码'''
+import json
+from array import array
+from typing import Dict, List
+
+# 非JSON类型的属性值（如日期）按字符串保存；复用同一个编码器，避免每个实体重新创建
+_ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), default=str)
+# 图谱的属性以中文为主，UTF-16 每个汉字2字节，UTF-8 需要3字节
+_CODEC = "utf-16-le"
+
+
+class EntityTable(object):
+    """
+    每个实体的属性（不含标签）编码为 JSON 后以 UTF-16 首尾相接存放在一个 bytes 中，offsets 记录每个实体的起止位置，
+    标签以下标数组保存。与每个实体一个 dict 相比，省去了大量小对象与重复的键名字符串，也便于整体 pickle 到快照。
+    """
+
+    def __init__(self, labels: List[str], label_ids: array, offsets: array, data: bytes):
+        self._labels = labels
+        self._label_ids = label_ids
+        self._offsets = offsets
+        self._data = data
+
+    def __len__(self) -> int:
+        return len(self._label_ids)
+
+    def label(self, entity_id: int) -> str:
+        return self._labels[self._label_ids[entity_id]]
+
+    def raw(self, entity_id: int) -> bytes:
+        return self._data[self._offsets[entity_id] : self._offsets[entity_id + 1]]
+
+    def get(self, entity_id: int) -> Dict:
+        """解码为与原来相同的节点字典 {'label': 标签, **节点属性}"""
+        return {"label": self.label(entity_id), **json.loads(self.raw(entity_id).decode(_CODEC))}
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            len(self._data)
+            + self._offsets.itemsize * len(self._offsets)
+            + self._label_ids.itemsize * len(self._label_ids)
+        )
+
+
+class EntityTableBuilder(object):
+
+    def __init__(self):
+        self._labels: List[str] = []
+        self._label_index: Dict[str, int] = {}
+        self._label_ids = array("H")
+        self._offsets = array("Q", [0])
+        self._data = bytearray()
+
+    def add(self, entity: Dict) -> int:
+        """添加一个节点字典，返回其ID"""
+        properties = {k: v for k, v in entity.items() if k != "label"}
+        return self.add_raw(entity["label"], _ENCODER.encode(properties).encode(_CODEC))
+
+    def add_raw(self, label: str, raw: bytes) -> int:
+        """添加已编码的属性，用于从旧的属性表中直接复制"""
+        label_id = self._label_index.get(label)
+        if label_id is None:
+            label_id = self._label_index[label] = len(self._labels)
+            self._labels.append(label)
+        self._label_ids.append(label_id)
+        self._data += raw
+        self._offsets.append(len(self._data))
+        return len(self._label_ids) - 1
+
+    def build(self) -> EntityTable:
+        return EntityTable(list(self._labels), self._label_ids, self._offsets, bytes(self._data))
@@ -3,9 +3,14 @@ from typing import Tuple, Optional, List,Dict
 from model.model_base import Modelbase
 from model.model_base import ModelStatus
 
+import threading
+import time
+
 import ahocorasick as pyahocorasick
 from config.config import Config
 from model.KG.data_utils import NodeEntities
+from model.KG.entity_snapshot import AutomatonSnapshot
+from model.KG.entity_table import EntityTableBuilder
 
 class EntitySearcher(Modelbase):
 
@@ -13,37 +18,175 @@ class EntitySearcher(Modelbase):
         super().__init__(*args, **krgs)
         self._node_entities = NodeEntities()
         self._search_key = Config.get_instance().get_with_nested_params("model", "graph-entity", "search-key")
-        self.build()
+        self._build_lock = threading.Lock()
+        # 匹配方式：longest 只保留最长且互不重叠的匹配，同一实体只保留一次并限制实体数；all 返回全部匹配
+        self._match_mode = Config.get_instance().get_with_default("longest", "model", "graph-entity", "match")
+        self._max_entities = Config.get_instance().get_with_default(10, "model", "graph-entity", "max-entities")
+        # 自动机的磁盘快照，图谱未变化时启动时直接加载
+        self._snapshot = AutomatonSnapshot()
+        # 当前自动机对应的图谱指纹，后台定时比较，图谱变化后重建
+        self._fingerprint = None
+        self._refresh_scheduled = False
+        self._metrics = {"rebuilds": 0}
+        # 自动机在首次检索或后台预热时才构建，导入模块时不再访问Neo4j
 
     def build(self, *args, **kwargs):
-        self._model_status = ModelStatus.BUILDING
+        with self._build_lock:
+            if self._model_status == ModelStatus.READY:
+                return
+            self._model_status = ModelStatus.BUILDING
 
-        try:
-            self._build_model()
-        except Exception as e:
-            self._model_status = ModelStatus.FAILED
-            return
+            try:
+                fingerprint = self._node_entities.fingerprint()
+                self._model = self._build_model(fingerprint)  # 将自动机模型保存到实例变量中
+                self._fingerprint = fingerprint
+            except Exception as e:
+                print(f"构建实体检索自动机失败: {e}")
+                self._model_status = ModelStatus.FAILED
+                return
 
-        self._model_status = ModelStatus.READY
+            self._model_status = ModelStatus.READY
+        self._schedule_refresh()
 
-    def _build_model(self, *args, **kwargs):
-        automaton = pyahocorasick.Automaton()
+    def _build_model(self, fingerprint=None, previous=None, previous_fingerprint=None):
+        """
+        返回新构建的 (自动机, 实体属性表)，自动机中的值只是实体在属性表中的整数ID。
+        指纹与快照一致时直接加载快照；提供了旧模型时，节点数与更新时间都没变的标签沿用旧属性表中的实体，
+        只从Neo4j重新读取变化的标签。
+        """
+        started = time.perf_counter()
+        if fingerprint is not None:
+            model = self._snapshot.load(fingerprint)
+            if model is not None:
+                print(f"已从快照 {self._snapshot.path} 加载实体检索自动机: {len(model[0])} 个实体")
+                self._record_build("snapshot", model, fingerprint, started)
+                return model
 
-        # 在这里的self._node_entities 包含图数据库的节点信息
-        for i, entity in enumerate(self._node_entities()):
-            # 从字典 entity 中提取 FIELD_NAMES 对应的值
-            # values = [entity[fn] for fn in FIELD_NAMES]  # 通过 FIELD_NAMES 获取对应的值
-            # value = _Value(*values)
-            automaton.add_word(entity[self._search_key], (i, entity))
+        labels = None
+        # 值为整数ID时以 STORE_INTS 保存，自动机中不再为每个词保存一个Python对象
+        automaton = pyahocorasick.Automaton(pyahocorasick.STORE_INTS)
+        entities = EntityTableBuilder()
+        if previous is not None and fingerprint is not None and previous_fingerprint is not None:
+            labels = self._changed_labels(previous_fingerprint, fingerprint)
+            if labels is not None:
+                kept = set(fingerprint["labels"]) - set(labels)
+                old_automaton, old_entities = previous
+                for word, entity_id in old_automaton.items():
+                    label = old_entities.label(entity_id)
+                    if label in kept:
+                        automaton.add_word(word, entities.add_raw(label, old_entities.raw(entity_id)))
+
+        # 在这里的self._node_entities 包含图数据库的节点信息，逐个读取，不保留完整的节点列表
+        for entity in self._node_entities.get_entities_iterator(labels):
+            # 自动机中只保存实体ID，节点属性编码后存入属性表，匹配到时再解码
+            automaton.add_word(entity[self._search_key], entities.add(entity))
 
         automaton.make_automaton()  # 构建自动机
-        self._model = automaton  # 将自动机模型保存到实例变量中
+        model = (automaton, entities.build())
+        if fingerprint is not None:
+            self._snapshot.save(model, fingerprint)
+        self._record_build("neo4j" if labels is None else "incremental", model, fingerprint, started)
+        return model
+
+    @staticmethod
+    def _changed_labels(old: Dict, new: Dict) -> Optional[List[str]]:
+        """指纹有变化的标签；搜索键改变时返回None，需要全部重新读取"""
+        if old.get("search-key") != new.get("search-key"):
+            return None
+        old_updates, new_updates = old.get("updated", {}), new.get("updated", {})
+        return [
+            label
+            for label, count in new["labels"].items()
+            if old["labels"].get(label) != count or old_updates.get(label) != new_updates.get(label)
+        ]
+
+    def _record_build(self, source: str, model: Tuple, fingerprint, started: float):
+        automaton, entities = model
+        self._metrics.update(
+            {
+                "source": source,
+                "entities": len(automaton),
+                "automaton-bytes": automaton.get_stats()["total_size"],
+                "table-bytes": entities.nbytes,
+                "labels": dict(fingerprint["labels"]) if fingerprint else None,
+                "rebuild-seconds": round(time.perf_counter() - started, 3),
+                "built-at": time.time(),
+            }
+        )
+
+    def _schedule_refresh(self):
+        """自动机就绪后用共享的 APScheduler 定时检查图谱变化，只注册一次"""
+        interval = Config.get_instance().get_with_default(0, "model", "graph-entity", "refresh-interval")
+        if not interval or self._refresh_scheduled:
+            return
+        self._refresh_scheduled = True
+        try:
+            from project.schedule import get_scheduler
+
+            scheduler = get_scheduler()
+            scheduler.add_job(
+                self.refresh,
+                "interval",
+                seconds=interval,
+                id="kg-entity-refresh",
+                replace_existing=True,
+                max_instances=1,
+                coalesce=True,
+            )
+            if not scheduler.running:
+                scheduler.start()
+        except Exception as e:
+            print(f"启动实体自动机的定时刷新失败: {e}")
+
+    def refresh(self) -> bool:
+        """
+        图谱有变化时在后台构建新的自动机，构建完成后整体替换，检索始终使用完整的旧自动机或新自动机。
+        返回是否替换了自动机。
+        """
+        if self._model_status != ModelStatus.READY:
+            return False
+        with self._build_lock:
+            self._metrics["checked-at"] = time.time()
+            try:
+                fingerprint = self._node_entities.fingerprint()
+                if fingerprint is None or fingerprint == self._fingerprint:
+                    return False
+                model = self._build_model(fingerprint, self._model, self._fingerprint)
+            except Exception as e:
+                print(f"刷新实体检索自动机失败，继续使用旧自动机: {e}")
+                return False
+            self._model, self._fingerprint = model, fingerprint
+            self._metrics["rebuilds"] += 1
+        print(
+            f"图谱已变化，实体检索自动机已更新: {self._metrics['entities']} 个实体, "
+            f"耗时 {self._metrics['rebuild-seconds']}s"
+        )
+        return True
+
+    def stats(self) -> Dict:
+        """自动机的实体数与内存占用、各标签节点数、最近一次构建的方式与耗时，以及后台刷新次数"""
+        return {"status": self._model_status, **self._metrics}
 
     def search(self, query: str) -> Tuple[Optional[List[Dict]]]:
+        if self._model_status != ModelStatus.READY:
+            self.build()
+            if self._model_status != ModelStatus.READY:
+                return []
+
+        # 后台刷新会整体替换自动机与属性表，检索期间始终使用同一组
+        automaton, entities = self._model
+        if self._match_mode != "longest":
+            return [entities.get(entity_id) for end_index, entity_id in automaton.iter(query)]
 
-        results = []
-        for end_index, (insert_order, original_value) in self._model.iter(query):
-            results.append(original_value)
+        # 从左到右取最长的匹配，“糖尿病”中不再同时匹配出“糖尿”“尿病”；重复提到的实体只保留一次
+        results, seen = [], set()
+        for end_index, entity_id in automaton.iter_long(query):
+            if entity_id in seen:
+                continue
+            if self._max_entities and len(results) >= self._max_entities:
+                break
+            seen.add(entity_id)
+            results.append(entities.get(entity_id))
 
         return results
 
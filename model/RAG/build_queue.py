@@ -0,0 +1,112 @@
+'''用户知识库的索引构建队列：固定大小的线程池执行构建，每个用户同时只有一个构建，构建期间的新上传合并到下一次构建中'''
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from config.config import Config
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def _snapshot(job: Dict) -> Dict:
+    return dict(job, files=list(job["files"]))
+
+
+class BuildQueue(object):
+    """
+    每个用户最多有一个运行中的任务和一个排队中的任务：
+    用户已有排队任务时，新提交的文件合并进该任务；任务运行中再提交时，新建的任务等当前任务结束后才进入线程池。
+    """
+
+    def __init__(self, build: Callable[[str], int], max_workers: int = 2):
+        self._build = build
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="index-build")
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        # 每个用户最近一次提交的任务，以及等待当前任务结束的排队任务
+        self._latest: Dict[str, Dict] = {}
+        self._running: Dict[str, Dict] = {}
+        self._waiting: Dict[str, Dict] = {}
+
+    def submit(self, user_id: str, files: Optional[List[str]] = None) -> Dict:
+        """提交用户的构建任务，返回任务状态"""
+        files = files or []
+        with self._lock:
+            job = self._waiting.get(user_id)
+            if job is None:
+                latest = self._latest.get(user_id)
+                if latest is not None and latest["state"] == QUEUED:
+                    job = latest
+            if job is not None:
+                job["files"].extend(f for f in files if f not in job["files"])
+                return _snapshot(job)
+
+            job = {
+                "job-id": next(self._ids),
+                "user-id": user_id,
+                "state": QUEUED,
+                "files": list(files),
+                "chunks": None,
+                "error": None,
+                "submitted-at": time.time(),
+                "started-at": None,
+                "finished-at": None,
+                "duration": None,
+            }
+            self._latest[user_id] = job
+            if user_id in self._running:
+                self._waiting[user_id] = job
+            else:
+                self._executor.submit(self._run, job)
+            return _snapshot(job)
+
+    def status(self, user_id: str) -> Optional[Dict]:
+        with self._lock:
+            job = self._latest.get(user_id)
+            return _snapshot(job) if job is not None else None
+
+    def _run(self, job: Dict):
+        user_id = job["user-id"]
+        with self._lock:
+            self._running[user_id] = job
+            job["state"] = RUNNING
+            job["started-at"] = time.time()
+        try:
+            chunks = self._build(user_id)
+        except Exception as e:
+            print(f"用户 {user_id} 的索引构建任务 {job['job-id']} 失败: {e}")
+            state, chunks, error = FAILED, None, str(e)
+        else:
+            state, error = DONE, None
+
+        with self._lock:
+            job.update({"state": state, "chunks": chunks, "error": error})
+            job["finished-at"] = time.time()
+            job["duration"] = job["finished-at"] - job["started-at"]
+            del self._running[user_id]
+            waiting = self._waiting.pop(user_id, None)
+            if waiting is not None:
+                self._executor.submit(self._run, waiting)
+
+
+_QUEUE: Optional[BuildQueue] = None
+_QUEUE_LOCK = threading.Lock()
+
+
+def get_build_queue() -> BuildQueue:
+    """全局构建队列，构建函数为检索模型的用户索引增量同步"""
+    global _QUEUE
+    with _QUEUE_LOCK:
+        if _QUEUE is None:
+            from model.RAG.retrieve_model import INSTANCE
+
+            _QUEUE = BuildQueue(
+                INSTANCE.sync_user_index,
+                max_workers=Config.get_instance().get_with_default(2, "indexing", "build-workers"),
+            )
+        return _QUEUE
@@ -0,0 +1,377 @@
+'''按文档结构切块：PDF 按页与标题、DOCX 按标题样式、Markdown 按标题、CSV 按行组切分，表格不从中间拆开，每个块记录所属章节'''
+import os
+import re
+import uuid
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter, TextSplitter
+
+from config.config import Config
+from model.RAG.document_loader import LOADER_VERSION
+
+CHUNK_METHODS = ("structure", "recursive")
+
+# 块 metadata 中的章节路径（各级标题以 " > " 连接）与所属父段落的ID
+SECTION_KEY = "section"
+PARENT_KEY = "parent_id"
+
+# 没有记录切块方式的旧索引使用的是 chunk_size=2000, chunk_overlap=100 的字符切分，加载器为最初的版本
+LEGACY_SIGNATURE = "recursive:2000:100"
+
+# 标题识别等结构切分规则改变时递增
+_STRUCTURE_VERSION = 3
+
+_SEPARATORS = ["\n\n", "\n", "。", "；", "！", "？", ". ", "; ", " ", ""]
+
+# 中文文档常见的标题写法与层级：第一章 / 第一节 / 一、 / （一） / 1. / 1.1
+_HEADING_PATTERNS = [
+    (re.compile(r"^第[一二三四五六七八九十百零\d]+[章篇部]"), 1),
+    (re.compile(r"^第[一二三四五六七八九十百零\d]+节"), 2),
+    (re.compile(r"^[一二三四五六七八九十]+[、.．]"), 2),
+    (re.compile(r"^[（(][一二三四五六七八九十]+[）)]"), 3),
+]
+_NUMBERED_HEADING = re.compile(r"^(\d{1,2}(?:\.\d{1,2})*)(?:([、.．])\s*|\s+)(?=[^\d\s])")
+_MARKDOWN_HEADING = re.compile(r"^(#{1,6})\s+(.+?)\s*#*$")
+_HEADING_MAX_CHARS = 40
+# 以这些标点结尾的行是正文句子，不作为标题
+_SENTENCE_END = tuple("。；;，,：:！？!?")
+# “1. 每日三次，每次一片”这样的编号列表与编号标题写法相同，只有较短且不含句读标点的行才作为标题
+_NUMBERED_HEADING_MAX_CHARS = 20
+_SENTENCE_PUNCTUATION = re.compile(r"[。；;，,：:！？!?]")
+# 编号与标题之间只有空格时（如“2.1 适应症”），标题须以汉字开头且不是计量单位，
+# 否则“3 mg”“1.5 mg/kg”“12 小时后复查”“2 型糖尿病”这样的剂量与数值会被当作标题
+_TITLE_START = re.compile(r"[\u4e00-\u9fff]")
+_UNIT_START = re.compile(r"(?:小时|分钟|秒|天|日|周|个月|月|年|岁|次|型|片|粒|支|袋|瓶|滴|倍|度|克|毫克|毫升|升|公斤)")
+# 表格行：用 | 分隔的 Markdown 表格，或用制表符、多个空格分隔出至少三列的行
+_TABLE_ROW = re.compile(r"^\s*\|.*\|\s*$|^\S.*?(?:\t| {2,})\S.*?(?:\t| {2,})\S")
+_FENCE = re.compile(r"^\s*(```|~~~)")
+
+
+def _heading_level(line: str) -> Optional[int]:
+    """
+    按常见标题写法判断一行是否为标题，返回标题层级（1 最高），不是标题时返回None
+
+    >>> _heading_level("第一章 总则"), _heading_level("1. 概述"), _heading_level("2.1 适应症")
+    (1, 2, 3)
+    >>> [_heading_level(s) for s in ("3 mg", "1.5 mg/kg", "12 小时后复查", "2 型糖尿病患者应控制血糖", "1. 每日三次，每次一片")]
+    [None, None, None, None, None]
+    """
+    if len(line) > _HEADING_MAX_CHARS or line.endswith(_SENTENCE_END):
+        return None
+    for pattern, level in _HEADING_PATTERNS:
+        if pattern.match(line):
+            return level
+    match = _NUMBERED_HEADING.match(line)
+    if (
+        match
+        and len(line) <= _NUMBERED_HEADING_MAX_CHARS
+        and not _SENTENCE_PUNCTUATION.search(line, match.end())
+        and (
+            match.group(2)
+            or _TITLE_START.match(line, match.end()) and not _UNIT_START.match(line, match.end())
+        )
+    ):
+        return 2 + match.group(1).count(".")
+    return None
+
+
+class _Section(object):
+    """一个标题下的内容，blocks 为 (类型 text/table, 文本, 所在页等metadata) 的列表"""
+
+    __slots__ = ("path", "blocks")
+
+    def __init__(self, path: List[str]):
+        self.path = path
+        self.blocks: List[Tuple[str, str, Dict]] = []
+
+    def append(self, kind: str, text: str, metadata: Dict):
+        # 同一页中相邻的正文段落合并在一起，切块时再按长度切分
+        if kind == "text" and self.blocks:
+            last_kind, last_text, last_metadata = self.blocks[-1]
+            if last_kind == "text" and last_metadata == metadata:
+                self.blocks[-1] = ("text", f"{last_text}\n{text}", metadata)
+                return
+        self.blocks.append((kind, text, metadata))
+
+
+class _Outline(object):
+    """按出现顺序记录标题层级，遇到新标题时开始新的章节"""
+
+    def __init__(self):
+        self._headings: List[Tuple[int, str]] = []
+        self.sections = [_Section([])]
+
+    def heading(self, level: int, title: str):
+        while self._headings and self._headings[-1][0] >= level:
+            self._headings.pop()
+        self._headings.append((level, title))
+        self.sections.append(_Section([t for _, t in self._headings]))
+
+    @property
+    def current(self) -> _Section:
+        return self.sections[-1]
+
+
+class StructureAwareChunker(TextSplitter):
+    """
+    按文档结构切块，块不跨越章节与页：
+    - PDF 每页单独切分，按标题写法识别章节；txt/html 同样按标题写法识别章节；
+    - DOCX 以 elements 方式加载，Title 元素按其层级划分章节，Table 元素整体保留；
+    - Markdown 按 # 标题划分章节，代码块中的 # 不作为标题；
+    - CSV 每 csv_rows 行（且不超过 chunk_size 个字符）为一个块。
+    文本中的表格不超过 2 倍 chunk_size 时整体作为一个块，更长时按行分组并在每组前重复表头。
+    每个块的内容以章节路径开头，metadata 中记录 section；同一章节被切成多个块时，
+    整节内容作为父段落（不超过 parent_max_chars 个字符）由 chunk() 一并返回，块中记录 parent_id，
+    检索到同一章节的多个块时可以换成整节内容。method="recursive" 时与原来一样只按字符数切分。
+    """
+
+    def __init__(
+        self,
+        method: str = "structure",
+        chunk_size: int = 800,
+        chunk_overlap: int = 80,
+        parent_max_chars: int = 4000,
+        csv_rows: int = 20,
+        **kwargs,
+    ):
+        if method not in CHUNK_METHODS:
+            raise ValueError(f"不支持的切块方式: {method}")
+        super().__init__(chunk_size=chunk_size, chunk_overlap=chunk_overlap, **kwargs)
+        self.method = method
+        self._parent_max_chars = parent_max_chars
+        self._csv_rows = max(1, csv_rows)
+        self._splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size, chunk_overlap=chunk_overlap, separators=_SEPARATORS
+        )
+
+    @classmethod
+    def from_config(cls) -> "StructureAwareChunker":
+        config = Config.get_instance().get_with_default({}, "indexing", "chunking") or {}
+        return cls(
+            method=config.get("method", "structure"),
+            chunk_size=config.get("chunk-size", 800),
+            chunk_overlap=config.get("chunk-overlap", 80),
+            parent_max_chars=config.get("parent-max-chars", 4000),
+            csv_rows=config.get("csv-rows", 20),
+        )
+
+    @property
+    def signature(self) -> str:
+        """
+        记录在索引清单中，切块方式或参数改变后需要全量重建索引。
+        包含加载器版本：加载器改变后即使按字符切分，块的内容也不同，不能与旧索引中的块混用
+        """
+        signature = f"{self.method}:{self._chunk_size}:{self._chunk_overlap}:loader{LOADER_VERSION}"
+        if self.method == "structure":
+            signature += f":{self._parent_max_chars}:{self._csv_rows}:v{_STRUCTURE_VERSION}"
+        return signature
+
+    def split_text(self, text: str) -> List[str]:
+        return self._splitter.split_text(text)
+
+    def split_documents(self, documents: Iterable[Document]) -> List[Document]:
+        chunks, _ = self.chunk(documents)
+        return chunks
+
+    def chunk(self, documents: Iterable[Document]) -> Tuple[List[Document], List[Document]]:
+        """返回 (块, 父段落)；父段落的 id 即块 metadata 中的 parent_id，只保存不参与向量检索"""
+        by_source: Dict[str, List[Document]] = {}
+        for doc in documents:
+            by_source.setdefault(doc.metadata.get("source", ""), []).append(doc)
+
+        chunks, parents = [], []
+        for source, docs in by_source.items():
+            ext = os.path.splitext(source)[1].lower()
+            if self.method == "recursive":
+                chunks.extend(self._splitter.split_documents(self._merge_elements(docs)))
+            elif ext == ".csv":
+                chunks.extend(self._csv_chunks(docs))
+            else:
+                if "category" in docs[0].metadata:
+                    sections = self._element_sections(docs)
+                else:
+                    sections = self._line_sections(docs, markdown=ext == ".md")
+                self._section_chunks(sections, chunks, parents)
+        return chunks, parents
+
+    @staticmethod
+    def _merge_elements(docs: List[Document]) -> List[Document]:
+        """elements 方式加载的 DOCX 每个元素是一个文档，字符切分前先按文件合并"""
+        if "category" not in docs[0].metadata:
+            return docs
+        text = "\n\n".join(doc.page_content for doc in docs)
+        return [Document(page_content=text, metadata={"source": docs[0].metadata.get("source")})]
+
+    def _line_sections(self, docs: List[Document], markdown: bool) -> List[_Section]:
+        outline = _Outline()
+        for doc in docs:
+            table: List[str] = []
+            in_fence = False
+            for line in doc.page_content.splitlines():
+                stripped = line.strip()
+                if markdown and _FENCE.match(stripped):
+                    in_fence = not in_fence
+                if not in_fence and stripped and _TABLE_ROW.match(line):
+                    table.append(stripped)
+                    continue
+                if len(table) >= 2:
+                    outline.current.append("table", "\n".join(table), doc.metadata)
+                elif table:
+                    outline.current.append("text", table[0], doc.metadata)
+                table = []
+                if not stripped:
+                    continue
+                level, title = None, stripped
+                if markdown and not in_fence:
+                    match = _MARKDOWN_HEADING.match(stripped)
+                    if match:
+                        level, title = len(match.group(1)), match.group(2)
+                elif not markdown:
+                    level = _heading_level(stripped)
+                if level is not None:
+                    outline.heading(level, title)
+                else:
+                    outline.current.append("text", stripped, doc.metadata)
+            if len(table) >= 2:
+                outline.current.append("table", "\n".join(table), doc.metadata)
+            elif table:
+                outline.current.append("text", table[0], doc.metadata)
+        return outline.sections
+
+    @staticmethod
+    def _element_sections(docs: List[Document]) -> List[_Section]:
+        outline = _Outline()
+        for doc in docs:
+            text = doc.page_content.strip()
+            if not text:
+                continue
+            metadata = {"source": doc.metadata.get("source")}
+            if doc.metadata.get("page_number") is not None:
+                metadata["page"] = doc.metadata["page_number"]
+            category = doc.metadata.get("category")
+            if category == "Title":
+                outline.heading((doc.metadata.get("category_depth") or 0) + 1, text)
+            elif category == "Table":
+                outline.current.append("table", text, metadata)
+            else:
+                outline.current.append("text", text, metadata)
+        return outline.sections
+
+    def _split_table(self, text: str) -> List[str]:
+        """表格不超过 2 倍 chunk_size 时整体保留，否则按行分组，每组前重复表头"""
+        if len(text) <= 2 * self._chunk_size:
+            return [text]
+        lines = text.split("\n")
+        header = lines[:2] if len(lines) > 2 and set(lines[1]) <= set("|-:+ ") else lines[:1]
+        groups, group = [], []
+        size = sum(len(line) + 1 for line in header)
+        for line in lines[len(header):]:
+            if group and size + len(line) + 1 > self._chunk_size:
+                groups.append("\n".join(header + group))
+                group, size = [], sum(len(h) + 1 for h in header)
+            group.append(line)
+            size += len(line) + 1
+        if group:
+            groups.append("\n".join(header + group))
+        return groups
+
+    def _section_chunks(
+        self, sections: List[_Section], chunks: List[Document], parents: List[Document]
+    ):
+        # 上一个只有一个块的小章节，后面的小章节可以并入其中
+        packed: Optional[Tuple[Document, List[str]]] = None
+        for section in sections:
+            pieces: List[Tuple[str, Dict]] = []
+            for kind, text, metadata in section.blocks:
+                texts = self._split_table(text) if kind == "table" else self._splitter.split_text(text)
+                for piece in texts:
+                    # 同一页内相邻的短片段合并到 chunk_size 以内
+                    if (
+                        pieces
+                        and pieces[-1][1] == metadata
+                        and len(pieces[-1][0]) + len(piece) + 1 <= self._chunk_size
+                    ):
+                        pieces[-1] = (f"{pieces[-1][0]}\n{piece}", metadata)
+                    else:
+                        pieces.append((piece, metadata))
+            if not pieces:
+                continue
+
+            title = " > ".join(section.path)
+            if len(pieces) == 1:
+                text, metadata = pieces[0]
+                content = f"{title}\n{text}" if title else text
+                if (
+                    packed is not None
+                    and packed[0].metadata.get("source") == metadata.get("source")
+                    and packed[0].metadata.get("page") == metadata.get("page")
+                    and len(packed[0].page_content) + len(content) + 1 <= self._chunk_size
+                ):
+                    # 小章节合并为一个块，章节路径取两者的公共部分
+                    doc, path = packed
+                    common = []
+                    for a, b in zip(path, section.path):
+                        if a != b:
+                            break
+                        common.append(a)
+                    doc.page_content = f"{doc.page_content}\n{content}"
+                    doc.metadata[SECTION_KEY] = " > ".join(common)
+                    packed = (doc, common)
+                    continue
+                doc = Document(page_content=content, metadata={**metadata, SECTION_KEY: title})
+                chunks.append(doc)
+                packed = (doc, section.path)
+                continue
+
+            packed = None
+            parent_id = None
+            if self._parent_max_chars > 0:
+                full = "\n".join(text for kind, text, _ in section.blocks)
+                if title:
+                    full = f"{title}\n{full}"
+                if len(full) <= self._parent_max_chars:
+                    parent_id = str(uuid.uuid4())
+                    parents.append(
+                        Document(
+                            id=parent_id,
+                            page_content=full,
+                            metadata={**pieces[0][1], SECTION_KEY: title},
+                        )
+                    )
+            for text, metadata in pieces:
+                metadata = {**metadata, SECTION_KEY: title}
+                if parent_id is not None:
+                    metadata[PARENT_KEY] = parent_id
+                chunks.append(
+                    Document(page_content=f"{title}\n{text}" if title else text, metadata=metadata)
+                )
+
+    def _csv_chunks(self, docs: List[Document]) -> List[Document]:
+        """CSVLoader 每行一个文档，按行分组，section 记录行号范围"""
+        chunks, group, size = [], [], 0
+
+        def flush():
+            first, last = group[0].metadata.get("row", 0), group[-1].metadata.get("row", 0)
+            chunks.append(
+                Document(
+                    page_content="\n\n".join(doc.page_content for doc in group),
+                    metadata={
+                        "source": group[0].metadata.get("source"),
+                        "row": first,
+                        SECTION_KEY: f"第 {first + 1}-{last + 1} 行",
+                    },
+                )
+            )
+
+        for doc in docs:
+            if group and (
+                len(group) >= self._csv_rows or size + len(doc.page_content) > self._chunk_size
+            ):
+                flush()
+                group, size = [], 0
+            group.append(doc)
+            size += len(doc.page_content) + 2
+        if group:
+            flush()
+        return chunks
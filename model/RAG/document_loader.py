@@ -0,0 +1,218 @@
+'''知识库文档加载：按扩展名把文件分发给对应的加载器，在同一个有界线程池或进程池中解析，并以生成器形式逐个输出'''
+import itertools
+import multiprocessing
+import os
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from langchain_community.document_loaders import (
+    PyPDFLoader,
+    MHTMLLoader,
+    TextLoader,
+    CSVLoader,
+)
+from langchain_community.document_loaders import (
+    UnstructuredWordDocumentLoader,
+    UnstructuredHTMLLoader,
+)
+
+# 文件扩展名到加载器的映射
+# 要利用json数据要设置jq语句和content_key提取特定字段，这在不同json数据结构中有所不同，较为繁琐，暂不支持。
+LOADER_MAPPING = {
+    ".pdf": (PyPDFLoader, {}),
+    # 按元素加载以保留标题样式与表格，切块时据此划分章节
+    ".docx": (UnstructuredWordDocumentLoader, {"mode": "elements"}),
+    ".txt": (TextLoader, {"autodetect_encoding": True}),
+    ".csv": (CSVLoader, {"autodetect_encoding": True}),
+    ".html": (UnstructuredHTMLLoader, {}),
+    ".mhtml": (MHTMLLoader, {}),
+    # 读取原文，切块时按 # 标题划分章节
+    ".md": (TextLoader, {"autodetect_encoding": True}),
+}
+
+SOURCE_EXTENSIONS = tuple(LOADER_MAPPING)
+
+# 加载器输出的文档改变时递增（2: .md 读取原文、.docx 按元素加载），记录在切块签名中，旧索引据此全量重建
+LOADER_VERSION = 2
+
+DEFAULT_WORKERS = min(8, os.cpu_count() or 1)
+
+# thread: 线程池解析，适合文件少、以IO为主的场景
+# process: 进程池解析，PDF/DOCX/HTML 的解析受GIL限制，多核机器上用进程池才能真正并行
+LOADER_MODES = ("thread", "process")
+
+# 子进程超时未返回时，父进程额外等待的时间，也是父进程检查超时的间隔
+_TIMEOUT_GRACE = 5
+
+
+def load_file(path: str) -> List[Document]:
+    """按扩展名选择加载器读取单个文件，解析失败时返回空列表"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in LOADER_MAPPING:
+        return []
+    loader_cls, loader_kwargs = LOADER_MAPPING[ext]
+    try:
+        return loader_cls(path, **loader_kwargs).load()
+    except Exception as e:
+        print(f"加载文件 {path} 失败: {e}")
+        return []
+
+
+# 进程池的每个子进程在共享数组中占两个位置，记录正在解析的任务序号与开始时间，父进程据此计算超时
+_worker_starts = None
+_worker_slot = 0
+
+
+def _init_process_worker(starts, counter):
+    global _worker_starts, _worker_slot
+    with counter.get_lock():
+        _worker_slot = counter.value
+        counter.value += 1
+    _worker_starts = starts
+
+
+def _load_file_in_process(path: str, timeout: Optional[float], task: int = 0) -> List[Tuple[str, Dict]]:
+    """在子进程中解析文件，只把纯文本和元数据传回父进程"""
+    if _worker_starts is not None:
+        # monotonic 为系统范围的时钟，父子进程的读数可以直接比较
+        with _worker_starts.get_lock():
+            _worker_starts[2 * _worker_slot] = task
+            _worker_starts[2 * _worker_slot + 1] = time.monotonic()
+    use_alarm = bool(timeout) and hasattr(signal, "SIGALRM")
+    if use_alarm:
+        def _on_timeout(signum, frame):
+            raise TimeoutError(f"解析超过 {timeout} 秒")
+
+        signal.signal(signal.SIGALRM, _on_timeout)
+        signal.alarm(max(1, int(timeout)))
+    try:
+        docs = load_file(path)
+    finally:
+        if use_alarm:
+            signal.alarm(0)
+    return [(doc.page_content, doc.metadata) for doc in docs]
+
+
+def _load_file_timed(started: List[float], path: str) -> List[Document]:
+    """线程池中运行，开始解析时记下时间，排队等待线程的时间不计入超时"""
+    started.append(time.monotonic())
+    return load_file(path)
+
+
+def _process_context():
+    methods = multiprocessing.get_all_start_methods()
+    if "forkserver" not in methods:
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    # forkserver 默认预先导入 __main__（app.py 及其依赖），改为只预先导入本模块，子进程 fork 出来时已导入各加载器
+    context.set_forkserver_preload([__name__])
+    return context
+
+
+def _process_starts(starts) -> Dict[int, float]:
+    """{任务序号: 子进程开始解析的时间}"""
+    with starts.get_lock():
+        values = starts[:]
+    return {int(values[i]): values[i + 1] for i in range(0, len(values), 2) if values[i]}
+
+
+def iter_documents(
+    paths: Iterable[str],
+    max_workers: int = DEFAULT_WORKERS,
+    mode: str = "thread",
+    file_timeout: Optional[float] = None,
+) -> Iterator[Tuple[str, List[Document]]]:
+    """
+    在一个线程池或进程池中并发解析文件，按完成顺序产出 (路径, 文档列表)。
+    同时在途的文件数不超过 max_workers，调用方逐个消费时不会把整个语料读入内存。
+    file_timeout 为单个文件的解析时限（秒），从工作线程或子进程真正开始解析时计时，在队列中等待的时间不计入，
+    超时的文件记录日志后跳过，不会拖住整个构建。进程池中子进程到时会自行中断解析；线程池中无法中断卡住的线程，超时的文件只是不再等待其结果，
+    该线程在解析结束前一直占用，排在后面的文件等到有空闲线程时才开始计时。
+    """
+    if mode not in LOADER_MODES:
+        raise ValueError(f"不支持的解析模式: {mode}")
+
+    if mode == "process":
+        # 调用方（Django、预热与构建队列）已有多个线程在运行，fork 可能把其他线程持有的锁带进子进程导致死锁，
+        # 改用 forkserver（不支持时用 spawn）启动子进程。子进程仍会以 __mp_main__ 的名义重新导入主模块，
+        # 入口脚本中启动服务的代码须放在 if __name__ == "__main__" 之下
+        context = _process_context()
+        starts = context.Array("d", 2 * max_workers)
+        executor = ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=context,
+            initializer=_init_process_worker,
+            initargs=(starts, context.Value("i", 0)),
+        )
+
+        def submit(path, started, task):
+            return executor.submit(_load_file_in_process, path, file_timeout, task)
+
+    else:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+
+        def submit(path, started, task):
+            return executor.submit(_load_file_timed, started, path)
+
+    paths = iter(paths)
+    tasks = itertools.count(1)
+    # future -> (路径, 开始解析的时间, 任务序号)；线程池中由工作线程写入开始时间，进程池中从子进程记录的共享数组中读取
+    pending = {}
+    timed_out = False
+
+    def add(path):
+        started, task = [], next(tasks)
+        pending[submit(path, started, task)] = (path, started, task)
+
+    try:
+        for path in paths:
+            add(path)
+            if len(pending) >= max_workers:
+                break
+
+        while pending:
+            done, _ = wait(
+                pending,
+                timeout=_TIMEOUT_GRACE if file_timeout else None,
+                return_when=FIRST_COMPLETED,
+            )
+            for future in done:
+                path, _started, _task = pending.pop(future)
+                try:
+                    docs = future.result()
+                except Exception as e:
+                    print(f"加载文件 {path} 失败: {e}")
+                    docs = []
+                if mode == "process":
+                    docs = [
+                        Document(page_content=content, metadata=metadata)
+                        for content, metadata in docs
+                    ]
+                yield path, docs
+
+            if file_timeout:
+                deadline = time.monotonic() - file_timeout - _TIMEOUT_GRACE
+                running = _process_starts(starts) if mode == "process" else {}
+                for future, (path, started, task) in list(pending.items()):
+                    if not started and task in running:
+                        started.append(running[task])
+                    if started and started[0] < deadline and not future.done():
+                        print(f"加载文件 {path} 超时，已跳过")
+                        future.cancel()
+                        del pending[future]
+                        timed_out = True
+
+            while len(pending) < max_workers:
+                next_path = next(paths, None)
+                if next_path is None:
+                    break
+                add(next_path)
+    finally:
+        if timed_out and mode == "process":
+            # 超时的子进程可能仍卡在解析中，直接结束整个进程池
+            for process in list(getattr(executor, "_processes", {}).values()):
+                process.terminate()
+        executor.shutdown(wait=not timed_out, cancel_futures=True)
@@ -0,0 +1,175 @@
+'''向量模型变化后的索引迁移：旧索引继续提供检索，后台限速地用新模型重新向量化全部块，完成后整体替换'''
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores.faiss import FAISS
+
+from config.config import Config
+from model.RAG.index_factory import create_index, index_kind, min_training_samples, needs_training
+from model.RAG.index_store import IndexStore
+from model.RAG.lexical_index import LexicalIndex
+
+
+def embedding_dimension(embedding: Embeddings) -> int:
+    dimension = getattr(embedding, "dimension", None)
+    if dimension is None:
+        dimension = len(embedding.embed_query("维度"))
+    return dimension
+
+
+def embedding_matches(
+    manifest: Dict, model_name: str, model_version: Optional[str], embedding: Embeddings
+) -> bool:
+    """清单中记录的向量模型名称、版本与维度都与当前模型一致时，索引中的向量才能继续使用"""
+    if manifest.get("embedding-model") != model_name:
+        return False
+    if manifest.get("embedding-version") != model_version:
+        return False
+    dimension = manifest.get("embedding-dim")
+    return dimension is None or dimension == embedding_dimension(embedding)
+
+
+def load_migration_config() -> Dict:
+    config = Config.get_instance().get_with_default({}, "model", "embedding", "migration") or {}
+    return {
+        "batch_size": config.get("batch-size", 64),
+        "chunks_per_second": config.get("chunks-per-second", 50),
+    }
+
+
+class EmbeddingMigration(threading.Thread):
+    """
+    直接读取旧索引 docstore 中的块用新模型重新向量化，不重新解析源文件，chunk_id 与文件清单保持不变。
+    新索引写入 index_store 后调用 on_done(新向量库, 倒排索引)，由调用方替换检索器。
+    向量化按 chunks_per_second 限速，避免与在线检索争抢CPU；新向量写入向量缓存，
+    进程中途退出后再次迁移时已完成的部分直接命中缓存。
+    需要训练的索引先向量化随机抽取的训练样本并创建索引，其余的块每批向量化后直接加入索引，内存中不保留全部向量。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        vectorstore: FAISS,
+        lexical_index: Optional[LexicalIndex],
+        files: Dict[str, Dict],
+        index_store: IndexStore,
+        embedding: Embeddings,
+        model_name: str,
+        model_version: Optional[str],
+        index_config: Dict,
+        on_done: Callable[[FAISS, Optional[LexicalIndex]], None],
+        batch_size: int = 64,
+        chunks_per_second: float = 50,
+        chunker: Optional[str] = None,
+    ):
+        super().__init__(name=f"embedding-migration:{name}", daemon=True)
+        # 迁移期间仍用旧向量库提供检索
+        self.vectorstore = vectorstore
+        self.lexical_index = lexical_index
+        self.files = files
+        self._index_store = index_store
+        self._embedding = embedding
+        self._model_name = model_name
+        self._model_version = model_version
+        self._index_config = index_config
+        self._on_done = on_done
+        self._batch_size = max(1, batch_size)
+        self._chunks_per_second = chunks_per_second
+        # 切块方式不变，新清单中沿用旧索引的记录
+        self._chunker = chunker
+        self.progress = 0
+
+    def run(self):
+        started = time.monotonic()
+        try:
+            vectorstore = self._migrate()
+        except Exception as e:
+            print(f"向量迁移 {self._index_store.index_path} 失败，继续使用旧索引: {e}")
+            return
+        print(
+            f"向量迁移 {self._index_store.index_path} 完成: {self.progress} 个块, "
+            f"耗时 {time.monotonic() - started:.1f}s"
+        )
+        self._on_done(vectorstore, self.lexical_index)
+
+    def _sample_size(self, total: int) -> int:
+        if not needs_training(self._index_config):
+            return 0
+        return min(total, max(self._index_config["train-size"], min_training_samples(self._index_config)))
+
+    def _embed_batches(
+        self, old: FAISS, ids: List[str], positions: np.ndarray, started: float
+    ) -> Iterator[Tuple[List[str], List[Document], np.ndarray]]:
+        """按 positions 的顺序分批取出旧 docstore 中的块并向量化，产出 (chunk_id, 文档, 向量)"""
+        for start in range(0, len(positions), self._batch_size):
+            batch_ids = [ids[p] for p in positions[start : start + self._batch_size]]
+            docs = [old.docstore.search(doc_id) for doc_id in batch_ids]
+            vectors = np.asarray(
+                self._embedding.embed_documents([doc.page_content for doc in docs]), dtype=np.float32
+            )
+            self.progress += len(docs)
+            if self._chunks_per_second > 0:
+                delay = self.progress / self._chunks_per_second - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            yield batch_ids, docs, vectors
+
+    def _migrate(self) -> FAISS:
+        old = self.vectorstore
+        ids = [doc_id for _, doc_id in sorted(old.index_to_docstore_id.items())]
+        # 随机抽取训练样本，先向量化这些块；新索引中块的位置按向量化的顺序编号
+        rng = np.random.default_rng(0)
+        sampled = np.sort(rng.choice(len(ids), self._sample_size(len(ids)), replace=False))
+        rest = np.setdiff1d(np.arange(len(ids)), sampled)
+
+        docstore = InMemoryDocstore()
+        index_to_docstore_id = {}
+
+        def add_docs(batch_ids, docs):
+            start = len(index_to_docstore_id)
+            # 块的文档对象不变，直接与旧 docstore 共用
+            docstore.add(dict(zip(batch_ids, docs)))
+            index_to_docstore_id.update({start + j: doc_id for j, doc_id in enumerate(batch_ids)})
+
+        started = time.monotonic()
+        index, sample = None, None
+        for batch_ids, docs, vectors in self._embed_batches(old, ids, sampled, started):
+            if sample is None:
+                sample = np.empty((len(sampled), vectors.shape[1]), dtype=np.float32)
+            sample[len(index_to_docstore_id) : len(index_to_docstore_id) + len(vectors)] = vectors
+            add_docs(batch_ids, docs)
+        if sample is not None:
+            index = create_index(sample, self._index_config)
+            index.add(sample)
+            del sample
+        for batch_ids, docs, vectors in self._embed_batches(old, ids, rest, started):
+            if index is None:
+                index = create_index(vectors, self._index_config)
+            index.add(vectors)
+            add_docs(batch_ids, docs)
+
+        vectorstore = FAISS(self._embedding, index, docstore, index_to_docstore_id)
+        # 父段落不参与向量检索，原样复制到新的 docstore
+        parents = {}
+        for entry in self.files.values():
+            for parent_id in entry.get("parent_ids", []):
+                parent = old.docstore.search(parent_id)
+                if isinstance(parent, Document):
+                    parents[parent_id] = parent
+        if parents:
+            vectorstore.docstore.add(parents)
+        self._index_store.save(
+            vectorstore,
+            self.files,
+            self._model_name,
+            index_kind(self._index_config),
+            self.lexical_index,
+            self._model_version,
+            self._chunker,
+        )
+        return vectorstore
@@ -0,0 +1,60 @@
+'''向量检索与 BM25 检索的结果按倒数排名融合（RRF）'''
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_community.vectorstores.faiss import FAISS
+from pydantic import ConfigDict
+
+from model.RAG.index_factory import reconstruct_vectors, search_vectors
+from model.RAG.lexical_index import LexicalIndex
+from model.RAG.scored_retriever import with_score
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], rrf_k: int = 60) -> List[Tuple[str, float]]:
+    """每个结果的得分为其在各路排名中 1/(rrf_k + 名次) 之和，不需要对不同检索的分数做归一化"""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (rrf_k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class HybridRetriever(BaseRetriever):
+    """与 vectorstore.as_retriever 返回的检索器一样带有 vectorstore 与 search_kwargs，可直接替换"""
+
+    vectorstore: FAISS
+    lexical_index: LexicalIndex
+    search_kwargs: dict = {"k": 6}
+    # 每路检索的候选数
+    fetch_k: int = 20
+    rrf_k: int = 60
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def _dense_search(self, query: str, k: int) -> Dict[str, Optional[np.ndarray]]:
+        """返回 {chunk_id: 向量}，按相似度排序；索引无法取出向量时值为None"""
+        embedding = self.vectorstore.embedding_function.embed_query(query)
+        _, positions = search_vectors(self.vectorstore, np.array([embedding], dtype=np.float32), k)
+        positions = positions[0][positions[0] != -1]
+        vectors = reconstruct_vectors(self.vectorstore.index, positions)
+        return {
+            self.vectorstore.index_to_docstore_id[position]: None if vectors is None else vectors[i]
+            for i, position in enumerate(positions)
+        }
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun, **kwargs
+    ) -> List[Document]:
+        k = kwargs.get("k", self.search_kwargs.get("k", 4))
+        fetch_k = max(self.fetch_k, k)
+        dense = self._dense_search(query, fetch_k)
+        lexical = [chunk_id for chunk_id, _ in self.lexical_index.search(query, fetch_k)]
+        docs = []
+        for chunk_id, score in reciprocal_rank_fusion([list(dense), lexical], self.rrf_k)[:k]:
+            doc = self.vectorstore.docstore.search(chunk_id)
+            if isinstance(doc, Document):
+                docs.append(with_score(doc, score, "rrf", dense.get(chunk_id)))
+        return docs
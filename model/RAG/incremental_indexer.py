@@ -0,0 +1,383 @@
+'''基于文件内容哈希的增量索引：只向量化新增或修改过的文件，并删除已移除文件的向量'''
+import hashlib
+import os
+import uuid
+from contextlib import nullcontext
+from typing import Callable, ContextManager, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores.faiss import FAISS
+from langchain_text_splitters import TextSplitter
+
+from model.RAG.chunker import LEGACY_SIGNATURE, StructureAwareChunker
+from model.RAG.document_loader import iter_documents, DEFAULT_WORKERS
+from model.RAG.embedding_migration import embedding_matches
+from model.RAG.index_factory import (
+    apply_search_params,
+    create_index,
+    enable_reconstruct,
+    index_kind,
+    is_flat,
+    load_index_config,
+    rebuild_index,
+    remove_positions,
+    train_index,
+)
+from model.RAG.index_store import IndexStore, scan_sources
+from model.RAG.lexical_index import LexicalIndex
+
+# 累积到这么多个块再统一向量化写入索引，减少小批量调用
+_EMBED_BATCH_CHUNKS = 256
+
+_HASH_BLOCK_SIZE = 1024 * 1024
+
+# HNSW 中已删除的位置超过这个比例后，用剩余的向量重建索引
+_MAX_DELETED_RATIO = 0.2
+
+
+def file_sha256(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class IncrementalIndexer(object):
+    """
+    维护 {相对路径: {size, mtime, sha256, chunk_ids, parent_ids}} 形式的文件清单。
+    size 与 mtime 都没变的文件直接跳过；变化的文件再比较 sha256，
+    内容确实改变时才删除旧的块并重新向量化，清单随索引一起保存在 IndexStore 中。
+    scope 不为空时只同步 source_dir/scope 子目录，清单中其他子目录的文件与块保持不变，
+    用于多个用户共用一个索引的情况。
+    使用 StructureAwareChunker 切块时，章节的父段落与块保存在同一个 docstore 中，但不加入向量索引。
+    """
+
+    def __init__(
+        self,
+        source_dir: str,
+        index_store: IndexStore,
+        embedding: Embeddings,
+        embedding_model: str,
+        text_splitter: TextSplitter,
+        max_workers: int = DEFAULT_WORKERS,
+        loader_mode: str = "thread",
+        file_timeout: Optional[float] = None,
+        index_config: Optional[Dict] = None,
+        lexical: bool = False,
+        known_hashes: Optional[Dict[str, Dict]] = None,
+        scope: Optional[str] = None,
+        chunk_metadata: Optional[Dict] = None,
+        files: Optional[Dict[str, Dict]] = None,
+        autosave: bool = True,
+        write_lock: Optional[Callable[[], ContextManager]] = None,
+        embedding_version: Optional[str] = None,
+        position_listener: Optional[Callable[[str, np.ndarray], None]] = None,
+    ):
+        self._source_dir = source_dir
+        self._index_store = index_store
+        self._embedding = embedding
+        self._embedding_model = embedding_model
+        self._embedding_version = embedding_version
+        self._text_splitter = text_splitter
+        # 切块方式与参数，记录在清单中，改变后全量重建
+        self._chunker = getattr(text_splitter, "signature", None)
+        self._max_workers = max_workers
+        self._loader_mode = loader_mode
+        self._file_timeout = file_timeout
+        self._index_config = index_config or load_index_config()
+        # 是否同时维护 BM25 倒排索引，sync 之后通过 lexical_index 取得
+        self._lexical = lexical
+        self.lexical_index: Optional[LexicalIndex] = None
+        # 上传时已计算的 {相对路径: {size, mtime, sha256}}，大小与修改时间一致时不再重新读取文件计算哈希
+        self._known_hashes = known_hashes or {}
+        self._scope = scope
+        # 写入每个块 metadata 的附加字段，如共用索引中块的所有者
+        self._chunk_metadata = chunk_metadata or {}
+        # 调用方在内存中维护的清单，提供时不读取磁盘上的清单，也不从磁盘加载索引
+        self._files = files
+        # autosave=False 时 sync 不写磁盘，由调用方决定何时保存
+        self._autosave = autosave
+        # 修改向量库时持有的锁，向量化在锁外进行，检索只在索引真正被修改时等待
+        self._write_lock = write_lock or nullcontext
+        # 向量在索引中的位置变化时在写锁内调用 position_listener(事件, 位置)：add 为新增的位置；
+        # remove 为删除的位置，其后的位置依次前移；delete 为删除但其余位置不变（HNSW 中只从 index_to_docstore_id 移除）
+        self._position_listener = position_listener or (lambda event, positions: None)
+        # 最近一次 sync 之后的完整清单
+        self.files: Dict[str, Dict] = {}
+        # 最近一次 sync 是否改动了索引，调用方据此决定是否让检索缓存失效
+        self.changed = False
+
+    def _stored_files(self) -> Dict[str, Dict]:
+        if self._files is not None:
+            return self._files
+        manifest = self._index_store.read_manifest()
+        if not manifest or not embedding_matches(
+            manifest, self._embedding_model, self._embedding_version, self._embedding
+        ):
+            return {}
+        if manifest.get("index-type", "flat") != index_kind(self._index_config):
+            # 索引类型或向量存储方式改变后需要全量重建
+            return {}
+        if self._chunker is not None and manifest.get("chunker", LEGACY_SIGNATURE) != self._chunker:
+            return {}
+        return manifest.get("files", {})
+
+    def sync(
+        self,
+        vectorstore: Optional[FAISS] = None,
+        lexical_index: Optional[LexicalIndex] = None,
+    ) -> Optional[FAISS]:
+        """
+        将向量库与源文件目录同步，返回更新后的向量库（目录中没有可用文档时返回None）。
+        vectorstore / lexical_index 为当前内存中的向量库与倒排索引，为None时从磁盘加载。
+        """
+        self.changed = False
+        self.lexical_index = lexical_index
+        stored_files = self._stored_files()
+        if not stored_files:
+            # 没有可用的旧清单，所有文件都需要重新向量化
+            vectorstore = None
+            self.lexical_index = None
+
+        prefix = f"{self._scope}/" if self._scope else ""
+        if prefix:
+            current = {
+                prefix + relpath: stat
+                for relpath, stat in scan_sources(os.path.join(self._source_dir, self._scope)).items()
+            }
+            other_files = {k: v for k, v in stored_files.items() if not k.startswith(prefix)}
+            scoped_files = {k: v for k, v in stored_files.items() if k.startswith(prefix)}
+        else:
+            current = scan_sources(self._source_dir)
+            other_files, scoped_files = {}, stored_files
+        files = {}
+        changed = {}
+        for relpath, stat in current.items():
+            old = scoped_files.get(relpath)
+            if old and old["size"] == stat["size"] and old["mtime"] == stat["mtime"]:
+                files[relpath] = old
+                continue
+            sha256 = self._file_sha256(relpath, stat)
+            if old and old["sha256"] == sha256:
+                # 仅修改时间变化，内容未变
+                files[relpath] = {**old, **stat}
+                continue
+            changed[relpath] = (stat, sha256)
+
+        stale_ids, stale_parent_ids = [], []
+        for relpath, entry in scoped_files.items():
+            if relpath not in files:
+                stale_ids.extend(entry.get("chunk_ids", []))
+                stale_parent_ids.extend(entry.get("parent_ids", []))
+
+        if vectorstore is None and stored_files and self._files is None:
+            # 没有变化时以mmap方式只读加载，需要修改时完整读入内存
+            vectorstore = self._index_store.load(
+                self._embedding, mmap=not (changed or stale_ids)
+            )
+            if vectorstore is None:
+                return self._rebuild()
+            if self._lexical:
+                self.lexical_index = self._index_store.load_lexical()
+        elif vectorstore is not None and (changed or stale_ids) and IndexStore.is_read_only(vectorstore):
+            # mmap加载的IVF索引倒排表只读，修改前重新完整读入内存
+            vectorstore = self._index_store.load(self._embedding, mmap=False)
+            if vectorstore is None:
+                return self._rebuild()
+        lexical_rebuilt = False
+        if vectorstore is not None:
+            apply_search_params(vectorstore.index, self._index_config)
+            # 之前保存的 IVF 索引没有 direct map，检索结果无法附带向量供重排序使用
+            enable_reconstruct(vectorstore.index)
+            if self._lexical and (
+                self.lexical_index is None
+                or len(self.lexical_index) != len(vectorstore.index_to_docstore_id)
+            ):
+                # 刚开启混合检索或倒排索引与向量库不一致时，从 docstore 中的块重建
+                self.lexical_index = self._build_lexical(vectorstore)
+                lexical_rebuilt = True
+
+        # 删除被修改或已移除文件的旧向量
+        if stale_ids:
+            live_ids = set(vectorstore.index_to_docstore_id.values())
+            stale_ids = [i for i in stale_ids if i in live_ids]
+            if stale_ids:
+                vectorstore = self._delete(vectorstore, stale_ids)
+                if self.lexical_index is not None:
+                    with self._write_lock():
+                        self.lexical_index.remove(stale_ids)
+            if stale_parent_ids:
+                self._delete_parents(vectorstore, stale_parent_ids)
+
+        # 只解析变化的文件，解析结果以流的形式切块并分批写入索引
+        added = 0
+        pending_docs, pending_ids, pending_parents = [], [], []
+        paths = (os.path.join(self._source_dir, relpath) for relpath in changed)
+        for path, docs in iter_documents(
+            paths, self._max_workers, self._loader_mode, self._file_timeout
+        ):
+            relpath = os.path.relpath(path, self._source_dir).replace(os.sep, "/")
+            stat, sha256 = changed[relpath]
+            splits, parents = self._split(docs)
+            for split in splits + parents:
+                split.metadata.update(self._chunk_metadata)
+            ids = [str(uuid.uuid4()) for _ in splits]
+            files[relpath] = {**stat, "sha256": sha256, "chunk_ids": ids}
+            if parents:
+                files[relpath]["parent_ids"] = [parent.id for parent in parents]
+            pending_docs.extend(splits)
+            pending_ids.extend(ids)
+            pending_parents.extend(parents)
+            if len(pending_docs) >= _EMBED_BATCH_CHUNKS:
+                vectorstore = self._add(vectorstore, pending_docs, pending_ids, pending_parents)
+                added += len(pending_docs)
+                pending_docs, pending_ids, pending_parents = [], [], []
+        if pending_docs:
+            vectorstore = self._add(vectorstore, pending_docs, pending_ids, pending_parents)
+            added += len(pending_docs)
+
+        if vectorstore is not None and not vectorstore.index_to_docstore_id:
+            vectorstore = None
+        if vectorstore is None:
+            self.lexical_index = None
+
+        files.update(other_files)
+        self.files = files
+        if changed or stale_ids or files != stored_files or lexical_rebuilt:
+            self.changed = True
+            print(
+                f"增量索引 {self._source_dir}: 新增/修改 {len(changed)} 个文件, "
+                f"新增 {added} 个块, 删除 {len(stale_ids)} 个块"
+            )
+            if self._autosave:
+                self.save(vectorstore)
+        return vectorstore
+
+    def save(self, vectorstore: Optional[FAISS]):
+        """将向量库与最近一次 sync 得到的清单写入 IndexStore，向量库为None时清空"""
+        if vectorstore is None:
+            self._index_store.clear()
+            return
+        try:
+            self._index_store.save(
+                vectorstore,
+                self.files,
+                self._embedding_model,
+                index_kind(self._index_config),
+                self.lexical_index,
+                self._embedding_version,
+                self._chunker,
+            )
+        except OSError as e:
+            print(f"保存索引 {self._index_store.index_path} 失败: {e}")
+
+    def _split(self, docs: List[Document]) -> Tuple[List[Document], List[Document]]:
+        """返回 (块, 父段落)，普通的 TextSplitter 没有父段落"""
+        if isinstance(self._text_splitter, StructureAwareChunker):
+            return self._text_splitter.chunk(docs)
+        return self._text_splitter.split_documents(docs), []
+
+    def _file_sha256(self, relpath: str, stat: Dict) -> str:
+        known = self._known_hashes.get(relpath)
+        if known and known["size"] == stat["size"] and known["mtime"] == stat["mtime"]:
+            return known["sha256"]
+        return file_sha256(os.path.join(self._source_dir, relpath))
+
+    def _rebuild(self) -> Optional[FAISS]:
+        """磁盘上的索引损坏时丢弃清单，全量重建"""
+        self._index_store.clear()
+        return self.sync()
+
+    @staticmethod
+    def _build_lexical(vectorstore: FAISS) -> LexicalIndex:
+        ids = list(vectorstore.index_to_docstore_id.values())
+        texts = (vectorstore.docstore.search(chunk_id).page_content for chunk_id in ids)
+        return LexicalIndex.from_texts(ids, texts)
+
+    def _add(
+        self,
+        vectorstore: Optional[FAISS],
+        docs: List[Document],
+        ids: List[str],
+        parents: Optional[List[Document]] = None,
+    ) -> FAISS:
+        texts = [doc.page_content for doc in docs]
+        embeddings = self._embedding.embed_documents(texts)
+        if vectorstore is None:
+            index = create_index(np.asarray(embeddings, dtype=np.float32), self._index_config)
+            vectorstore = FAISS(self._embedding, index, InMemoryDocstore(), {})
+        with self._write_lock():
+            if self._lexical:
+                if self.lexical_index is None:
+                    self.lexical_index = LexicalIndex()
+                self.lexical_index.add(ids, texts)
+            # HNSW 中已删除的位置仍占用编号，新向量的位置从 ntotal 开始；
+            # langchain 的 add_embeddings 按 index_to_docstore_id 的长度编号，这里直接写入
+            start = vectorstore.index.ntotal
+            vectorstore.index.add(np.asarray(embeddings, dtype=np.float32))
+            vectorstore.docstore.add(
+                {
+                    chunk_id: Document(page_content=text, metadata=doc.metadata)
+                    for chunk_id, text, doc in zip(ids, texts, docs)
+                }
+            )
+            vectorstore.index_to_docstore_id.update({start + j: chunk_id for j, chunk_id in enumerate(ids)})
+            self._position_listener("add", np.arange(start, start + len(ids), dtype=np.int64))
+            if parents:
+                # 父段落只存入 docstore，检索到其中的块后按 parent_id 取出
+                vectorstore.docstore.add({parent.id: parent for parent in parents})
+        # 需要训练的索引在向量足够之前以 flat 索引保存，够了之后在锁外训练并加入已有向量，再整体替换
+        trained = train_index(vectorstore.index, self._index_config)
+        if trained is not None:
+            with self._write_lock():
+                vectorstore.index = trained
+            print(f"索引已有 {trained.ntotal} 个向量，已训练为 {index_kind(self._index_config)} 索引")
+        return vectorstore
+
+    def _delete_parents(self, vectorstore: FAISS, ids: List[str]):
+        ids = [i for i in ids if isinstance(vectorstore.docstore.search(i), Document)]
+        if ids:
+            with self._write_lock():
+                vectorstore.docstore.delete(ids)
+
+    def _delete(self, vectorstore: FAISS, ids: List[str]) -> FAISS:
+        """
+        flat 与 IVF 索引直接删除向量，其余向量的位置依次前移，与 langchain 的 FAISS.delete 一致；
+        HNSW 不支持删除，删除的块只从 index_to_docstore_id 中移除，检索时跳过这些位置，
+        已删除的位置超过 _MAX_DELETED_RATIO 后用索引中剩余的向量重建。都不需要重新向量化。
+        """
+        removed = set(ids)
+        items = sorted(vectorstore.index_to_docstore_id.items())
+        positions = np.array([p for p, doc_id in items if doc_id in removed], dtype=np.int64)
+        if is_flat(vectorstore.index):
+            with self._write_lock():
+                vectorstore.delete(ids)
+                self._position_listener("remove", positions)
+            return vectorstore
+
+        live = {p: doc_id for p, doc_id in items if doc_id not in removed}
+        with self._write_lock():
+            vectorstore.docstore.delete(ids)
+            if remove_positions(vectorstore.index, positions):
+                vectorstore.index_to_docstore_id = dict(enumerate(live.values()))
+                self._position_listener("remove", positions)
+                return vectorstore
+            vectorstore.index_to_docstore_id = live
+            self._position_listener("delete", positions)
+
+        index = vectorstore.index
+        if index.ntotal - len(live) > index.ntotal * _MAX_DELETED_RATIO:
+            # 在锁外重建，期间检索继续使用旧索引
+            live_positions = np.fromiter(live, dtype=np.int64, count=len(live))
+            rebuilt = rebuild_index(index, live_positions)
+            apply_search_params(rebuilt, self._index_config)
+            with self._write_lock():
+                vectorstore.index = rebuilt
+                vectorstore.index_to_docstore_id = dict(enumerate(live.values()))
+                self._position_listener("remove", np.setdiff1d(np.arange(index.ntotal), live_positions))
+            print(f"索引中已删除的向量超过 {_MAX_DELETED_RATIO:.0%}，已用剩余的 {rebuilt.ntotal} 个向量重建")
+        return vectorstore
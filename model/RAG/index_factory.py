@@ -0,0 +1,298 @@
+'''按配置创建FAISS索引：flat（精确检索）、ivf-flat、hnsw、ivf-pq，向量的存储精度（float32 / fp16 / sq8 / pq），检索参数 nprobe / efSearch 的设置，以及删除向量后的编号维护'''
+import weakref
+from typing import Dict, Optional
+
+import numpy as np
+from langchain_community.vectorstores.faiss import dependable_faiss_import
+
+from config.config import Config
+
+INDEX_TYPES = ("flat", "ivf-flat", "hnsw", "ivf-pq")
+
+# 向量在索引中的存储方式：float32 原始向量；fp16 半精度（内存减半）；
+# sq8 每维 8 位标量量化（内存为 1/4，需训练）；pq 乘积量化（pq-m 个子向量各 pq-bits 位，需训练）
+STORAGE_TYPES = ("float32", "fp16", "sq8", "pq")
+
+DEFAULT_INDEX_CONFIG = {
+    "type": "flat",
+    "storage": "float32",
+    # IVF 聚类中心个数，train-size 不足 nlist×39 时按 train-size/39 缩小
+    "nlist": 1024,
+    # IVF 检索时探查的聚类个数，越大召回越高、越慢
+    "nprobe": 16,
+    # HNSW 每个节点的邻居数，以及构建、检索时的候选队列长度
+    "hnsw-m": 32,
+    "ef-construction": 200,
+    "ef-search": 64,
+    # PQ 子向量个数（需整除向量维度）与每个子向量的编码位数
+    "pq-m": 16,
+    "pq-bits": 8,
+    # 训练 IVF 时最多使用的样本数
+    "train-size": 50000,
+}
+
+# faiss 建议每个聚类中心至少有 39 个训练样本
+_MIN_POINTS_PER_CENTROID = 39
+# sq8 训练时统计每一维的取值范围，样本过少时范围偏窄，之后加入的向量会被截断
+_MIN_SQ_TRAINING_SAMPLES = 1000
+
+# 重建索引时每次取出的向量数
+_REBUILD_BATCH = 65536
+
+# {向量库: (索引状态, 跳过已删除位置的 IDSelector, 其引用的 IDSelectorBatch)}，索引或 index_to_docstore_id 改变后重新生成
+_deleted_selectors = weakref.WeakKeyDictionary()
+
+
+def load_index_config() -> Dict:
+    config = dict(DEFAULT_INDEX_CONFIG)
+    config.update(
+        Config.get_instance().get_with_default({}, "model", "embedding", "index") or {}
+    )
+    if config["type"] not in INDEX_TYPES:
+        raise ValueError(f"不支持的索引类型: {config['type']}")
+    if config["storage"] not in STORAGE_TYPES:
+        raise ValueError(f"不支持的向量存储方式: {config['storage']}")
+    return config
+
+
+def index_kind(config: Dict) -> str:
+    """记录在索引清单中的类型，类型或存储方式改变后需要全量重建；float32 时与原先的记录一致"""
+    if config["type"] == "ivf-pq" or config["storage"] == "float32":
+        return config["type"]
+    return f"{config['type']}/{config['storage']}"
+
+
+def is_flat(index) -> bool:
+    """flat（含 fp16 / sq8 / pq 编码的 flat）索引删除向量后位置会前移，与 langchain FAISS.delete 的编号方式一致"""
+    faiss = dependable_faiss_import()
+    return isinstance(faiss.downcast_index(index), faiss.IndexFlatCodes)
+
+
+def needs_training(config: Dict) -> bool:
+    return config["type"] in ("ivf-flat", "ivf-pq") or config["storage"] in ("sq8", "pq")
+
+
+def _ivf_nlist(config: Dict, samples: int) -> int:
+    return max(1, min(config["nlist"], samples // _MIN_POINTS_PER_CENTROID))
+
+
+def min_training_samples(config: Dict) -> int:
+    """
+    需要训练的索引至少积累这么多个向量才创建，之前以 flat 精确索引保存。
+    IVF 为配置的 nlist（受 train-size 限制）个聚类中心各 39 个样本，避免只用最初的几十个块训练出一两个聚类中心；
+    PQ 每个子空间 2^pq-bits 个中心各 39 个样本，样本不足时不再降低编码位数
+    """
+    samples = 0
+    if config["type"] in ("ivf-flat", "ivf-pq"):
+        samples = _ivf_nlist(config, config["train-size"]) * _MIN_POINTS_PER_CENTROID
+    if config["type"] == "ivf-pq" or config["storage"] == "pq":
+        samples = max(samples, 2 ** config["pq-bits"] * _MIN_POINTS_PER_CENTROID)
+    elif config["storage"] == "sq8":
+        samples = max(samples, _MIN_SQ_TRAINING_SAMPLES)
+    return samples
+
+
+def is_untrained(index, config: Dict) -> bool:
+    """index 是否为向量数不足训练时暂用的 flat 索引"""
+    faiss = dependable_faiss_import()
+    return needs_training(config) and isinstance(faiss.downcast_index(index), faiss.IndexFlat)
+
+
+def train_index(index, config: Dict):
+    """
+    暂用的 flat 索引中的向量足够训练后，按配置创建索引并加入这些向量，返回新索引；否则返回None。
+    flat 索引保存的是原始向量，不需要重新向量化，新索引中向量的位置与原来一致。
+    """
+    if not is_untrained(index, config) or index.ntotal < min_training_samples(config):
+        return None
+    vectors = index.reconstruct_n(0, index.ntotal)
+    trained = create_index(vectors, config)
+    trained.add(vectors)
+    return trained
+
+
+def _scalar_quantizer_type(storage: str):
+    faiss = dependable_faiss_import()
+    return faiss.ScalarQuantizer.QT_fp16 if storage == "fp16" else faiss.ScalarQuantizer.QT_8bit
+
+
+def _pq_params(dim: int, config: Dict):
+    pq_m = config["pq-m"]
+    if dim % pq_m != 0:
+        raise ValueError(f"pq-m={pq_m} 必须整除向量维度 {dim}")
+    return pq_m, config["pq-bits"]
+
+
+def create_index(vectors: np.ndarray, config: Dict):
+    """
+    创建索引并在需要时用 vectors 中的样本训练，返回尚未添加向量的空索引。
+    样本少于 min_training_samples 时返回 flat 索引，向量积累足够后由 train_index 转换
+    """
+    faiss = dependable_faiss_import()
+    dim = vectors.shape[1]
+    index_type = config["type"]
+    storage = config["storage"]
+    if len(vectors) < min_training_samples(config):
+        return faiss.IndexFlatL2(dim)
+
+    # 训练样本不少于 min_training_samples，train-size 较小时也能训练出完整的 PQ 码本
+    sample_size = max(config["train-size"], min_training_samples(config))
+    sample = vectors
+    if len(sample) > sample_size:
+        rng = np.random.default_rng(0)
+        sample = sample[rng.choice(len(sample), sample_size, replace=False)]
+
+    if index_type == "flat":
+        if storage == "float32":
+            index = faiss.IndexFlatL2(dim)
+        elif storage == "pq":
+            index = faiss.IndexPQ(dim, *_pq_params(dim, config))
+        else:
+            index = faiss.IndexScalarQuantizer(dim, _scalar_quantizer_type(storage))
+    elif index_type == "hnsw":
+        if storage == "float32":
+            index = faiss.IndexHNSWFlat(dim, config["hnsw-m"])
+        elif storage == "pq":
+            pq_m, pq_bits = _pq_params(dim, config)
+            index = faiss.IndexHNSWPQ(dim, pq_m, config["hnsw-m"], pq_bits)
+        else:
+            index = faiss.IndexHNSWSQ(dim, _scalar_quantizer_type(storage), config["hnsw-m"])
+        index.hnsw.efConstruction = config["ef-construction"]
+    else:
+        nlist = _ivf_nlist(config, len(sample))
+        quantizer = faiss.IndexFlatL2(dim)
+        if index_type == "ivf-pq" or storage == "pq":
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, *_pq_params(dim, config))
+        elif storage == "float32":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+        else:
+            index = faiss.IndexIVFScalarQuantizer(
+                quantizer, dim, nlist, _scalar_quantizer_type(storage)
+            )
+
+    if not index.is_trained:
+        index.train(np.ascontiguousarray(sample, dtype=np.float32))
+    if isinstance(index, faiss.IndexIVF):
+        index.quantizer_trains_alone = 0
+        # 重排序按位置取出候选块的向量，不再重新向量化
+        enable_reconstruct(index)
+    apply_search_params(index, config)
+    return index
+
+
+def apply_search_params(index, config: Dict):
+    """设置检索时的 nprobe / efSearch，加载已保存的索引后也需要重新设置以便配置修改即时生效"""
+    faiss = dependable_faiss_import()
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = config["ef-search"]
+        return
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return
+    ivf.nprobe = min(config["nprobe"], ivf.nlist)
+
+
+def remove_positions(index, positions: np.ndarray) -> bool:
+    """
+    从 IVF 索引中删除 positions 处的向量，并把其余向量的编号依次前移，删除后的编号方式与 flat 索引一致。
+    索引不是 IVF（如 HNSW 不支持删除）时返回False
+    """
+    faiss = dependable_faiss_import()
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return False
+    removed = np.sort(np.asarray(positions, dtype=np.int64))
+    direct_map = ivf.direct_map.type
+    if direct_map != faiss.DirectMap.NoMap:
+        ivf.set_direct_map_type(faiss.DirectMap.NoMap)
+    index.remove_ids(faiss.IDSelectorBatch(removed))
+    # IVF 删除后保留原编号，直接改写倒排表中的编号：减去比它小的已删除编号个数
+    invlists = ivf.invlists
+    for list_no in range(ivf.nlist):
+        size = invlists.list_size(list_no)
+        if size:
+            ptr = invlists.get_ids(list_no)
+            ids = faiss.rev_swig_ptr(ptr, size)
+            ids -= np.searchsorted(removed, ids)
+            invlists.release_ids(list_no, ptr)
+    if direct_map != faiss.DirectMap.NoMap:
+        ivf.set_direct_map_type(direct_map)
+    return True
+
+
+def rebuild_index(index, positions: np.ndarray):
+    """按 positions 的顺序取出 index 中的向量，重建一个同样参数（沿用训练结果）的索引，用于清除 HNSW 中已删除的位置"""
+    faiss = dependable_faiss_import()
+    rebuilt = faiss.clone_index(index)
+    rebuilt.reset()
+    for start in range(0, len(positions), _REBUILD_BATCH):
+        rebuilt.add(index.reconstruct_batch(positions[start : start + _REBUILD_BATCH]))
+    return rebuilt
+
+
+def enable_reconstruct(index):
+    """IVF 索引需要 direct map 才能按位置取出向量（reconstruct），其他索引无需处理"""
+    faiss = dependable_faiss_import()
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return
+    if ivf.direct_map.type == faiss.DirectMap.NoMap:
+        ivf.make_direct_map()
+
+
+def can_reconstruct(index) -> bool:
+    faiss = dependable_faiss_import()
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return True
+    return ivf.direct_map.type != faiss.DirectMap.NoMap
+
+
+def reconstruct_vectors(index, positions: np.ndarray) -> Optional[np.ndarray]:
+    """按位置取出索引中的向量（PQ / SQ 索引为解码后的近似向量），没有 direct map 的 IVF 索引返回None"""
+    if not len(positions) or not can_reconstruct(index):
+        return None
+    return index.reconstruct_batch(np.asarray(positions, dtype=np.int64))
+
+
+def _deleted_selector(vectorstore):
+    faiss = dependable_faiss_import()
+    index, index_to_docstore_id = vectorstore.index, vectorstore.index_to_docstore_id
+    state = (id(index), index.ntotal, len(index_to_docstore_id))
+    cached = _deleted_selectors.get(vectorstore)
+    if cached is None or cached[0] != state:
+        live = np.zeros(index.ntotal, dtype=bool)
+        live[np.fromiter(index_to_docstore_id, dtype=np.int64, count=len(index_to_docstore_id))] = True
+        deleted = faiss.IDSelectorBatch(np.flatnonzero(~live).astype(np.int64))
+        cached = (state, faiss.IDSelectorNot(deleted), deleted)
+        _deleted_selectors[vectorstore] = cached
+    return cached[1]
+
+
+def search_vectors(vectorstore, vectors: np.ndarray, k: int):
+    """
+    与 vectorstore.index.search 相同，返回 (距离, 位置)。HNSW 删除的块只从 index_to_docstore_id 中移除，
+    向量仍在索引中，检索时跳过这些位置
+    """
+    index = vectorstore.index
+    if len(vectorstore.index_to_docstore_id) >= index.ntotal:
+        return index.search(vectors, k)
+    return index.search(vectors, k, params=search_parameters(index, _deleted_selector(vectorstore)))
+
+
+def search_parameters(index, selector):
+    """带 IDSelector 的检索参数，保留索引当前的 nprobe / efSearch；索引不支持 IDSelector 时返回None"""
+    faiss = dependable_faiss_import()
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    if isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=index.nprobe)
+    if isinstance(index, faiss.IndexPQ):
+        return None
+    return faiss.SearchParameters(sel=selector)
@@ -0,0 +1,206 @@
+'''知识库向量库的磁盘存储：保存FAISS索引、docstore以及源文件清单，启动时直接加载'''
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+from typing import Dict, Optional
+
+from langchain_core.embeddings import Embeddings
+from langchain_community.vectorstores.faiss import FAISS, dependable_faiss_import
+
+from model.RAG.document_loader import SOURCE_EXTENSIONS
+from model.RAG.index_factory import is_flat
+from model.RAG.lexical_index import LexicalIndex
+
+MANIFEST_VERSION = 1
+
+# 每个索引目录一把锁，同一进程中的多个 IndexStore 实例（如迁移回调与构建队列）共用
+_store_locks: Dict[str, threading.RLock] = {}
+_store_locks_lock = threading.Lock()
+
+
+def _store_lock(index_path: str) -> threading.RLock:
+    key = os.path.abspath(index_path)
+    with _store_locks_lock:
+        return _store_locks.setdefault(key, threading.RLock())
+
+
+def scan_sources(source_dir: str, extensions=SOURCE_EXTENSIONS) -> Dict[str, Dict]:
+    """遍历知识库目录，返回 {相对路径: {size, mtime}} 形式的源文件清单"""
+    files = {}
+    for root, _dirs, names in os.walk(source_dir):
+        for name in names:
+            if not name.lower().endswith(extensions):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            relpath = os.path.relpath(path, source_dir).replace(os.sep, "/")
+            files[relpath] = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+    return files
+
+
+class IndexStore(object):
+    """
+    一个索引目录包含 index.faiss、docstore.pkl 和 manifest.json 三个文件，开启混合检索时还有 lexical.pkl。
+    读写同一目录时持有该目录的锁，同一进程中读取不会落在保存时替换目录的间隙里。
+    """
+
+    _INDEX_FILE = "index.faiss"
+    _DOCSTORE_FILE = "docstore.pkl"
+    _MANIFEST_FILE = "manifest.json"
+    _LEXICAL_FILE = "lexical.pkl"
+
+    def __init__(self, index_path: str):
+        self._index_path = index_path
+        self._lock = _store_lock(index_path)
+
+    @classmethod
+    def beside(cls, source_dir: str) -> "IndexStore":
+        """在源文件目录旁边建立同名的 .index 目录，避免索引文件混入知识库"""
+        return cls(os.path.normpath(source_dir) + ".index")
+
+    @property
+    def index_path(self) -> str:
+        return self._index_path
+
+    def exists(self) -> bool:
+        with self._lock:
+            return self._exists()
+
+    def _exists(self) -> bool:
+        return all(
+            os.path.exists(os.path.join(self._index_path, name))
+            for name in (self._INDEX_FILE, self._DOCSTORE_FILE, self._MANIFEST_FILE)
+        )
+
+    def read_manifest(self) -> Optional[Dict]:
+        path = os.path.join(self._index_path, self._MANIFEST_FILE)
+        with self._lock:
+            if not os.path.exists(path):
+                return None
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                return None
+
+    def load(self, embedding: Embeddings, mmap: bool = True) -> Optional[FAISS]:
+        """加载索引，mmap=True 时以内存映射方式读取，多个进程可共享同一份页缓存"""
+        with self._lock:
+            return self._load(embedding, mmap)
+
+    def _load(self, embedding: Embeddings, mmap: bool) -> Optional[FAISS]:
+        if not self._exists():
+            return None
+        faiss = dependable_faiss_import()
+        index_file = os.path.join(self._index_path, self._INDEX_FILE)
+        mapped = False
+        try:
+            if mmap:
+                try:
+                    index = faiss.read_index(index_file, faiss.IO_FLAG_MMAP)
+                    mapped = True
+                except RuntimeError:
+                    # 部分索引类型不支持mmap，退回普通读取
+                    index = faiss.read_index(index_file)
+            else:
+                index = faiss.read_index(index_file)
+            with open(os.path.join(self._index_path, self._DOCSTORE_FILE), "rb") as f:
+                docstore, index_to_docstore_id = pickle.load(f)
+        except Exception as e:
+            print(f"加载索引 {self._index_path} 失败: {e}")
+            return None
+        vectorstore = FAISS(embedding, index, docstore, index_to_docstore_id)
+        # flat 索引在mmap模式下仍会读入内存，只有IVF的倒排表真正映射且只读
+        vectorstore._mmap_read_only = mapped and not is_flat(index)
+        return vectorstore
+
+    def load_lexical(self) -> Optional[LexicalIndex]:
+        path = os.path.join(self._index_path, self._LEXICAL_FILE)
+        with self._lock:
+            if not os.path.exists(path):
+                return None
+            try:
+                with open(path, "rb") as f:
+                    return pickle.load(f)
+            except Exception as e:
+                print(f"加载倒排索引 {path} 失败: {e}")
+                return None
+
+    @staticmethod
+    def is_read_only(vectorstore: FAISS) -> bool:
+        return getattr(vectorstore, "_mmap_read_only", False)
+
+    def save(
+        self,
+        vectorstore: FAISS,
+        files: Dict[str, Dict],
+        embedding_model: str,
+        index_type: str = "flat",
+        lexical_index: Optional[LexicalIndex] = None,
+        embedding_version: Optional[str] = None,
+        chunker: Optional[str] = None,
+    ):
+        """
+        先写入临时目录再整体替换，避免进程中途退出留下不完整的索引。
+        临时目录由 mkdtemp 生成，同一进程的多个线程同时保存时互不覆盖；写入与替换都在该目录的锁内进行。
+        清单中记录向量模型的名称、版本与维度，模型变化后据此判断旧向量不可再用；
+        chunker 为切块方式与参数，改变后同样需要重建。
+        """
+        with self._lock:
+            parent = os.path.dirname(os.path.abspath(self._index_path))
+            os.makedirs(parent, exist_ok=True)
+            tmp_path = tempfile.mkdtemp(
+                prefix=f"{os.path.basename(self._index_path)}.tmp-", dir=parent
+            )
+            try:
+                self._write(
+                    tmp_path, vectorstore, files, embedding_model, index_type,
+                    lexical_index, embedding_version, chunker,
+                )
+            except BaseException:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                raise
+
+            old_path = f"{tmp_path}.old"
+            if os.path.exists(self._index_path):
+                os.replace(self._index_path, old_path)
+            os.replace(tmp_path, self._index_path)
+            if os.path.exists(old_path):
+                shutil.rmtree(old_path, ignore_errors=True)
+
+    def _write(
+        self, tmp_path, vectorstore, files, embedding_model, index_type,
+        lexical_index, embedding_version, chunker,
+    ):
+        faiss = dependable_faiss_import()
+        faiss.write_index(vectorstore.index, os.path.join(tmp_path, self._INDEX_FILE))
+        with open(os.path.join(tmp_path, self._DOCSTORE_FILE), "wb") as f:
+            pickle.dump((vectorstore.docstore, vectorstore.index_to_docstore_id), f)
+        if lexical_index is not None:
+            with open(os.path.join(tmp_path, self._LEXICAL_FILE), "wb") as f:
+                pickle.dump(lexical_index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "embedding-model": embedding_model,
+            "embedding-version": embedding_version,
+            "embedding-dim": vectorstore.index.d,
+            "index-type": index_type,
+            "chunker": chunker,
+            "built-at": time.time(),
+            "chunks": len(vectorstore.index_to_docstore_id),
+            "files": files,
+        }
+        with open(os.path.join(tmp_path, self._MANIFEST_FILE), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+
+    def clear(self):
+        with self._lock:
+            if os.path.exists(self._index_path):
+                shutil.rmtree(self._index_path, ignore_errors=True)
@@ -0,0 +1,147 @@
+'''知识库的 BM25 倒排索引：补充向量检索对药品名、ICD编码、剂量等精确词的召回，随向量索引一起增量维护并保存'''
+import math
+import re
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import jieba  # 可选依赖，缺失时中文按相邻两字切分
+except ImportError:  # pragma: no cover
+    jieba = None
+
+# 英文、数字以及 J45.901 / 0.5g / COVID-19 这类编码与剂量保持为一个词
+_ASCII_TOKEN = re.compile(r"[a-z0-9]+(?:[.\-/][a-z0-9]+)*")
+_CJK_RUN = re.compile(r"[一-鿿]+")
+
+# 已删除的块超过这个比例时重建倒排表
+_COMPACT_RATIO = 0.3
+
+
+def tokenize(text: str) -> List[str]:
+    text = text.lower()
+    tokens = _ASCII_TOKEN.findall(text)
+    for run in _CJK_RUN.findall(text):
+        if jieba is not None:
+            tokens.extend(word for word in jieba.cut_for_search(run) if word.strip())
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class LexicalIndex(object):
+    """
+    倒排表按词保存 (文档序号 uint32, 词频 uint16) 两个紧凑数组，文档序号只增不减，
+    删除的块只在 _deleted 中打标记，删除比例过高时整体压缩重排。
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        self._chunk_ids: List[str] = []
+        self._doc_lens = array("I")
+        self._deleted = bytearray()
+        self._positions: Dict[str, int] = {}
+        self._total_len = 0
+        self._live = 0
+
+    def __len__(self) -> int:
+        return self._live
+
+    @property
+    def nbytes(self) -> int:
+        """倒排数组占用的内存，用于估算用户索引的内存开销"""
+        return sum(
+            docs.itemsize * len(docs) + tfs.itemsize * len(tfs)
+            for docs, tfs in self._postings.values()
+        ) + self._doc_lens.itemsize * len(self._doc_lens)
+
+    @classmethod
+    def from_texts(cls, chunk_ids: Iterable[str], texts: Iterable[str]) -> "LexicalIndex":
+        index = cls()
+        index.add(chunk_ids, texts)
+        return index
+
+    def add(self, chunk_ids: Iterable[str], texts: Iterable[str]):
+        for chunk_id, text in zip(chunk_ids, texts):
+            if chunk_id in self._positions:
+                continue
+            position = len(self._chunk_ids)
+            counts = Counter(tokenize(text))
+            for term, tf in counts.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = (array("I"), array("H"))
+                postings[0].append(position)
+                postings[1].append(min(tf, 0xFFFF))
+            length = sum(counts.values())
+            self._chunk_ids.append(chunk_id)
+            self._doc_lens.append(length)
+            self._deleted.append(0)
+            self._positions[chunk_id] = position
+            self._total_len += length
+            self._live += 1
+
+    def remove(self, chunk_ids: Iterable[str]):
+        for chunk_id in chunk_ids:
+            position = self._positions.pop(chunk_id, None)
+            if position is None:
+                continue
+            self._deleted[position] = 1
+            self._total_len -= self._doc_lens[position]
+            self._live -= 1
+        if self._chunk_ids and len(self._chunk_ids) - self._live > _COMPACT_RATIO * len(self._chunk_ids):
+            self._compact()
+
+    def _compact(self):
+        remap = np.full(len(self._chunk_ids), -1, dtype=np.int64)
+        keep = np.flatnonzero(np.frombuffer(self._deleted, dtype=np.uint8) == 0)
+        remap[keep] = np.arange(len(keep))
+        postings = {}
+        for term, (docs, tfs) in self._postings.items():
+            new_docs = remap[np.frombuffer(docs, dtype=np.uint32)]
+            live = new_docs >= 0
+            if live.any():
+                postings[term] = (
+                    array("I", new_docs[live].astype(np.uint32).tobytes()),
+                    array("H", np.frombuffer(tfs, dtype=np.uint16)[live].tobytes()),
+                )
+        self._postings = postings
+        self._chunk_ids = [self._chunk_ids[i] for i in keep]
+        self._doc_lens = array("I", np.frombuffer(self._doc_lens, dtype=np.uint32)[keep].tobytes())
+        self._deleted = bytearray(len(keep))
+        self._positions = {chunk_id: i for i, chunk_id in enumerate(self._chunk_ids)}
+
+    def search(
+        self, query: str, k: int, chunk_ids: Optional[Iterable[str]] = None
+    ) -> List[Tuple[str, float]]:
+        """返回 BM25 得分最高的 k 个块的 (chunk_id, score)，chunk_ids 不为空时只在这些块中检索"""
+        if not self._live:
+            return []
+        doc_lens = np.frombuffer(self._doc_lens, dtype=np.uint32).astype(np.float32)
+        avg_len = self._total_len / self._live or 1.0
+        norms = self.k1 * (1 - self.b + self.b * doc_lens / avg_len)
+        scores = np.zeros(len(self._chunk_ids), dtype=np.float32)
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            docs = np.frombuffer(postings[0], dtype=np.uint32)
+            tfs = np.frombuffer(postings[1], dtype=np.uint16).astype(np.float32)
+            df = len(docs)
+            idf = math.log(1 + (self._live - df + 0.5) / (df + 0.5))
+            scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + norms[docs])
+        scores[np.frombuffer(self._deleted, dtype=np.uint8) == 1] = 0
+        if chunk_ids is not None:
+            allowed = np.zeros(len(scores), dtype=bool)
+            allowed[[self._positions[c] for c in chunk_ids if c in self._positions]] = True
+            scores[~allowed] = 0
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self._chunk_ids[i], float(scores[i])) for i in top if scores[i] > 0]
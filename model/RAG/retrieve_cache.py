@@ -0,0 +1,60 @@
+'''检索结果缓存：以 (索引id, 索引版本, 规范化问题, k) 为键，带过期时间和容量上限，索引重建后版本号变化自动失效'''
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from model.Embedding.embedding_cache import normalize_text
+
+
+def normalize_query(query: str) -> str:
+    """去掉首尾标点与多余空白，大小写不敏感，同一个常见问题的不同写法命中同一条缓存"""
+    return normalize_text(query).strip(" ?？!！。.,，").lower()
+
+
+class RetrievalCache(object):
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 600):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[float, List[Document]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(index_id: str, version: int, query: str, k: int) -> Tuple:
+        return (index_id, version, normalize_query(query), k)
+
+    def get(self, key: Hashable) -> Optional[List[Document]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(entry[1])
+
+    def put(self, key: Hashable, docs: List[Document]):
+        if self._max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self._ttl, list(docs))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit-rate": self.hits / total if total else 0.0,
+            }
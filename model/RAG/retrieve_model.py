@@ -1,33 +1,34 @@
 '''本地知识库的RAG检索模型类'''
 from model.model_base import Modelbase
 from model.model_base import ModelStatus
+from model.Embedding.embedding_service import (
+    get_embedding,
+    get_embedding_model_name,
+    get_embedding_model_version,
+)
+from model.RAG.chunker import LEGACY_SIGNATURE, StructureAwareChunker
+from model.RAG.document_loader import DEFAULT_WORKERS
+from model.RAG.embedding_migration import (
+    EmbeddingMigration,
+    embedding_matches,
+    load_migration_config,
+)
+from model.RAG.hybrid_retriever import HybridRetriever
+from model.RAG.index_factory import index_kind, load_index_config
+from model.RAG.index_store import IndexStore
+from model.RAG.incremental_indexer import IncrementalIndexer
+from model.RAG.scored_retriever import ScoredVectorStoreRetriever
+from model.RAG.shared_index import OWNER_KEY, SharedIndexRetriever, SharedUserIndex
+from model.RAG.upload_store import TEMP_PREFIX, save_upload
+from model.RAG.user_index_cache import UserIndexCache
 from config.config import Config
 from env import get_app_root
 
 import os
-import shutil
-import markdown  # pip install markdown
-import unstructured  # pip install unstructured
-import docx  # pip install python-docx
+import threading
 
-from langchain_community.embeddings import ModelScopeEmbeddings
+from langchain_core.retrievers import BaseRetriever
 from langchain_core.vectorstores import VectorStoreRetriever
-from langchain_community.document_loaders import (
-    DirectoryLoader,
-    PyPDFLoader,
-    JSONLoader,
-    MHTMLLoader,
-    TextLoader,
-    CSVLoader,
-)
-from langchain_community.document_loaders import (
-    UnstructuredWordDocumentLoader,
-    UnstructuredHTMLLoader,
-    UnstructuredMarkdownLoader,
-)
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores.faiss import FAISS
-from modelscope.hub.snapshot_download import snapshot_download
 
 
 # 检索模型
@@ -38,144 +39,219 @@ class Retrievemodel(Modelbase):
     def __init__(self, *args, **krgs):
         super().__init__(*args, **krgs)
 
-        # 此处请自行改成下载embedding模型的位置
-        self._embedding_download_path = Config.get_instance().get_with_nested_params(
-            "model", "embedding", "model-path"
-        )
-        self._embedding_model_name = Config.get_instance().get_with_nested_params(
-            "model", "embedding", "model-name"
-        )
-        self._embedding_model_path = os.path.join(
-            self._embedding_download_path, self._embedding_model_name
-        )
-        if not os.path.exists(self._embedding_model_path):
-            try:
-                # 如果为空，则从modelscope下载模型
-                model_dir = snapshot_download(
-                    self._embedding_model_name,
-                    cache_dir=self._embedding_download_path,
-                )
-                print(f"Model downloaded and saved to {model_dir}")
-            except Exception as e:
-                print(f"Failed to download model: {e}")
-                if os.path.exists(self._embedding_model_path):
-                    shutil.rmtree(self._embedding_model_path)
+        self._embedding_model_name = get_embedding_model_name()
+        self._embedding_model_version = get_embedding_model_version()
+        # 进行中的向量模型迁移 {索引ID: EmbeddingMigration}
+        self._migrations = {}
+        self._migrations_lock = threading.Lock()
+        self._migration_config = load_migration_config()
         # self._loader = PyPDFDirectoryLoader
-        self._text_splitter = RecursiveCharacterTextSplitter
-        # self._embedding = OpenAIEmbeddings()
-        # ModelScopeEmbeddings 只能接受官方模型名
-        self._embedding = ModelScopeEmbeddings(model_id=self._embedding_model_name)
+        # 按页、标题、表格与CSV行组切块（indexing.chunking 中可改回只按字符数切分）
+        self._text_splitter = StructureAwareChunker.from_config()
         self._data_path = Config.get_instance().get_with_nested_params(
             "Knowledge-base-path"
         )
         if not os.path.exists(self._data_path):
             os.makedirs(self._data_path)
-        self._user_retrievers = {}
-
-
-    # 建立向量库
-    def build(self):
-
-        # 加载PDF文件
-        pdf_loader = DirectoryLoader(
-            self._data_path,
-            glob="**/*.pdf",
-            loader_cls=PyPDFLoader,
-            silent_errors=True,
-            use_multithreading=True,
-        )
-        pdf_docs = pdf_loader.load()
-
-        # 加载Word文件
-        docx_loader = DirectoryLoader(
-            self._data_path,
-            glob="**/*.docx",
-            loader_cls=UnstructuredWordDocumentLoader,
-            silent_errors=True,
-            use_multithreading=True,
-        )
-        docx_docs = docx_loader.load()
-
-        # 加载txt文件
-        txt_loader = DirectoryLoader(
-            self._data_path,
-            glob="**/*.txt",
-            loader_cls=TextLoader,
-            silent_errors=True,
-            loader_kwargs={"autodetect_encoding": True},
-            use_multithreading=True,
+        # 向量库持久化在知识库目录旁的 .index 目录中，启动时文件未变化则直接加载
+        self._index_store = IndexStore.beside(self._data_path)
+        # 解析文档的并发数、并发方式（线程/进程）以及单个文件的解析时限
+        self._loader_workers = Config.get_instance().get_with_default(
+            DEFAULT_WORKERS, "indexing", "workers"
         )
-        txt_docs = txt_loader.load()
-
-        # 加载csv文件
-        csv_loader = DirectoryLoader(
-            self._data_path,
-            glob="**/*.csv",
-            loader_cls=CSVLoader,
-            silent_errors=True,
-            loader_kwargs={"autodetect_encoding": True},
-            use_multithreading=True,
+        self._loader_mode = Config.get_instance().get_with_default(
+            "thread", "indexing", "mode"
         )
-        csv_docs = csv_loader.load()
-
-        # 加载html文件
-        html_loader = DirectoryLoader(
-            self._data_path,
-            glob="**/*.html",
-            loader_cls=UnstructuredHTMLLoader,
-            silent_errors=True,
-            use_multithreading=True,
+        self._file_timeout = Config.get_instance().get_with_default(
+            None, "indexing", "file-timeout"
         )
-        html_docs = html_loader.load()
-
-        mhtml_loader = DirectoryLoader(
-            self._data_path,
-            glob="**/*.mhtml",
-            loader_cls=MHTMLLoader,
-            silent_errors=True,
-            use_multithreading=True,
+        # 向量索引类型（flat / ivf-flat / hnsw / ivf-pq）、向量存储精度及其训练、检索参数
+        self._index_config = load_index_config()
+        # 混合检索：向量检索与 BM25 倒排检索的结果按倒数排名融合
+        self._hybrid = Config.get_instance().get_with_default(False, "retrieval", "hybrid")
+        self._fetch_k = Config.get_instance().get_with_default(20, "retrieval", "fetch-k")
+        self._rrf_k = Config.get_instance().get_with_default(60, "retrieval", "rrf-k")
+        # 各索引的版本号，索引内容变化时递增，检索结果缓存以此判断是否失效
+        self._index_versions = {}
+        # 同一用户的索引同步串行执行，避免并发写入同一个索引目录
+        self._user_locks = {}
+        self._user_locks_lock = threading.Lock()
+        # 上传时边写边算出的文件哈希 {user_id: {文件名: {size, mtime, sha256}}}，下次同步时交给索引器
+        self._upload_hashes = {}
+        # 各用户的检索器按最近使用保留在内存中，超出用户数或向量内存预算时淘汰，淘汰后从磁盘索引重新加载
+        self._user_retrievers = UserIndexCache(
+            max_users=Config.get_instance().get_with_default(
+                64, "indexing", "user-cache-size"
+            ),
+            max_bytes=Config.get_instance().get_with_default(
+                1024, "indexing", "user-cache-memory-mb"
+            ) * 1024 * 1024,
         )
-        mhtml_docs = mhtml_loader.load()
-
-        # 加载markdown文件
-        markdown_loader = DirectoryLoader(
-            self._data_path,
-            glob="**/*.md",
-            loader_cls=UnstructuredMarkdownLoader,
-            silent_errors=True,
-            use_multithreading=True,
-        )
-        markdown_docs = markdown_loader.load()
-
-        # 要利用json数据要设置jq语句和content_key提取特定字段，这在不同json数据结构中有所不同，较为繁琐。
-        # 官方文档：https://api.python.langchain.com/en/latest/document_loaders/langchain_community.document_loaders.json_loader.JSONLoader.html
-        # json_loader = DirectoryLoader(self._data_path, glob="**/*.json", loader_kwargs={"jq_schema": ".","text_content":False},loader_cls=JSONLoader, silent_errors=True)
-        # json_docs = json_loader.load()
-
-        # 合并文档
-        docs = (
-            pdf_docs
-            + docx_docs
-            + txt_docs
-            + csv_docs
-            + html_docs
-            + mhtml_docs
-            + markdown_docs
+        # 用户知识库的索引方式：per-user 每个用户一个索引；shared 所有用户共用一个索引，检索时按所有者过滤
+        self._shared_user_index = None
+        if Config.get_instance().get_with_default("per-user", "indexing", "user-index") == "shared":
+            self._shared_user_index = SharedUserIndex(
+                IndexStore.beside("user_data"),
+                self._create_shared_indexer,
+                save_interval=Config.get_instance().get_with_default(
+                    30, "indexing", "shared-save-interval"
+                ),
+                exact_search_below=Config.get_instance().get_with_default(
+                    10000, "indexing", "shared-exact-search-below"
+                ),
+            )
+
+
+    @property
+    def _embedding(self):
+        # self._embedding = OpenAIEmbeddings()
+        # 所有检索模型从模型注册表借用同一个带缓存的向量化服务，首次使用时才加载
+        return get_embedding()
+
+    def _create_indexer(self, source_dir: str, index_store: IndexStore, known_hashes=None, **kwargs):
+        return IncrementalIndexer(
+            source_dir,
+            index_store,
+            self._embedding,
+            self._embedding_model_name,
+            self._text_splitter,
+            max_workers=self._loader_workers,
+            loader_mode=self._loader_mode,
+            file_timeout=self._file_timeout,
+            index_config=self._index_config,
+            lexical=self._hybrid,
+            known_hashes=known_hashes,
+            embedding_version=self._embedding_model_version,
+            **kwargs,
         )
 
-        # 创建一个 RecursiveCharacterTextSplitter 对象，用于将文档分割成块，chunk_size为最大块大小，chunk_overlap块之间可以重叠的大小
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=2000, chunk_overlap=100
+    def _create_shared_indexer(self, user_id, **kwargs):
+        # 共用索引的清单以 "用户ID/文件名" 为键，每次只同步一个用户的文件夹，由 SharedUserIndex 负责保存
+        return self._create_indexer(
+            "user_data",
+            IndexStore.beside("user_data"),
+            scope=user_id,
+            chunk_metadata={OWNER_KEY: user_id},
+            autosave=False,
+            **kwargs,
         )
-        splits = text_splitter.split_documents(docs)
 
-        # 使用 FAISS 创建一个向量数据库，存储分割后的文档及其嵌入向量
-        vectorstore = FAISS.from_documents(documents=splits, embedding=self._embedding)
+    def _make_retriever(self, vectorstore, lexical_index=None) -> BaseRetriever:
         # 将向量存储转换为检索器，设置检索参数 k 为 6，即返回最相似的 6 个文档
-        self._retriever = vectorstore.as_retriever(search_kwargs={"k": 6})
+        if self._hybrid and lexical_index is not None:
+            return HybridRetriever(
+                vectorstore=vectorstore,
+                lexical_index=lexical_index,
+                search_kwargs={"k": 6},
+                fetch_k=self._fetch_k,
+                rrf_k=self._rrf_k,
+            )
+        # 检索结果的 metadata["score"] 中带有相关度，拼接上下文时据此过滤
+        return ScoredVectorStoreRetriever(vectorstore=vectorstore, search_kwargs={"k": 6})
+
+    @property
+    def current_index_id(self) -> str:
+        """当前用户所使用索引的标识，未登录时为公共知识库"""
+        return "kb" if self.user_id is None else f"user:{self.user_id}"
+
+    def index_version(self, index_id: str) -> int:
+        version = self._index_versions.get(index_id, 0)
+        if self._shared_user_index is not None and index_id.startswith("user:"):
+            # 共用索引整体替换后所有用户的检索缓存都需要失效
+            version += self._index_versions.get("user-shared", 0)
+        return version
+
+    def _bump_index_version(self, index_id: str):
+        self._index_versions[index_id] = self._index_versions.get(index_id, 0) + 1
+
+    def _migrating(self, index_id: str):
+        """返回该索引进行中的向量迁移，没有时返回None"""
+        migration = self._migrations.get(index_id)
+        return migration if migration is not None and migration.is_alive() else None
+
+    def _start_migration(self, index_id: str, index_store: IndexStore, on_done):
+        """
+        磁盘上的索引由其他向量模型（名称、版本或维度不同）生成时，用旧模型加载旧索引继续提供检索，
+        同时在后台用当前模型重新向量化，完成后调用 on_done(新向量库, 倒排索引)。
+        返回迁移任务，没有可迁移的旧索引时返回None，由调用方全量重建。
+        """
+        manifest = index_store.read_manifest()
+        if not manifest or not manifest.get("embedding-model"):
+            return None
+        if manifest.get("index-type", "flat") != index_kind(self._index_config):
+            return None
+        if manifest.get("chunker", LEGACY_SIGNATURE) != self._text_splitter.signature:
+            # 切块方式也改变了，块需要重新生成，直接全量重建
+            return None
+        if embedding_matches(
+            manifest, self._embedding_model_name, self._embedding_model_version, self._embedding
+        ):
+            return None
+        try:
+            old_embedding = get_embedding(
+                manifest["embedding-model"], manifest.get("embedding-version")
+            )
+        except Exception as e:
+            print(f"加载旧向量模型 {manifest['embedding-model']} 失败，将全量重建索引: {e}")
+            return None
+        vectorstore = index_store.load(old_embedding)
+        if vectorstore is None:
+            return None
+
+        migration = EmbeddingMigration(
+            index_id,
+            vectorstore,
+            index_store.load_lexical() if self._hybrid else None,
+            manifest.get("files", {}),
+            index_store,
+            self._embedding,
+            self._embedding_model_name,
+            self._embedding_model_version,
+            self._index_config,
+            on_done,
+            chunker=self._text_splitter.signature,
+            **self._migration_config,
+        )
+        self._migrations[index_id] = migration
+        print(
+            f"索引 {index_store.index_path} 由向量模型 {manifest['embedding-model']} 生成，"
+            f"迁移到 {self._embedding_model_name} 期间继续使用旧索引"
+        )
+        migration.start()
+        return migration
 
-        # 设置模型状态为 BUILDING
-        self._model_status = ModelStatus.BUILDING
+    # 建立向量库
+    def build(self, vectorstore=None, lexical_index=None):
+        """vectorstore / lexical_index 为向量迁移完成后的新索引，为None时从磁盘加载"""
+        if vectorstore is None:
+            migration = self._migrating("kb") or self._start_migration(
+                "kb", self._index_store, self._on_kb_migrated
+            )
+            if migration is not None:
+                self._retriever = self._make_retriever(
+                    migration.vectorstore, migration.lexical_index
+                )
+                self._model_status = ModelStatus.READY
+                return
+        # 知识库没有变化时直接从磁盘加载索引，否则只解析、向量化变化的文件
+        indexer = self._create_indexer(self._data_path, self._index_store)
+        vectorstore = indexer.sync(vectorstore, lexical_index)
+        if vectorstore is None:
+            print(f"知识库目录 {self._data_path} 中没有找到文档")
+            self._retriever = None
+            self._model_status = ModelStatus.FAILED
+        else:
+            self._retriever = self._make_retriever(vectorstore, indexer.lexical_index)
+            self._model_status = ModelStatus.READY
+        # 检索器替换之后再递增版本号，避免旧索引的检索结果写入新版本的缓存
+        if indexer.changed:
+            self._bump_index_version("kb")
+
+    def _on_kb_migrated(self, vectorstore, lexical_index):
+        self._migrations.pop("kb", None)
+        # 迁移期间知识库文件可能有变化，在新索引上增量同步后再替换检索器
+        self.build(vectorstore, lexical_index)
+        self._bump_index_version("kb")
 
     @property
     def retriever(self) -> VectorStoreRetriever:
@@ -185,143 +261,177 @@ class Retrievemodel(Modelbase):
         else:
             return self._retriever
 
-    def build_user_vector_store(self):
-        """根据用户的ID加载用户文件夹中的文件并为用户构建向量库"""
-        user_data_path = os.path.join("user_data", self.user_id)  # 用户独立文件夹
+    def _user_data_path(self, user_id=None):
+        return os.path.join("user_data", user_id or self.user_id)  # 用户独立文件夹
+
+    def _user_lock(self, user_id) -> threading.Lock:
+        with self._user_locks_lock:
+            return self._user_locks.setdefault(user_id, threading.Lock())
+
+    def sync_user_index(self, user_id=None) -> int:
+        """
+        增量同步用户文件夹中的文件到该用户的向量库，返回同步后的块数，出错时抛出异常。
+        同步在从磁盘重新加载的向量库上进行，完成后才替换检索器，检索中的请求始终使用完整的索引。
+        索引由其他向量模型生成时改为在后台迁移，迁移完成前不同步，继续使用旧索引。
+        """
+        user_id = user_id or self.user_id
+        user_data_path = self._user_data_path(user_id)
         if not os.path.exists(user_data_path):
             print(f"用户文件夹 {user_data_path} 不存在")
-            return
-
-        try:
-            # 清理旧的向量库（如果已经存在）
-            if self.user_id in self._user_retrievers:
-                del self._user_retrievers[self.user_id]
-                print(f"用户 {self.user_id} 的旧向量库已删除")
-
-                # 加载用户文件夹中的文件并构建向量库
-                # 加载PDF文件
-            pdf_loader = DirectoryLoader(
-                user_data_path,
-                glob="**/*.pdf",
-                loader_cls=PyPDFLoader,
-                silent_errors=True,
-                use_multithreading=True,
-            )
-            pdf_docs = pdf_loader.load()
-
-            # 加载Word文件
-            docx_loader = DirectoryLoader(
-                user_data_path,
-                glob="**/*.docx",
-                loader_cls=UnstructuredWordDocumentLoader,
-                silent_errors=True,
-                use_multithreading=True,
+            return 0
+
+        if self._shared_user_index is not None:
+            return self._sync_shared_user_index(user_id)
+
+        with self._user_lock(user_id):
+            index_id = f"user:{user_id}"
+            migration = self._migrating(index_id) or self._start_migration(
+                index_id,
+                IndexStore.beside(user_data_path),
+                lambda vectorstore, lexical_index: self._on_user_migrated(
+                    user_id, vectorstore, lexical_index
+                ),
             )
-            docx_docs = docx_loader.load()
-
-            # 加载txt文件
-            txt_loader = DirectoryLoader(
-                user_data_path,
-                glob="**/*.txt",
-                loader_cls=TextLoader,
-                silent_errors=True,
-                loader_kwargs={"autodetect_encoding": True},
-                use_multithreading=True,
-            )
-            txt_docs = txt_loader.load()
-
-            # 加载csv文件
-            csv_loader = DirectoryLoader(
-                user_data_path,
-                glob="**/*.csv",
-                loader_cls=CSVLoader,
-                silent_errors=True,
-                loader_kwargs={"autodetect_encoding": True},
-                use_multithreading=True,
-            )
-            csv_docs = csv_loader.load()
-
-            # 加载html文件
-            html_loader = DirectoryLoader(
-                user_data_path,
-                glob="**/*.html",
-                loader_cls=UnstructuredHTMLLoader,
-                silent_errors=True,
-                use_multithreading=True,
-            )
-            html_docs = html_loader.load()
-
-            mhtml_loader = DirectoryLoader(
-                user_data_path,
-                glob="**/*.mhtml",
-                loader_cls=MHTMLLoader,
-                silent_errors=True,
-                use_multithreading=True,
-            )
-            mhtml_docs = mhtml_loader.load()
-
-            # 加载markdown文件
-            markdown_loader = DirectoryLoader(
-                user_data_path,
-                glob="**/*.md",
-                loader_cls=UnstructuredMarkdownLoader,
-                silent_errors=True,
-                use_multithreading=True,
-            )
-            markdown_docs = markdown_loader.load()
-
-            # 要利用json数据要设置jq语句和content_key提取特定字段，这在不同json数据结构中有所不同，较为繁琐。
-            # 官方文档：https://api.python.langchain.com/en/latest/document_loaders/langchain_community.document_loaders.json_loader.JSONLoader.html
-            # json_loader = DirectoryLoader(self._data_path, glob="**/*.json", loader_kwargs={"jq_schema": ".","text_content":False},loader_cls=JSONLoader, silent_errors=True)
-            # json_docs = json_loader.load()
-
-            # 合并文档
-            docs = (
-                pdf_docs
-                + docx_docs
-                + txt_docs
-                + csv_docs
-                + html_docs
-                + mhtml_docs
-                + markdown_docs
-            )
-
-            if not docs:
-                print(f"用户 {self.user_id} 文件夹中没有找到文档")
-                return
-
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=2000, chunk_overlap=100
-            )
-            splits = text_splitter.split_documents(docs)
-
-            # 为该用户构建向量库
-            vectorstore = FAISS.from_documents(
-                documents=splits, embedding=self._embedding
-            )
-            user_retriever = vectorstore.as_retriever(search_kwargs={"k": 6})
-
+            if migration is not None:
+                # 迁移期间新上传的文件留在文件夹中，迁移完成后一并同步
+                if user_id not in self._user_retrievers:
+                    self._user_retrievers[user_id] = self._make_retriever(
+                        migration.vectorstore, migration.lexical_index
+                    )
+                return len(migration.vectorstore.index_to_docstore_id)
+            return self._sync_user(user_id)
+
+    def _sync_user(self, user_id, vectorstore=None, lexical_index=None) -> int:
+        """在持有用户锁时调用，vectorstore 为None时从磁盘加载"""
+        user_data_path = self._user_data_path(user_id)
+        # 只向量化新增或修改过的文件，已删除文件的向量会从索引中移除
+        with self._user_locks_lock:
+            known_hashes = self._upload_hashes.pop(user_id, None)
+        indexer = self._create_indexer(
+            user_data_path, IndexStore.beside(user_data_path), known_hashes
+        )
+        vectorstore = indexer.sync(vectorstore, lexical_index)
+        if vectorstore is None:
+            self._user_retrievers.pop(user_id, None)
+            print(f"用户 {user_id} 文件夹中没有找到文档")
+        elif indexer.changed or user_id not in self._user_retrievers:
             # 将用户的retriever存储到字典中
-            self._user_retrievers[self.user_id] = user_retriever
-            print(f"用户 {self.user_id} 的向量库已构建完成")
-
+            self._user_retrievers[user_id] = self._make_retriever(
+                vectorstore, indexer.lexical_index
+            )
+            print(f"用户 {user_id} 的向量库已构建完成")
+        if indexer.changed:
+            self._bump_index_version(f"user:{user_id}")
+        return 0 if vectorstore is None else len(vectorstore.index_to_docstore_id)
+
+    def _on_user_migrated(self, user_id, vectorstore, lexical_index):
+        index_id = f"user:{user_id}"
+        with self._user_lock(user_id):
+            self._migrations.pop(index_id, None)
+            # 迁移期间上传或删除的文件在新索引上增量同步，然后替换检索器
+            self._user_retrievers.pop(user_id, None)
+            self._sync_user(user_id, vectorstore, lexical_index)
+            self._bump_index_version(index_id)
+
+    def _sync_shared_user_index(self, user_id) -> int:
+        shared = self._shared_user_index
+        with self._migrations_lock:
+            migration = self._migrating("user-shared")
+            if migration is None and not shared.loaded:
+                migration = self._start_migration(
+                    "user-shared", IndexStore.beside("user_data"), self._on_shared_migrated
+                )
+                if migration is not None:
+                    shared.install(migration.vectorstore, migration.lexical_index, migration.files)
+        if migration is not None:
+            # 迁移期间新上传的文件留在文件夹中，迁移完成后各用户下次检索时同步
+            return shared.count(user_id)
+
+        with self._user_lock(user_id):
+            with self._user_locks_lock:
+                known_hashes = self._upload_hashes.pop(user_id, None)
+            chunks, changed = shared.sync(user_id, known_hashes)
+            if changed:
+                self._bump_index_version(f"user:{user_id}")
+            return chunks
+
+    def _on_shared_migrated(self, vectorstore, lexical_index):
+        migration = self._migrations.pop("user-shared")
+        self._shared_user_index.install(vectorstore, lexical_index, migration.files)
+        self._bump_index_version("user-shared")
+
+    def build_user_vector_store(self, user_id=None):
+        """根据用户的ID增量同步用户文件夹中的文件到该用户的向量库"""
+        try:
+            self.sync_user_index(user_id)
         except Exception as e:
-            print(f"构建用户 {self.user_id} 向量库时出错: {e}")
+            print(f"构建用户 {user_id or self.user_id} 向量库时出错: {e}")
 
     def get_user_retriever(self) -> VectorStoreRetriever:
         """获取用户的retriever，如果不存在则返回None"""
+        if self._shared_user_index is not None:
+            if not self._shared_user_index.is_synced(self.user_id):
+                self.build_user_vector_store()
+            if not self._shared_user_index.count(self.user_id):
+                return None
+            return SharedIndexRetriever(
+                shared_index=self._shared_user_index,
+                owner=self.user_id,
+                embedding=self._embedding,
+                search_kwargs={"k": 6},
+                hybrid=self._hybrid,
+                fetch_k=self._fetch_k,
+                rrf_k=self._rrf_k,
+            )
+        if self.user_id not in self._user_retrievers:
+            # 进程重启或被移出内存后，从磁盘索引增量同步，文件没有变化时以mmap方式加载
+            self.build_user_vector_store()
         return self._user_retrievers.get(self.user_id, None)
 
-    def upload_user_file(self, file):
-        """将用户上传的文件存储到用户的文件夹中"""
-        user_data_path = os.path.join("user_data", self.user_id)
-        os.makedirs(user_data_path, exist_ok=True)  # 确保用户文件夹存在
-
-        file_path = os.path.join(user_data_path, file.name)
-        with open(file_path, "wb") as f:
-            f.write(file.read())
-
-        print(f"文件 {file.name} 已成功上传到用户 {self.user_id} 的文件夹")
+    def _indexed_files(self, user_id):
+        """用户已索引文件的清单 {文件名: {size, mtime, sha256, chunk_ids}}"""
+        if self._shared_user_index is not None:
+            return self._shared_user_index.files(user_id)
+        manifest = IndexStore.beside(self._user_data_path(user_id)).read_manifest() or {}
+        return manifest.get("files", {})
+
+    def _find_duplicate(self, user_id, sha256):
+        """在用户已索引和刚上传的文件中查找内容相同的文件，返回其文件名"""
+        user_data_path = self._user_data_path(user_id)
+        with self._user_locks_lock:
+            pending = dict(self._upload_hashes.get(user_id, {}))
+        for name, entry in {**self._indexed_files(user_id), **pending}.items():
+            if entry.get("sha256") == sha256 and os.path.exists(
+                os.path.join(user_data_path, name)
+            ):
+                return name
+        return None
+
+    def upload_user_file(self, file, user_id=None):
+        """
+        将用户上传的文件以流的方式存储到用户的文件夹中，返回 {name, sha256, duplicate-of}。
+        内容与已有文件相同时不保存，duplicate-of 为已有文件的文件名，调用方无需再构建索引。
+        """
+        user_id = user_id or self.user_id
+        user_data_path = self._user_data_path(user_id)
+        name = os.path.basename(file.name)
+        duplicate = []
+
+        def is_duplicate(sha256):
+            existing = self._find_duplicate(user_id, sha256)
+            if existing is not None:
+                duplicate.append(existing)
+            return existing is not None
+
+        file_path, info = save_upload(file, user_data_path, name, skip_if=is_duplicate)
+        if file_path is None:
+            print(f"文件 {name} 与用户 {user_id} 已上传的 {duplicate[0]} 内容相同，已跳过")
+            return {"name": name, "sha256": info["sha256"], "duplicate-of": duplicate[0]}
+
+        with self._user_locks_lock:
+            self._upload_hashes.setdefault(user_id, {})[name] = info
+        print(f"文件 {name} 已成功上传到用户 {user_id} 的文件夹")
+        return {"name": name, "sha256": info["sha256"], "duplicate-of": None}
 
     # 展示用户已上传的文件
     def list_uploaded_files(self):
@@ -331,7 +441,8 @@ class Retrievemodel(Modelbase):
             print(f"用户文件夹 {user_data_path} 不存在")
             return []
 
-        files = os.listdir(user_data_path)
+        # 忽略正在上传的临时文件
+        files = [f for f in os.listdir(user_data_path) if not f.startswith(TEMP_PREFIX)]
         if files:
             print(f"用户 {self.user_id} 已上传的文件：")
             for file in files:
@@ -363,10 +474,14 @@ class Retrievemodel(Modelbase):
                 os.remove(file_path)
             print(f"用户 {self.user_id} 文件夹已清空")
 
+        # 同步删除已移除文件的向量
+        self.build_user_vector_store()
+
     def view_uploaded_file(self, filename):
         """根据文件名返回用户文件的路径"""
         user_data_path = os.path.join("user_data", self.user_id)  # 定义用户文件夹路径
-        file_path = os.path.join(user_data_path, filename)  # 拼接完整的文件路径
+        # 只取文件名部分，防止通过 ../ 访问用户文件夹之外的文件
+        file_path = os.path.join(user_data_path, os.path.basename(filename))  # 拼接完整的文件路径
 
         if not os.path.exists(file_path):
             print(f"文件 {filename} 不存在")
@@ -376,5 +491,25 @@ class Retrievemodel(Modelbase):
         print(f"文件 {filename} 路径已成功获取")
         return file_path
 
+    def uploaded_file_sha256(self, filename, user_id=None):
+        """
+        返回用户文件的内容哈希，取自上传时的计算结果或索引清单，不读取文件；
+        文件在记录之后被修改过（大小或修改时间不一致）时返回None。
+        """
+        user_id = user_id or self.user_id
+        user_data_path = self._user_data_path(user_id)
+        name = os.path.basename(filename)
+        try:
+            stat = os.stat(os.path.join(user_data_path, name))
+        except OSError:
+            return None
+        with self._user_locks_lock:
+            entry = self._upload_hashes.get(user_id, {}).get(name)
+        if entry is None:
+            entry = self._indexed_files(user_id).get(name)
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+            return entry["sha256"]
+        return None
+
 
 INSTANCE = Retrievemodel()
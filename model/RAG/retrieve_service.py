@@ -1,13 +1,45 @@
 # 该函数用于对外界提供retreive服务，调用的是retrieve_model 中的接口
-from typing import List
-#from model.RAG.retrieve_model import INSTANCE
-INSTANCE = None
+from typing import Dict, List, Optional
+from config.config import Config
+from model.RAG.retrieve_model import INSTANCE
+from model.RAG.retrieve_cache import RetrievalCache
+from model.RAG.shared_index import SharedIndexRetriever
 from langchain_core.documents import Document
 
-def retrieve(query:str) ->List[Document]:
+# 常见问题的检索结果缓存，索引版本变化后旧结果自动失效
+_CACHE = RetrievalCache(
+    max_entries=Config.get_instance().get_with_default(1024, "retrieval", "cache-size"),
+    ttl=Config.get_instance().get_with_default(600, "retrieval", "cache-ttl"),
+)
+
+def _current_retriever():
     if INSTANCE.user_id is None:
-        doc = INSTANCE.retriever.invoke(query)
-    else:
-        doc = INSTANCE.get_user_retriever().invoke(query)
-        
-    return doc
\ No newline at end of file
+        return INSTANCE.retriever
+    return INSTANCE.get_user_retriever()
+
+def retrieve(query:str, k:Optional[int]=None) ->List[Document]:
+    """k 为返回的文档数，默认使用检索器配置的 k；重排序时传入更大的 k 多取候选"""
+    index_id = INSTANCE.current_index_id
+    retriever = _current_retriever()
+
+    k = k or retriever.search_kwargs.get("k", 4)
+    key = RetrievalCache.make_key(index_id, INSTANCE.index_version(index_id), query, k)
+    doc = _CACHE.get(key)
+    if doc is None:
+        doc = retriever.invoke(query, k=k)
+        _CACHE.put(key, doc)
+    return doc
+
+def parent_documents(parent_ids:List[str]) -> Dict[str, Document]:
+    """按块 metadata 中的 parent_id 从当前索引取出整节内容，返回 {parent_id: 文档}"""
+    retriever = _current_retriever()
+    if isinstance(retriever, SharedIndexRetriever):
+        return retriever.shared_index.get_by_ids(retriever.owner, parent_ids)
+    vectorstore = getattr(retriever, "vectorstore", None)
+    if vectorstore is None:
+        return {}
+    docs = {parent_id: vectorstore.docstore.search(parent_id) for parent_id in parent_ids}
+    return {parent_id: doc for parent_id, doc in docs.items() if isinstance(doc, Document)}
+
+def cache_stats() -> Dict:
+    return _CACHE.stats()
\ No newline at end of file
@@ -0,0 +1,52 @@
+'''在检索结果的 metadata["score"] 中附带相关度（越大越相关），供拼接上下文时按分数过滤'''
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStoreRetriever
+
+from model.RAG.index_factory import reconstruct_vectors, search_vectors
+
+
+# metadata["score_type"] 为分数的来源：similarity 由向量的 L2 距离换算；rrf 为混合检索的倒数排名融合得分；
+# cross-encoder 为重排序模型的打分。不同来源的分数取值范围不同，不能用同一个阈值比较
+SCORE_TYPES = ("similarity", "rrf", "cross-encoder")
+
+# 向量检索命中的块在 metadata[VECTOR_KEY] 中附带其在索引中的向量，重排序（MMR）直接使用，不再重新向量化；
+# 重排序后移除。只由 BM25 命中的块及无法取出向量的索引没有此项
+VECTOR_KEY = "vector"
+
+
+def with_score(
+    doc: Document, score: float, score_type: str = "similarity", vector: Optional[np.ndarray] = None
+) -> Document:
+    """复制一份文档再写入分数，避免修改 docstore 中共享的文档对象"""
+    metadata = {**doc.metadata, "score": score, "score_type": score_type}
+    if vector is not None:
+        metadata[VECTOR_KEY] = vector
+    return Document(id=doc.id, page_content=doc.page_content, metadata=metadata)
+
+
+class ScoredVectorStoreRetriever(VectorStoreRetriever):
+    """与 vectorstore.as_retriever 相同的相似度检索，分数为 1/(1+L2距离)；HNSW 中已删除的块不会被检索到"""
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun, **kwargs
+    ) -> List[Document]:
+        # 调用时传入的参数（如重排序前多取的 k）覆盖 search_kwargs
+        k = kwargs.get("k", self.search_kwargs.get("k", 4))
+        vectorstore = self.vectorstore
+        embedding = vectorstore.embedding_function.embed_query(query)
+        distances, positions = search_vectors(vectorstore, np.array([embedding], dtype=np.float32), k)
+        found = positions[0] != -1
+        distances, positions = distances[0][found], positions[0][found]
+        vectors = reconstruct_vectors(vectorstore.index, positions)
+        return [
+            with_score(
+                vectorstore.docstore.search(vectorstore.index_to_docstore_id[position]),
+                1.0 / (1.0 + float(distance)),
+                vector=None if vectors is None else vectors[i],
+            )
+            for i, (distance, position) in enumerate(zip(distances, positions))
+        ]
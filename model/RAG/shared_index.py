@@ -0,0 +1,360 @@
+'''多个用户共用一个向量索引：块的 metadata 中记录所有者，检索时用 faiss 的 IDSelector 只在该用户的块中查找'''
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_community.vectorstores.faiss import dependable_faiss_import
+from pydantic import ConfigDict
+
+from model.RAG.hybrid_retriever import reciprocal_rank_fusion
+from model.RAG.incremental_indexer import IncrementalIndexer
+from model.RAG.index_factory import (
+    can_reconstruct,
+    enable_reconstruct,
+    is_flat,
+    reconstruct_vectors,
+    search_parameters,
+)
+from model.RAG.index_store import IndexStore
+from model.RAG.scored_retriever import with_score
+
+# 块 metadata 中记录所有者（用户ID）的字段
+OWNER_KEY = "owner"
+
+# 精确检索时每次解码的向量数
+_EXACT_SEARCH_BATCH = 4096
+
+
+class _ReadWriteLock(object):
+    """检索可以并发进行；修改索引时等待进行中的检索结束，等待期间新的检索排在修改之后"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writers_waiting = 0
+        self._writing = False
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writing or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+
+class SharedUserIndex(object):
+    """
+    所有用户的块保存在同一个 FAISS 索引与 docstore 中，清单以 "用户ID/文件名" 为键，
+    每个用户同步时只扫描自己的文件夹。检索时按块的所有者生成 IDSelector，
+    用户只能检索到自己的块，与每个用户一个索引时的隔离效果相同。
+    修改后的索引每隔 save_interval 秒合并写入一次磁盘，进程退出前未写入的修改在用户下次同步时按清单补上。
+    """
+
+    def __init__(
+        self,
+        index_store: IndexStore,
+        create_indexer: Callable[..., IncrementalIndexer],
+        save_interval: float = 30,
+        exact_search_below: int = 10000,
+    ):
+        self._index_store = index_store
+        # create_indexer(scope, known_hashes=..., files=..., write_lock=..., position_listener=...) 创建只同步一个用户文件夹的索引器
+        self._create_indexer = create_indexer
+        self._save_interval = save_interval
+        # 块数少于此值的用户在 HNSW / IVF 索引中改为解码其向量精确检索：
+        # 带 IDSelector 的近似检索在大索引中只能找到很少几个属于小用户的结果
+        self._exact_search_below = exact_search_below
+        self._rw_lock = _ReadWriteLock()
+        # 同一时间只有一个用户在同步，保存索引时也持有此锁
+        self._sync_lock = threading.Lock()
+        self._vectorstore = None
+        self._lexical_index = None
+        # 内存中的完整清单，首次同步前为None
+        self._files: Optional[Dict[str, Dict]] = None
+        self._indexer: Optional[IncrementalIndexer] = None
+        # 每个位置上的块的所有者编号（-1 为已删除），索引增删时由索引器回调同步修改；
+        # 为None时（首次检索或整体替换索引后）扫描一次 docstore 生成
+        self._position_owners: Optional[np.ndarray] = None
+        self._owner_codes: Dict[str, int] = {}
+        # 检索在读锁内按需扫描与分配所有者编号，多个检索线程可能同时进行，由此锁保证编号不重复
+        self._owners_lock = threading.Lock()
+        # {所有者: 其块在索引中的位置}，由 _position_owners 按需生成，索引被修改后清空
+        self._owner_positions: Dict[str, np.ndarray] = {}
+        self._save_timer: Optional[threading.Timer] = None
+        # 本进程中已同步过的用户，其余用户首次检索前需要先同步
+        self._synced = set()
+
+    def is_synced(self, owner: str) -> bool:
+        return owner in self._synced
+
+    @property
+    def loaded(self) -> bool:
+        return self._files is not None
+
+    def install(self, vectorstore, lexical_index, files: Dict[str, Dict]):
+        """
+        整体替换内存中的索引（如向量模型迁移完成后），索引须已写入磁盘。
+        替换后每个用户下次检索前重新同步一次，补上替换前未同步的文件变化。
+        """
+        with self._sync_lock:
+            with self._writing():
+                enable_reconstruct(vectorstore.index)
+                self._vectorstore = vectorstore
+                self._lexical_index = lexical_index
+                self._position_owners = None
+            self._files = files
+            self._indexer = None
+            self._synced = set()
+
+    @contextmanager
+    def _writing(self):
+        with self._rw_lock.write():
+            yield
+            self._owner_positions = {}
+
+    def sync(self, owner: str, known_hashes: Optional[Dict[str, Dict]] = None) -> Tuple[int, bool]:
+        """同步一个用户的文件夹，返回 (该用户的块数, 索引是否改变)"""
+        prefix = f"{owner}/"
+        with self._sync_lock:
+            indexer = self._create_indexer(
+                owner,
+                known_hashes={prefix + name: entry for name, entry in (known_hashes or {}).items()},
+                files=self._files,
+                write_lock=self._writing,
+                position_listener=self._position_listener(owner),
+            )
+            vectorstore = indexer.sync(self._vectorstore, self._lexical_index)
+            with self._writing():
+                if vectorstore is not self._vectorstore:
+                    # 索引被重新创建，位置与原来的索引无关
+                    self._position_owners = None
+                if vectorstore is not None:
+                    # 训练后替换的 IVF 索引也需要重新建立 direct map
+                    enable_reconstruct(vectorstore.index)
+                self._vectorstore = vectorstore
+                self._lexical_index = indexer.lexical_index
+            self._files = indexer.files
+            self._indexer = indexer
+            self._synced.add(owner)
+            if indexer.changed:
+                self._schedule_save()
+        return self.count(owner), indexer.changed
+
+    def _schedule_save(self):
+        if self._save_interval <= 0:
+            self._indexer.save(self._vectorstore)
+            return
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(self._save_interval, self.save)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def save(self):
+        """将内存中的共用索引写入磁盘；写入期间检索不受影响"""
+        with self._sync_lock:
+            self._save_timer = None
+            if self._indexer is not None:
+                self._indexer.save(self._vectorstore)
+
+    def files(self, owner: str) -> Dict[str, Dict]:
+        """用户已索引的文件 {文件名: {size, mtime, sha256, chunk_ids}}"""
+        files = self._files
+        if files is None:
+            files = (self._index_store.read_manifest() or {}).get("files", {})
+        prefix = f"{owner}/"
+        return {k[len(prefix):]: v for k, v in files.items() if k.startswith(prefix)}
+
+    def _position_listener(self, owner: str) -> Callable[[str, np.ndarray], None]:
+        """同步 owner 的文件夹时，索引器在写锁内报告位置的变化，据此修改每个位置的所有者，不需要重新扫描 docstore"""
+
+        def on_change(event: str, positions: np.ndarray):
+            owners = self._position_owners
+            if owners is None:
+                return
+            if event == "add":
+                if len(positions) and positions[0] != len(owners):
+                    # 向新创建的索引中添加，同步结束后重新扫描
+                    self._position_owners = None
+                    return
+                with self._owners_lock:
+                    code = self._owner_codes.setdefault(owner, len(self._owner_codes))
+                self._position_owners = np.concatenate(
+                    [owners, np.full(len(positions), code, dtype=np.int32)]
+                )
+            elif event == "remove":
+                self._position_owners = np.delete(owners, positions)
+            else:
+                owners[positions] = -1
+
+        return on_change
+
+    def _scan_owners(self) -> np.ndarray:
+        """在 _owners_lock 内调用"""
+        vectorstore = self._vectorstore
+        owners = np.full(vectorstore.index.ntotal, -1, dtype=np.int32)
+        for position, chunk_id in vectorstore.index_to_docstore_id.items():
+            owner = vectorstore.docstore.search(chunk_id).metadata.get(OWNER_KEY)
+            owners[position] = self._owner_codes.setdefault(owner, len(self._owner_codes))
+        return owners
+
+    def _positions(self, owner: str) -> Optional[np.ndarray]:
+        """在读锁内调用"""
+        positions = self._owner_positions.get(owner)
+        if positions is not None:
+            return positions
+        with self._owners_lock:
+            # 等待锁期间其他检索线程可能已经生成
+            positions = self._owner_positions.get(owner)
+            if positions is None:
+                owners = self._position_owners
+                if owners is None:
+                    owners = self._position_owners = self._scan_owners()
+                code = self._owner_codes.get(owner)
+                if code is None:
+                    return None
+                positions = self._owner_positions[owner] = np.flatnonzero(owners == code).astype(np.int64)
+        return positions
+
+    def count(self, owner: str) -> int:
+        with self._rw_lock.read():
+            if self._vectorstore is None:
+                return 0
+            positions = self._positions(owner)
+            return 0 if positions is None else len(positions)
+
+    def search(self, owner: str, query: str, k: int) -> List[Tuple[str, Document, float, Optional[np.ndarray]]]:
+        """在 owner 的块中做向量检索，返回 (chunk_id, 文档, L2距离, 块的向量)，索引无法取出向量时向量为None"""
+        faiss = dependable_faiss_import()
+        vectorstore = self._vectorstore
+        if vectorstore is None:
+            return []
+        # 问题用向量库自己的模型向量化，迁移期间旧索引仍使用旧模型
+        query_vector = vectorstore.embedding_function.embed_query(query)
+        with self._rw_lock.read():
+            if self._vectorstore is not vectorstore:
+                # 向量化期间索引被整体替换，用新索引重新检索
+                return self.search(owner, query, k)
+            positions = self._positions(owner)
+            if positions is None or not len(positions):
+                return []
+            index = vectorstore.index
+            query_vector = np.array([query_vector], dtype=np.float32)
+            k = min(k, len(positions))
+            params = None
+            if is_flat(index) or len(positions) >= self._exact_search_below or not can_reconstruct(index):
+                selector = faiss.IDSelectorBatch(positions)
+                params = search_parameters(index, selector)
+            if params is not None:
+                distances, found = index.search(query_vector, k, params=params)
+            else:
+                # 块数较少的用户，以及不支持 IDSelector 的 flat PQ 索引，解码该用户的向量后直接计算距离
+                distances, found = self._exact_search(index, positions, query_vector, k)
+            hit = found[0] != -1
+            distances, found = distances[0][hit], found[0][hit]
+            vectors = reconstruct_vectors(index, found)
+            results = []
+            for i, (distance, position) in enumerate(zip(distances, found)):
+                chunk_id = vectorstore.index_to_docstore_id[position]
+                vector = None if vectors is None else vectors[i]
+                results.append((chunk_id, vectorstore.docstore.search(chunk_id), float(distance), vector))
+            return results
+
+    @staticmethod
+    def _exact_search(index, positions: np.ndarray, query_vector: np.ndarray, k: int):
+        all_distances = np.empty(len(positions), dtype=np.float32)
+        for start in range(0, len(positions), _EXACT_SEARCH_BATCH):
+            vectors = index.reconstruct_batch(positions[start : start + _EXACT_SEARCH_BATCH])
+            all_distances[start : start + len(vectors)] = ((vectors - query_vector) ** 2).sum(axis=1)
+        order = np.argsort(all_distances)[:k]
+        return all_distances[order][None], positions[order][None]
+
+    def get_by_ids(self, owner: str, ids: List[str]) -> Dict[str, Document]:
+        """按ID取出 owner 的文档（如章节的父段落），其他用户的文档不返回"""
+        with self._rw_lock.read():
+            vectorstore = self._vectorstore
+            if vectorstore is None:
+                return {}
+            docs = {doc_id: vectorstore.docstore.search(doc_id) for doc_id in ids}
+            return {
+                doc_id: doc
+                for doc_id, doc in docs.items()
+                if isinstance(doc, Document) and doc.metadata.get(OWNER_KEY) == owner
+            }
+
+    def lexical_search(self, owner: str, query: str, k: int) -> List[Tuple[str, Document, float]]:
+        """在 owner 的块中做 BM25 检索，返回 (chunk_id, 文档, 得分)"""
+        with self._rw_lock.read():
+            vectorstore = self._vectorstore
+            if vectorstore is None or self._lexical_index is None:
+                return []
+            positions = self._positions(owner)
+            if positions is None:
+                return []
+            chunk_ids = [vectorstore.index_to_docstore_id[p] for p in positions]
+            return [
+                (chunk_id, vectorstore.docstore.search(chunk_id), score)
+                for chunk_id, score in self._lexical_index.search(query, k, chunk_ids)
+            ]
+
+
+class SharedIndexRetriever(BaseRetriever):
+    """只检索 owner 的块，与 vectorstore.as_retriever 返回的检索器一样带有 search_kwargs"""
+
+    shared_index: SharedUserIndex
+    owner: str
+    search_kwargs: dict = {"k": 6}
+    # 开启混合检索时向量与 BM25 结果按倒数排名融合
+    hybrid: bool = False
+    fetch_k: int = 20
+    rrf_k: int = 60
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun, **kwargs
+    ) -> List[Document]:
+        k = kwargs.get("k", self.search_kwargs.get("k", 4))
+        fetch_k = max(self.fetch_k, k) if self.hybrid else k
+        dense = self.shared_index.search(self.owner, query, fetch_k)
+        if not self.hybrid:
+            return [
+                with_score(doc, 1.0 / (1.0 + distance), vector=vector) for _, doc, distance, vector in dense
+            ]
+
+        lexical = self.shared_index.lexical_search(self.owner, query, fetch_k)
+        docs = {chunk_id: doc for chunk_id, doc, _ in lexical}
+        docs.update({chunk_id: doc for chunk_id, doc, _, _ in dense})
+        vectors = {chunk_id: vector for chunk_id, _, _, vector in dense}
+        fused = reciprocal_rank_fusion(
+            [[chunk_id for chunk_id, _, _, _ in dense], [chunk_id for chunk_id, _, _ in lexical]],
+            self.rrf_k,
+        )
+        return [
+            with_score(docs[chunk_id], score, "rrf", vectors.get(chunk_id)) for chunk_id, score in fused[:k]
+        ]
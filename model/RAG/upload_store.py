@@ -0,0 +1,65 @@
+'''以流的方式保存上传的知识库文件：分块写入同目录下的临时文件，同时计算内容哈希，写完 fsync 后原子替换为目标文件'''
+import hashlib
+import os
+import tempfile
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+# 没有 chunks() 的文件对象（如 gradio 上传的文件）每次读取的字节数
+_READ_BLOCK_SIZE = 1024 * 1024
+
+# 上传中的临时文件以此开头，列出文件时忽略
+TEMP_PREFIX = ".upload-"
+
+
+def _iter_chunks(file) -> Iterable[bytes]:
+    if hasattr(file, "chunks"):
+        # Django 的 UploadedFile，大文件已由 Django 落盘，这里按块读取
+        return file.chunks()
+    return iter(lambda: file.read(_READ_BLOCK_SIZE), b"")
+
+
+def _fsync_dir(directory: str):
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:  # pragma: no cover - Windows 不支持打开目录
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def save_upload(
+    file, directory: str, name: str, skip_if: Optional[Callable[[str], bool]] = None
+) -> Tuple[Optional[str], Dict]:
+    """
+    将上传的文件保存为 directory/name，返回 (文件路径, {size, mtime, sha256})。
+    skip_if 以内容哈希判断是否丢弃本次上传（如内容重复），丢弃时文件路径为None。
+    写入过程中出错或进程退出时目标文件保持原样，只会留下以 TEMP_PREFIX 开头的临时文件。
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name)
+    sha = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=TEMP_PREFIX, suffix=".part")
+    try:
+        # mkstemp 创建的文件权限为 0600，改为与直接 open 创建的文件一致
+        os.chmod(tmp_path, 0o644)
+        with os.fdopen(fd, "wb") as f:
+            for chunk in _iter_chunks(file):
+                sha.update(chunk)
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        sha256 = sha.hexdigest()
+        if skip_if is not None and skip_if(sha256):
+            os.remove(tmp_path)
+            return None, {"sha256": sha256}
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    _fsync_dir(directory)
+
+    stat = os.stat(path)
+    return path, {"size": stat.st_size, "mtime": stat.st_mtime_ns, "sha256": sha256}
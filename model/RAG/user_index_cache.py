@@ -0,0 +1,85 @@
+'''按用户缓存向量库检索器：限制常驻用户数与向量总内存，按最近最少使用淘汰，淘汰的用户下次检索时从磁盘索引重新加载'''
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from langchain_core.vectorstores import VectorStoreRetriever
+
+
+def vector_bytes(retriever: VectorStoreRetriever) -> int:
+    """估算检索器背后FAISS索引中向量占用的内存，混合检索时加上倒排索引"""
+    lexical_index = getattr(retriever, "lexical_index", None)
+    lexical_bytes = lexical_index.nbytes if lexical_index is not None else 0
+    index = getattr(retriever.vectorstore, "index", None)
+    if index is None:
+        return lexical_bytes
+    # HNSW 的向量编码保存在 storage 子索引中
+    storage = getattr(index, "storage", None)
+    code_size = storage.sa_code_size() if storage is not None else getattr(index, "code_size", 0)
+    code_size = code_size or index.d * 4
+    return index.ntotal * code_size + lexical_bytes
+
+
+class UserIndexCache(object):
+    """
+    接口与 dict 保持一致（get / [] / pop / in），可以直接替换原先的 _user_retrievers 字典。
+    用户的索引在每次增量同步后都已写入磁盘，淘汰时只需从内存中移除。
+    """
+
+    def __init__(self, max_users: int = 64, max_bytes: int = 1024 * 1024 * 1024):
+        self._max_users = max_users
+        self._max_bytes = max_bytes
+        self._retrievers: "OrderedDict[str, VectorStoreRetriever]" = OrderedDict()
+        self._sizes = {}
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def __len__(self) -> int:
+        return len(self._retrievers)
+
+    def __contains__(self, user_id) -> bool:
+        return user_id in self._retrievers
+
+    def get(self, user_id, default=None) -> Optional[VectorStoreRetriever]:
+        with self._lock:
+            retriever = self._retrievers.get(user_id)
+            if retriever is None:
+                return default
+            self._retrievers.move_to_end(user_id)
+            return retriever
+
+    def __setitem__(self, user_id, retriever: VectorStoreRetriever):
+        size = vector_bytes(retriever)
+        with self._lock:
+            self._remove(user_id)
+            self._retrievers[user_id] = retriever
+            self._sizes[user_id] = size
+            self._total_bytes += size
+            self._evict(keep=user_id)
+
+    def pop(self, user_id, default=None) -> Optional[VectorStoreRetriever]:
+        with self._lock:
+            retriever = self._retrievers.get(user_id, default)
+            self._remove(user_id)
+            return retriever
+
+    def _remove(self, user_id):
+        if user_id in self._retrievers:
+            del self._retrievers[user_id]
+            self._total_bytes -= self._sizes.pop(user_id, 0)
+
+    def _evict(self, keep):
+        # 刚写入的用户即使单独超出预算也保留，保证其本次检索可用
+        while len(self._retrievers) > 1 and (
+            len(self._retrievers) > self._max_users or self._total_bytes > self._max_bytes
+        ):
+            user_id = next(iter(self._retrievers))
+            if user_id == keep:
+                self._retrievers.move_to_end(user_id)
+                continue
+            self._remove(user_id)
+            print(f"用户 {user_id} 的向量库已移出内存，下次检索时从磁盘加载")
@@ -0,0 +1,79 @@
+'''进程内的模型注册表：同一个模型在一个进程中只加载一次，并记录每个模型的加载耗时与内存占用'''
+import os
+import threading
+import time
+from typing import Any, Callable, Dict
+
+try:
+    import psutil  # 可选依赖，缺失时读取 /proc 或 getrusage
+except ImportError:  # pragma: no cover
+    psutil = None
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - Windows
+    resource = None
+
+
+def current_rss_mb() -> float:
+    """当前进程的常驻内存（MB），无法获取时返回0"""
+    if psutil is not None:
+        return psutil.Process(os.getpid()).memory_info().rss / 1024 / 1024
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is not None:
+        # 只能拿到峰值内存，单位为KB
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return 0.0
+
+
+class ModelRegistry(object):
+    """按名称缓存模型实例，各检索模型从这里借用实例而不是各自加载"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._name_locks: Dict[str, threading.Lock] = {}
+        self._models: Dict[str, Any] = {}
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def get(self, name: str, factory: Callable[[], Any]) -> Any:
+        """返回名为 name 的模型，首次调用时用 factory 加载；同名模型并发加载时只会加载一次"""
+        model = self._models.get(name)
+        if model is not None:
+            return model
+
+        with self._lock:
+            name_lock = self._name_locks.setdefault(name, threading.Lock())
+        with name_lock:
+            model = self._models.get(name)
+            if model is not None:
+                return model
+
+            rss_before = current_rss_mb()
+            start = time.perf_counter()
+            model = factory()
+            seconds = time.perf_counter() - start
+            rss_delta = current_rss_mb() - rss_before
+
+            self._stats[name] = {"load-seconds": seconds, "rss-mb": rss_delta}
+            self._models[name] = model
+            print(f"[model-registry] 已加载 {name}: 耗时 {seconds:.2f}s, 内存 {rss_delta:+.1f}MB")
+            return model
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._models
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {name: dict(stat) for name, stat in self._stats.items()}
+
+
+_REGISTRY = ModelRegistry()
+
+
+def get_registry() -> ModelRegistry:
+    return _REGISTRY
@@ -0,0 +1,90 @@
+'''服务启动后在后台预热各个模型，并记录每个模型的预热状态，供日志与就绪检查使用'''
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+from model.model_registry import get_registry
+
+_status: Dict[str, Dict] = {}
+_status_lock = threading.Lock()
+_started = False
+
+
+def _warm_embedding():
+    from model.Embedding.embedding_service import get_embedding
+
+    get_embedding()
+
+
+def _warm_rag_index():
+    from model.RAG.retrieve_model import INSTANCE
+
+    INSTANCE.retriever
+
+
+def _warm_kg_automaton():
+    from model.KG.search_model import INSTANCE
+    from model.model_base import ModelStatus
+
+    INSTANCE.build()
+    if INSTANCE.model_status != ModelStatus.READY:
+        raise RuntimeError("实体检索自动机构建失败，请检查Neo4j配置")
+
+
+# 预热顺序：向量化模型 -> 知识库索引 -> 知识图谱实体自动机（同时建立Neo4j连接）
+_WARMUP_STEPS: List[Tuple[str, Callable[[], None]]] = [
+    ("embedding", _warm_embedding),
+    ("rag-index", _warm_rag_index),
+    ("kg-automaton", _warm_kg_automaton),
+]
+
+
+def _set_status(name: str, **status):
+    with _status_lock:
+        _status.setdefault(name, {}).update(status)
+
+
+def _run_warmup():
+    for name, step in _WARMUP_STEPS:
+        _set_status(name, state="warming")
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            _set_status(name, state="failed", error=str(e), seconds=time.perf_counter() - start)
+            print(f"[warmup] {name} 预热失败: {e}")
+            continue
+        seconds = time.perf_counter() - start
+        _set_status(name, state="ready", seconds=seconds)
+        print(f"[warmup] {name} 已就绪，耗时 {seconds:.2f}s")
+
+    summary = ", ".join(f"{name}={_status[name]['state']}" for name, _ in _WARMUP_STEPS)
+    print(f"[warmup] 预热结束: {summary}")
+
+
+def warm_up_in_background():
+    """在守护线程中依次预热各个模型，只会启动一次"""
+    global _started
+    with _status_lock:
+        if _started:
+            return
+        _started = True
+        for name, _ in _WARMUP_STEPS:
+            _status[name] = {"state": "pending"}
+    threading.Thread(target=_run_warmup, name="model-warmup", daemon=True).start()
+
+
+def readiness() -> Dict:
+    """返回各模型的预热状态、模型注册表中记录的加载耗时与内存，以及检索缓存的命中情况"""
+    from model.KG.search_model import INSTANCE as entity_searcher
+    from model.RAG.retrieve_service import cache_stats
+
+    with _status_lock:
+        status = {name: dict(item) for name, item in _status.items()}
+    return {
+        "ready": bool(status) and all(item["state"] == "ready" for item in status.values()),
+        "models": status,
+        "registry": get_registry().stats(),
+        "retrieval-cache": cache_stats(),
+        "kg-automaton": entity_searcher.stats(),
+    }
@@ -142,3 +142,11 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 CORS_ALLOW_CREDENTIALS = True
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_HEADERS = "*"
+
+# -------------------------------------------------------------------
+# 用户知识库文件的发送方式：留空时由 Django 发送（支持 Range / ETag）；
+# x-accel-redirect 交给 nginx，需配置 internal 的 location 将 USER_FILE_ACCEL_PREFIX 映射到 user_data 目录；
+# x-sendfile 交给 Apache mod_xsendfile / lighttpd
+# -------------------------------------------------------------------
+USER_FILE_SERVE_MODE = ""
+USER_FILE_ACCEL_PREFIX = "/protected/user_data/"
@@ -193,3 +193,11 @@ JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY", "replace-me-with-a-secure-jwt-secre
 JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 ACCESS_TOKEN_LIFETIME_MINUTES = int(os.getenv("ACCESS_TOKEN_LIFETIME_MINUTES", "60"))
 REFRESH_TOKEN_LIFETIME_DAYS = int(os.getenv("REFRESH_TOKEN_LIFETIME_DAYS", "7"))
+
+# -------------------------------------------------------------------
+# 用户知识库文件的发送方式：留空时由 Django 发送（支持 Range / ETag）；
+# x-accel-redirect 交给 nginx，需配置 internal 的 location 将 USER_FILE_ACCEL_PREFIX 映射到 user_data 目录；
+# x-sendfile 交给 Apache mod_xsendfile / lighttpd
+# -------------------------------------------------------------------
+USER_FILE_SERVE_MODE = os.getenv("USER_FILE_SERVE_MODE", "")
+USER_FILE_ACCEL_PREFIX = os.getenv("USER_FILE_ACCEL_PREFIX", "/protected/user_data/")
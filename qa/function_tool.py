@@ -21,14 +21,12 @@ from audio.audio_extract import (
 from audio.audio_generate import audio_generate
 from model.KG.search_service import search
 from Internet.Internet_chain import InternetSearchChain
-from kg.Graph import GraphDao
+from kg.Graph import get_dao
 from config.config import Config
 from qa.purpose_type import userPurposeType
 from env import get_env_value
 
 
-_dao = GraphDao()
-
 def is_file_path(path):
     return Path(path).exists()
 
@@ -37,21 +35,22 @@ def relation_tool(entities: List[Dict] | None) -> str | None:
         return None
 
     relationships = set()  # 使用集合来避免重复关系
-    relationship_match = []
 
     searchKey = Config.get_instance().get_with_nested_params("model", "graph-entity", "search-key")
-    # 遍历每个实体并查询与其他实体的关系
+    # 遍历每个实体，记录其属性
     for entity in entities:
         entity_name = entity[searchKey]
         for k, v in entity.items():
             relationships.add(f"{entity_name} {k}: {v}")
 
-        # 查询每个实体与其他实体的关系a-r-b
-        relationship_match.append(_dao.query_relationship_by_name(entity_name))
-        
+    # 一次查询所有实体与其他实体的关系a-r-b，耗时不再随实体数线性增长
+    relationship_match = get_dao().query_relationships_by_names(
+        [entity[searchKey] for entity in entities]
+    ) or {}
+
     # 抽取并记录每个实体与其他实体的关系
-    for i in range(len(relationship_match)):
-        for record in relationship_match[i]:
+    for records in relationship_match.values():
+        for record in records:
             # 获取起始节点和结束节点的名称
 
             start_name = record["r"].start_node[searchKey]
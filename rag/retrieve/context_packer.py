@@ -0,0 +1,118 @@
+'''将检索到的文档片段拼接为提示词中的上下文：按分数过滤、去掉相邻块的重叠文本，并按模型的token预算以句子为单位截断'''
+import math
+import re
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from config.config import Config
+from env import get_env_value
+
+SEPARATOR = "\n-------------分割线--------------\n"
+
+_CJK_CHAR = re.compile(r"[一-鿿　-〿＀-￯]")
+# 在句末标点或换行之后断句，标点与换行保留在句子末尾
+_SENTENCE_END = re.compile(r"(?<=[。！？!?；;\n])")
+# 相邻块之间的重叠来自切分时的 chunk-overlap（见 indexing.chunking），只检查这个范围内的重叠
+_MIN_OVERLAP = 20
+_MAX_OVERLAP = 200
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算token数：中文约每字一个token，其余字符约每4个一个token"""
+    cjk = len(_CJK_CHAR.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def split_sentences(text: str) -> List[str]:
+    return [sentence for sentence in _SENTENCE_END.split(text) if sentence.strip()]
+
+
+def _strip_overlap(text: str, selected: List[str]) -> str:
+    """去掉与已选片段首尾重叠的部分：已选片段的结尾是本片段的开头，或本片段的结尾是已选片段的开头"""
+    for other in selected:
+        tail = other[-_MAX_OVERLAP:]
+        for size in range(min(len(tail), len(text)), _MIN_OVERLAP - 1, -1):
+            if tail.endswith(text[:size]):
+                text = text[size:]
+                break
+        head = other[:_MAX_OVERLAP]
+        for size in range(min(len(head), len(text)), _MIN_OVERLAP - 1, -1):
+            if head.startswith(text[-size:]):
+                text = text[:-size]
+                break
+    return text
+
+
+class ContextPacker(object):
+
+    def __init__(
+        self,
+        token_budget: int = 3000,
+        min_score: float = 0.0,
+        min_score_ratio: float = 0.0,
+    ):
+        self._token_budget = token_budget
+        self._min_score = min_score
+        self._min_score_ratio = min_score_ratio
+
+    @classmethod
+    def for_model(cls, model_name: Optional[str] = None) -> "ContextPacker":
+        """按 retrieval.context 配置创建，token 预算按模型名查找，未配置的模型使用 default"""
+        config = Config.get_instance().get_with_default({}, "retrieval", "context") or {}
+        budgets: Dict[str, int] = config.get("token-budget") or {}
+        model_name = model_name or get_env_value("MODEL_NAME")
+        return cls(
+            token_budget=budgets.get(model_name, budgets.get("default", 3000)),
+            min_score=config.get("min-score", 0.0),
+            min_score_ratio=config.get("min-score-ratio", 0.0),
+        )
+
+    def _filter_by_score(self, docs: List[Document]) -> List[Document]:
+        # 只按向量检索的相似度过滤；RRF 得分只反映名次，只被一路检索到的片段得分天然只有最高分的一半左右，
+        # cross-encoder 的打分已在重排序时用过，这两类分数不参与过滤
+        scores = [
+            doc.metadata.get("score")
+            if doc.metadata.get("score_type", "similarity") == "similarity"
+            else None
+            for doc in docs
+        ]
+        known = [score for score in scores if score is not None]
+        if not known:
+            return docs
+        # 低于绝对阈值，或远低于本次检索最高分的片段相关性较弱，不放入上下文
+        threshold = max(self._min_score, self._min_score_ratio * max(known))
+        return [doc for doc, score in zip(docs, scores) if score is None or score >= threshold]
+
+    def pack(self, docs: List[Document]) -> Tuple[List[Document], str]:
+        """返回实际放入上下文的文档与拼接后的文本，文档顺序与检索结果一致"""
+        budget = self._token_budget - estimate_tokens(SEPARATOR) * max(0, len(docs) - 1)
+        packed_docs, texts, keys = [], [], []
+        for doc in self._filter_by_score(docs):
+            text = _strip_overlap(doc.page_content.strip(), texts).strip()
+            # 内容已被之前的片段完整包含（如重复上传的文件）时跳过
+            key = re.sub(r"\s+", "", text)
+            if not key or any(key in other for other in keys):
+                continue
+
+            tokens = estimate_tokens(text)
+            if tokens > budget:
+                # 预算不足以放下整个片段时，按句子保留能放下的部分
+                kept = []
+                for sentence in split_sentences(text):
+                    sentence_tokens = estimate_tokens(sentence)
+                    if sentence_tokens > budget:
+                        break
+                    kept.append(sentence)
+                    budget -= sentence_tokens
+                text = "".join(kept).strip()
+                if text:
+                    packed_docs.append(doc)
+                    texts.append(text)
+                break
+
+            budget -= tokens
+            keys.append(key)
+            packed_docs.append(doc)
+            texts.append(text)
+        return packed_docs, SEPARATOR.join(texts)
@@ -0,0 +1,131 @@
+'''检索结果的重排序：先多取若干倍候选，再用 MMR 去掉内容相近的片段，可选用本地 cross-encoder 重新打分'''
+import math
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+
+from config.config import Config
+from model.Embedding.embedding_service import get_embedding
+from model.RAG.scored_retriever import VECTOR_KEY, with_score
+from model.model_registry import get_registry
+
+try:
+    from sentence_transformers import CrossEncoder  # 可选依赖，仅在配置了 cross-encoder 时需要
+except ImportError:  # pragma: no cover
+    CrossEncoder = None
+
+RERANK_METHODS = ("none", "mmr", "cross-encoder")
+
+
+def mmr_select(
+    query_vector: np.ndarray, doc_vectors: np.ndarray, k: int, lambda_mult: float = 0.7,
+    relevance: Optional[np.ndarray] = None,
+) -> List[int]:
+    """
+    最大边际相关：每次选出 lambda*相关度 - (1-lambda)*与已选片段的最大相似度 最高的片段。
+    relevance 为空时以与问题向量的余弦相似度作为相关度。
+    """
+    if len(doc_vectors) == 0:
+        return []
+    docs = doc_vectors / np.maximum(np.linalg.norm(doc_vectors, axis=1, keepdims=True), 1e-12)
+    if relevance is None:
+        query = query_vector / max(np.linalg.norm(query_vector), 1e-12)
+        relevance = docs @ query
+    similarity = docs @ docs.T
+
+    selected = [int(np.argmax(relevance))]
+    redundancy = similarity[selected[0]].copy()
+    candidates = np.ones(len(docs), dtype=bool)
+    candidates[selected[0]] = False
+    while len(selected) < min(k, len(docs)):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~candidates] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        candidates[best] = False
+        np.maximum(redundancy, similarity[best], out=redundancy)
+    return selected
+
+
+class Reranker(object):
+
+    def __init__(
+        self,
+        method: str = "mmr",
+        top_k: int = 6,
+        over_fetch: int = 3,
+        mmr_lambda: float = 0.7,
+        cross_encoder: Optional[str] = None,
+    ):
+        if method not in RERANK_METHODS:
+            raise ValueError(f"不支持的重排序方式: {method}")
+        if method == "cross-encoder" and (not cross_encoder or CrossEncoder is None):
+            print("未配置 cross-encoder 模型或未安装 sentence-transformers，重排序退回 MMR")
+            method = "mmr"
+        self.method = method
+        self.top_k = top_k
+        self._over_fetch = max(1, over_fetch)
+        self._mmr_lambda = mmr_lambda
+        self._cross_encoder = cross_encoder
+
+    @classmethod
+    def from_config(cls) -> "Reranker":
+        config = Config.get_instance().get_with_default({}, "retrieval", "rerank") or {}
+        return cls(
+            method=config.get("method", "mmr"),
+            top_k=config.get("top-k", 6),
+            over_fetch=config.get("over-fetch", 3),
+            mmr_lambda=config.get("mmr-lambda", 0.7),
+            cross_encoder=config.get("cross-encoder") or None,
+        )
+
+    @property
+    def fetch_k(self) -> int:
+        """从检索器获取的候选数"""
+        return self.top_k if self.method == "none" else self.top_k * self._over_fetch
+
+    def _cross_encoder_scores(self, query: str, docs: List[Document]) -> np.ndarray:
+        model = get_registry().get(
+            f"cross-encoder:{self._cross_encoder}", lambda: CrossEncoder(self._cross_encoder)
+        )
+        logits = model.predict([(query, doc.page_content) for doc in docs])
+        # 转换到 0~1，与检索分数一样越大越相关，便于拼接上下文时按比例过滤
+        return np.array([1 / (1 + math.exp(-float(x))) for x in logits], dtype=np.float32)
+
+    @staticmethod
+    def _doc_vectors(docs: List[Document], embedding, dim: int) -> np.ndarray:
+        """
+        使用检索时从索引中取出的块向量；只由 BM25 命中的块、无法取出向量的索引，
+        以及迁移期间旧模型的向量（维度与当前模型不同）才重新向量化
+        """
+        vectors = [doc.metadata.get(VECTOR_KEY) for doc in docs]
+        missing = [i for i, vector in enumerate(vectors) if vector is None or len(vector) != dim]
+        if missing:
+            embedded = embedding.embed_documents([docs[i].page_content for i in missing])
+            for i, vector in zip(missing, embedded):
+                vectors[i] = vector
+        return np.asarray(vectors, dtype=np.float32)
+
+    def rerank(self, query: str, docs: List[Document]) -> List[Document]:
+        """选出 top_k 个片段，返回的文档不再带有检索时附带的向量"""
+        if self.method == "none" or len(docs) <= 1:
+            return [_without_vector(doc) for doc in docs[: self.top_k]]
+
+        embedding = get_embedding()
+        query_vector = np.asarray(embedding.embed_query(query), dtype=np.float32)
+        doc_vectors = self._doc_vectors(docs, embedding, len(query_vector))
+
+        relevance = None
+        if self.method == "cross-encoder":
+            relevance = self._cross_encoder_scores(query, docs)
+            docs = [with_score(doc, float(score), "cross-encoder") for doc, score in zip(docs, relevance)]
+        order = mmr_select(query_vector, doc_vectors, self.top_k, self._mmr_lambda, relevance)
+        return [_without_vector(docs[i]) for i in order]
+
+
+def _without_vector(doc: Document) -> Document:
+    if VECTOR_KEY not in doc.metadata:
+        return doc
+    metadata = {key: value for key, value in doc.metadata.items() if key != VECTOR_KEY}
+    return Document(id=doc.id, page_content=doc.page_content, metadata=metadata)
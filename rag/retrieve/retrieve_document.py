@@ -1,13 +1,49 @@
 from typing import List,Tuple
 from langchain_core.documents import Document
-from model.RAG.retrieve_service import retrieve
+from config.config import Config
+from model.RAG.chunker import PARENT_KEY
+from model.RAG.retrieve_service import parent_documents, retrieve
+from model.RAG.scored_retriever import with_score
+from rag.retrieve.context_packer import ContextPacker
+from rag.retrieve.reranker import Reranker
 
 def format_docs(docs:List[Document]):
     return "\n-------------分割线--------------\n".join(doc.page_content for doc in docs)
 
+def with_parent_context(docs:List[Document], min_hits:int=2)->List[Document]:
+    """同一章节命中至少 min_hits 个块时，把这些块换成整节内容，放在其中第一个块的位置，分数取这些块的最高分"""
+    scores, score_types = {}, {}
+    for doc in docs:
+        parent_id = doc.metadata.get(PARENT_KEY)
+        if parent_id:
+            scores.setdefault(parent_id, []).append(doc.metadata.get("score", 0.0))
+            score_types.setdefault(parent_id, doc.metadata.get("score_type", "similarity"))
+    wanted = [parent_id for parent_id, hits in scores.items() if len(hits) >= max(1, min_hits)]
+    if not wanted:
+        return docs
+    parents = parent_documents(wanted)
+    result = []
+    for doc in docs:
+        parent_id = doc.metadata.get(PARENT_KEY)
+        if parent_id not in parents:
+            result.append(doc)
+        elif parent_id in scores:
+            result.append(
+                with_score(parents[parent_id], max(scores.pop(parent_id)), score_types[parent_id])
+            )
+    return result
+
 def retrieve_docs(question:str)->Tuple[List[Document],str]:
-    docs = retrieve(question) # 这里的到的是文件
-    _context = format_docs(docs) # 这里处理成文本
+    reranker = Reranker.from_config()
+    docs = retrieve(question, k=reranker.fetch_k) # 这里的到的是文件，重排序时会多取若干倍候选
+    # 去掉内容相近的片段（MMR），或用 cross-encoder 重新打分后再选出 top-k
+    docs = reranker.rerank(question, docs)
+    # 检索到的小块属于同一章节时换成整节内容，只命中一个块时仍使用小块
+    min_hits = Config.get_instance().get_with_default(2, "retrieval", "parent-context", "min-hits")
+    if min_hits:
+        docs = with_parent_context(docs, min_hits)
+    # 按分数过滤、去重并按当前模型的token预算截断后处理成文本
+    docs, _context = ContextPacker.for_model().pack(docs)
     print(_context)
     return (docs,_context)
     
\ No newline at end of file